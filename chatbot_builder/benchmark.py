@@ -0,0 +1,438 @@
+import os
+import re
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+from chatbot_builder.bot_builder import BotBuilder, find_response
+from chatbot_builder.bot_builder_cli import BotBuilderCLI
+from chatbot_builder.pattern_dict import PatternDict
+from chatbot_builder.rcu import ConcurrentBot
+from chatbot_builder import compiler
+
+def build_bot(num_patterns, num_contexts, seed=None):
+    """
+    Build a bot with 'num_patterns' literal-prefixed patterns in the main
+    context, and 'num_contexts' top-level contexts with a few patterns each
+
+    :return: tuple of the form (builder, texts), where 'texts' is a list of \
+        messages that match patterns in the bot
+    """
+    rnd = random.Random(seed)
+    builder = BotBuilder()
+    texts = []
+
+    for i in range(num_patterns):
+        builder.add_response("word%d (.*)" % i, "response %d {p0}" % i)
+        texts.append("word%d %d" % (i, rnd.randint(0, 1000)))
+
+    for i in range(num_contexts):
+        builder.unload_context()
+        builder.add_context("context%d" % i)
+        builder.add_entry("enter context %d" % i, "entered %d" % i)
+        builder.add_response("inside (.*)", "inside %d {p0}" % i)
+        texts.append("enter context %d" % i)
+
+    builder.unload_context()
+    texts.append("no match here")
+    return builder, texts
+
+def _run_threads(num_readers, duration, read, write, write_interval):
+    # Run 'num_readers' threads calling read(rnd) in a loop, and one thread
+    # calling write(i) every 'write_interval' seconds, for 'duration' seconds.
+    # Returns (total reads, total writes, worst read latency)
+    stop = threading.Event()
+    reads = [0] * num_readers
+    worst = [0.0] * num_readers
+    writes = [0]
+
+    def reader(index):
+        rnd = random.Random(index)
+        count = 0
+        slowest = 0.0
+        while not stop.is_set():
+            start = time.perf_counter()
+            read(rnd)
+            slowest = max(slowest, time.perf_counter() - start)
+            count += 1
+
+        reads[index] = count
+        worst[index] = slowest
+
+    def writer():
+        i = 0
+        while not stop.wait(write_interval):
+            write(i)
+            i += 1
+
+        writes[0] = i
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(num_readers)]
+    if write_interval > 0:
+        threads.append(threading.Thread(target=writer))
+
+    for t in threads:
+        t.start()
+
+    time.sleep(duration)
+    stop.set()
+
+    for t in threads:
+        t.join()
+
+    return sum(reads), writes[0], max(worst)
+
+def bench_rcu(num_readers, duration, num_patterns, num_contexts, write_interval):
+    """
+    Readers look up responses in the published version of a ConcurrentBot,
+    while a writer adds and removes patterns
+    """
+    builder, texts = build_bot(num_patterns, num_contexts, 1)
+    bot = ConcurrentBot(builder)
+
+    def read(rnd):
+        bot.lookup(rnd.choice(texts))
+
+    def write(i):
+        if i % 2:
+            bot.edit(BotBuilder.delete_response, "extra%d" % (i - 1))
+        else:
+            bot.edit(BotBuilder.add_response, "extra%d" % i, "extra")
+
+    return _run_threads(num_readers, duration, read, write, write_interval)
+
+def bench_locked(num_readers, duration, num_patterns, num_contexts, write_interval):
+    """
+    Readers and the writer share one BotBuilder, protected by a single lock
+    """
+    builder, texts = build_bot(num_patterns, num_contexts, 1)
+    lock = threading.Lock()
+
+    def read(rnd):
+        text = rnd.choice(texts)
+        with lock:
+            find_response(builder, None, text)
+
+    def write(i):
+        with lock:
+            if i % 2:
+                builder.delete_response("extra%d" % (i - 1))
+            else:
+                builder.add_response("extra%d" % i, "extra")
+
+            # Compile while holding the lock, as the next reader would
+            builder.responses.compile()
+
+    return _run_threads(num_readers, duration, read, write, write_interval)
+
+BENCHMARKS = {
+    "rcu": bench_rcu,
+    "locked": bench_locked
+}
+
+def run_concurrency(args):
+    print("%-8s %8s %12s %10s %16s" % ("mode", "readers", "reads/sec", "writes",
+                                       "worst read (ms)"))
+
+    for mode in args.modes:
+        for readers in args.threads:
+            reads, writes, worst = BENCHMARKS[mode](readers, args.duration, args.patterns,
+                                                    args.contexts, args.write_interval)
+            print("%-8s %8d %12.0f %10d %16.3f"
+                  % (mode, readers, reads / args.duration, writes, worst * 1000.0))
+
+def _zipf_texts(texts, exponent, count, rnd):
+    # 'count' texts where the i'th text is chosen with weight 1 / (i + 1)^exponent
+    weights = [1.0 / ((i + 1) ** exponent) for i in range(len(texts))]
+    return rnd.choices(texts, weights=weights, k=count)
+
+def bench_ordering(num_patterns, adaptive, exponent, warmup, lookups):
+    """
+    Look up texts in a single PatternDict, where the most frequently matched
+    patterns were added last (the worst case for the stored order)
+
+    :return: tuple of the form (lookups per second, mean chunks tried)
+    """
+    rnd = random.Random(1)
+    patterns = PatternDict()
+    patterns.adaptive = adaptive
+    texts = []
+
+    for i in range(num_patterns):
+        patterns["word%d (.*)" % i] = i
+        texts.insert(0, "word%d %d" % (i, rnd.randint(0, 1000)))
+
+    patterns["(.*)"] = None
+
+    for text in _zipf_texts(texts, exponent, warmup, rnd):
+        patterns.lookup(text)
+
+    sample = _zipf_texts(texts, exponent, lookups, rnd)
+    start = time.perf_counter()
+    for text in sample:
+        patterns.lookup(text)
+
+    secs = time.perf_counter() - start
+
+    # Counting chunks also counts hits, so measure it on a frozen copy
+    frozen = patterns.frozen()
+    chunks = sum([frozen.traced_lookup(text)[1] for text in sample])
+    return lookups / secs, float(chunks) / lookups
+
+def run_ordering(args):
+    print("%10s %10s %12s %12s" % ("patterns", "adaptive", "lookups/sec", "mean chunks"))
+
+    for num_patterns in args.patterns:
+        for adaptive in [False, True]:
+            rate, chunks = bench_ordering(num_patterns, adaptive, args.exponent,
+                                          args.warmup, args.lookups)
+            print("%10d %10s %12.0f %12.2f" % (num_patterns, adaptive, rate, chunks))
+
+def _best_start_time(json_filename, load_compiled, text, repeat):
+    # Patterns are compiled when first used, so time the first response too
+    best = None
+    for _ in range(repeat):
+        re.purge()
+        start = time.perf_counter()
+        cli = BotBuilderCLI(json_filename, load_compiled=load_compiled)
+        cli.process_message(text)
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+
+    return best, cli
+
+def bench_compiled(num_patterns, num_contexts, lookups, repeat):
+    """
+    Compare a bot loaded from its .json file with the same bot loaded from its
+    compiled module, for time to the first response and response throughput
+
+    :return: tuple of the form (compile seconds, results), where 'results' is \
+        a list of tuples of the form (mode, start seconds, responses per second)
+    """
+    json_dir = tempfile.mkdtemp(prefix="chatbot_builder_bench_")
+    json_filename = os.path.join(json_dir, "bot.json")
+
+    try:
+        builder, texts = build_bot(num_patterns, num_contexts, seed=1)
+        with open(json_filename, 'w') as fh:
+            json.dump(builder.to_json(), fh)
+
+        start = time.perf_counter()
+        compiler.compile_file(json_filename)
+        compile_secs = time.perf_counter() - start
+
+        # Unique texts, so that the lookup cache doesn't help
+        rnd = random.Random(1)
+        sample = ["%s %d" % (rnd.choice(texts), i) for i in range(lookups)]
+
+        ret = []
+        for mode, load_compiled in [("json", False), ("compiled", True)]:
+            start_secs, cli = _best_start_time(json_filename, load_compiled, texts[-1],
+                                               repeat)
+            start = time.perf_counter()
+            for text in sample:
+                cli.process_message(text)
+
+            ret.append((mode, start_secs, lookups / (time.perf_counter() - start)))
+
+        return compile_secs, ret
+    finally:
+        shutil.rmtree(json_dir)
+
+def run_compiled(args):
+    print("%10s %10s %12s %14s" % ("patterns", "mode", "start (ms)", "responses/sec"))
+
+    for num_patterns in args.patterns:
+        compile_secs, results = bench_compiled(num_patterns, args.contexts, args.lookups,
+                                               args.repeat)
+        for mode, start_secs, rate in results:
+            print("%10d %10s %12.2f %14.0f" % (num_patterns, mode, start_secs * 1000.0, rate))
+
+        print("%10d %10s %12.2f" % (num_patterns, "(compile)", compile_secs * 1000.0))
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def _serve_http(json_dir, queue):
+    # Runs the HTTP client in a separate process, and reports the port it is using
+    from chatbot_builder.clients.bot_cache import BotCache
+    from chatbot_builder.clients.http_client import BotBuilderHttpServer, HttpBotBuilderCLI
+
+    server = BotBuilderHttpServer(BotCache(HttpBotBuilderCLI, json_dir), "127.0.0.1", 0)
+
+    async def serve():
+        await server.start()
+        queue.put(server.port)
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+async def _http_connection(port, path, texts, batch, deadline, rnd, latencies):
+    # One keep-alive connection sending requests back to back until 'deadline'.
+    # Returns the number of messages sent.
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    sent = 0
+
+    try:
+        while time.perf_counter() < deadline:
+            if batch > 1:
+                body = json.dumps([rnd.choice(texts) for _ in range(batch)])
+            else:
+                body = json.dumps({"text": rnd.choice(texts)})
+
+            body = body.encode('utf-8')
+            start = time.perf_counter()
+            writer.write(("POST %s HTTP/1.1\r\nHost: localhost\r\n"
+                          "Content-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                          % (path, len(body))).encode('latin-1') + body)
+
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+
+            await reader.readexactly(length)
+            if not status.startswith(b'HTTP/1.1 200'):
+                raise RuntimeError("Request failed: %s" % status.decode('latin-1').strip())
+
+            latencies.append(time.perf_counter() - start)
+            sent += batch
+    finally:
+        writer.close()
+
+    return sent
+
+async def _http_load(port, bot_id, texts, connections, batch, duration):
+    path = "/bots/%s/%s" % (bot_id, "batch" if batch > 1 else "messages")
+    deadline = time.perf_counter() + duration
+    latencies = []
+
+    sent = await asyncio.gather(*[
+        _http_connection(port, path, texts, batch, deadline, random.Random(i), latencies)
+        for i in range(connections)])
+
+    return sum(sent), latencies
+
+def run_http(args):
+    builder, texts = build_bot(args.patterns, args.contexts, 1)
+    json_dir = tempfile.mkdtemp(prefix="chatbot_builder_bench_")
+    bot_id = "bench"
+
+    with open(os.path.join(json_dir, "%s.json" % bot_id), 'w') as fh:
+        json.dump(builder.to_json(), fh)
+
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve_http, args=(json_dir, queue), daemon=True)
+    server.start()
+
+    try:
+        port = queue.get(timeout=30)
+        best = None
+
+        print("%12s %8s %12s %12s %10s %10s" % ("connections", "batch", "requests/sec",
+                                               "messages/sec", "p50 (ms)", "p99 (ms)"))
+
+        for connections in args.connections:
+            sent, latencies = asyncio.run(_http_load(port, bot_id, texts, connections,
+                                                     args.batch, args.duration))
+            p99 = _percentile(latencies, 0.99) * 1000.0
+            print("%12d %8d %12.0f %12.0f %10.3f %10.3f"
+                  % (connections, args.batch, len(latencies) / args.duration,
+                     sent / args.duration, _percentile(latencies, 0.5) * 1000.0, p99))
+
+            if (p99 <= args.max_latency) and ((best is None) or (sent > best[1])):
+                best = (connections, sent)
+
+        if best is None:
+            print("\nNo run had a p99 latency under %.1fms" % args.max_latency)
+        else:
+            print("\nBest throughput with p99 latency under %.1fms: %.0f messages/sec "
+                  "with %d connection(s)" % (args.max_latency, best[1] / args.duration, best[0]))
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(json_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for chatbot_builder")
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    p = subparsers.add_parser("concurrency", help="Read throughput with concurrent "
+                              "writes, for read-copy-update vs. a single lock")
+    p.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4, 8],
+                   help="Numbers of reader threads to test with")
+    p.add_argument('-d', '--duration', type=float, default=2.0,
+                   help="Seconds to run each test for")
+    p.add_argument('-p', '--patterns', type=int, default=500,
+                   help="Number of patterns in the main context")
+    p.add_argument('-c', '--contexts', type=int, default=20,
+                   help="Number of top-level contexts")
+    p.add_argument('-w', '--write-interval', type=float, default=0.01,
+                   help="Seconds between edits (0 for no edits)")
+    p.add_argument('-m', '--modes', nargs='+', default=list(BENCHMARKS.keys()),
+                   choices=list(BENCHMARKS.keys()), help="Modes to test")
+    p.set_defaults(func=run_concurrency)
+
+    p = subparsers.add_parser("http", help="Requests per second and latency for the "
+                              "HTTP client, with keep-alive connections")
+    p.add_argument('-n', '--connections', type=int, nargs='+', default=[1, 4, 16, 64],
+                   help="Numbers of concurrent connections to test with")
+    p.add_argument('-b', '--batch', type=int, default=1,
+                   help="Messages per request (more than 1 uses the batch endpoint)")
+    p.add_argument('-d', '--duration', type=float, default=3.0,
+                   help="Seconds to run each test for")
+    p.add_argument('-l', '--max-latency', type=float, default=10.0,
+                   help="Report the best throughput with a p99 latency under "
+                   "this many milliseconds")
+    p.add_argument('-p', '--patterns', type=int, default=500,
+                   help="Number of patterns in the main context")
+    p.add_argument('-c', '--contexts', type=int, default=20,
+                   help="Number of top-level contexts")
+    p.set_defaults(func=run_http)
+
+    p = subparsers.add_parser("ordering", help="Lookup throughput with and without "
+                              "adaptive pattern ordering, for skewed traffic")
+    p.add_argument('-p', '--patterns', type=int, nargs='+', default=[100, 1000, 5000],
+                   help="Numbers of patterns to test with")
+    p.add_argument('-s', '--exponent', type=float, default=1.1,
+                   help="Zipf exponent for how often each pattern is matched")
+    p.add_argument('-w', '--warmup', type=int, default=20000,
+                   help="Number of lookups before measuring")
+    p.add_argument('-n', '--lookups', type=int, default=20000,
+                   help="Number of lookups to measure")
+    p.set_defaults(func=run_ordering)
+
+    p = subparsers.add_parser("compiled", help="Time to first response and throughput for "
+                              "bots loaded from .json files vs. compiled modules")
+    p.add_argument('-p', '--patterns', type=int, nargs='+', default=[100, 1000, 5000],
+                   help="Numbers of patterns in the main context to test with")
+    p.add_argument('-c', '--contexts', type=int, default=20,
+                   help="Number of top-level contexts")
+    p.add_argument('-n', '--lookups', type=int, default=20000,
+                   help="Number of messages to send to each bot")
+    p.add_argument('-r', '--repeat', type=int, default=3,
+                   help="Start each bot this many times, and report the fastest")
+    p.set_defaults(func=run_compiled)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
+import sys
 import random
+import time
+from collections.abc import Mapping
 
-from chatbot_utils.redict import ReDict
+from chatbot_builder.pattern_dict import PatternDict
+from chatbot_builder.lookup_cache import LookupCache, LookupResult
+from chatbot_builder.entry_index import EntryIndex
+from chatbot_builder.normalize import Normalizer
+from chatbot_builder.prefilter import MatchSummary
+from chatbot_builder import memory
+from chatbot_builder import constants as const
 
 CONTEXT_NAME_SEP = '::'
 
@@ -10,39 +19,209 @@ RESP_KEY = "responses"
 VARS_KEY = "variables"
 DEFAULT_RESP_KEY = "default_responses"
 CTX_KEY = "contexts"
+GLOBAL_ENTRY_KEY = "global_entry"
+NORMALIZE_KEY = "normalize"
 
-def _check_get_response(responsedict, text):
-    try:
-        response = responsedict[text]
-    except KeyError:
-        return None, None
+def _traced_lookup(patterns, text, trace, store):
+    if trace is None:
+        return patterns.lookup(text)
 
-    return response, responsedict.groups()
+    start = time.perf_counter()
+    ret, chunks = patterns.traced_lookup(text)
+    trace.step(store, time.perf_counter() - start, chunks,
+               None if ret is None else ret[0])
+    return ret
 
-def _attempt_context_entry(contexts, text):
+def _check_get_response(responsedict, text, trace=None, store=None):
+    ret = _traced_lookup(responsedict, text, trace, store)
+    if ret is None:
+        return None, None, None
+
+    pattern, response, groups = ret
+    return response, groups, pattern
+
+def _attempt_context_entry(contexts, text, trace=None):
     for name in contexts:
         context = contexts[name]
-        response, groups = _check_get_response(context.entry, text)
+        ret = _traced_lookup(context.entry, text, trace, "entry:%s" % name)
+        if ret is not None:
+            pattern, response, groups = ret
+            return context, response, groups, pattern
+
+    return None, None, None, None
+
+def _global_context_entry(bot, text, trace):
+    ret = _traced_lookup(bot.entry_index.build(bot), text, trace, "entry:*")
+    if ret is None:
+        return None, None, None, None
+
+    pattern, (context, response), groups = ret
+    return context, response, groups, pattern
+
+def find_response(bot, context, text, trace=None):
+    """
+    Find the response for some text, without changing anything
+
+    :param bot: BotBuilder instance, or a published chatbot_builder.rcu.BotVersion
+    :param context: responding context to start in, or None for the main context
+    :param str text: text to find a response for
+    :param chatbot_builder.tracing.Trace trace: if not None, each pattern \
+        dict tried is recorded in this trace
+    :return: LookupResult instance
+    """
+    response = None
+    groups = None
+    pattern = None
+
+    # Normalized once, and shared by every pattern dict tried below
+    text = bot.normalizer.prepare(text)
+
+    # If currently in a context, try to get a response from the context
+    if context:
+        response, groups, pattern = _check_get_response(
+            context.responses, text, trace, "responses:%s" % context.name)
+        if response is None:
+            # Try entering subcontexts contained in current context, if any
+            newctx, response, groups, pattern = _attempt_context_entry(
+                context.contexts, text, trace)
+
+            if newctx is not None:
+                context = newctx
+
+    # If no contextual response is available, try to get a response from
+    # the dict of contextless responses
+    if response is None:
+        response, groups, pattern = _check_get_response(
+            bot.responses, text, trace, "responses")
         if response is not None:
-            return context, response, groups
+            # If we are currently in a context but only able to get a
+            # matching response from the contextless dict, set the current
+            # context to None
+            context = None
+        else:
+            # No contextless responses available, attempt context entry
+            if bot.global_entry:
+                newctx, response, groups, pattern = _global_context_entry(
+                    bot, text, trace)
+            else:
+                newctx, response, groups, pattern = _attempt_context_entry(
+                    bot.contexts, text, trace)
+
+            if newctx is not None:
+                context = newctx
+
+    return LookupResult(response, groups, pattern, context)
+
+def _insert_at(d, index, key, value):
+    items = list(d.items())
+    items.insert(index, (key, value))
+    d.clear()
+    d.update(items)
+
+def _same_patterns(a, b):
+    return list(a.iteritems()) == list(b.iteritems())
+
+def _merge_context(old, new, parent):
+    # Returns 'old' if nothing under it has changed. Otherwise returns 'new',
+    # re-using any pattern dicts from 'old' that have not changed, so that
+    # their compiled regular expressions are kept.
+    if old is None:
+        return new
+
+    contexts = {}
+    for name in new.contexts:
+        contexts[name] = _merge_context(old.contexts.get(name, None), new.contexts[name], new)
+
+    unchanged = ((old.name == new.name) and (old.variables == new.variables) and
+                 (list(old.contexts.keys()) == list(contexts.keys())) and
+                 all([old.contexts[n] is contexts[n] for n in contexts]))
+
+    if _same_patterns(old.entry, new.entry):
+        new.entry = old.entry
+    else:
+        unchanged = False
+
+    if _same_patterns(old.responses, new.responses):
+        new.responses = old.responses
+    else:
+        unchanged = False
+
+    if unchanged:
+        ret = old
+    else:
+        ret = new
+        new.contexts = contexts
+
+    # Merged subcontexts were given 'new' as their parent, which is discarded
+    # if 'old' is kept
+    ret.parent = parent
+    for name in contexts:
+        contexts[name].parent = ret
+
+    return ret
+
+def _context_label(context):
+    if context is None:
+        return "main context"
+
+    return "context '%s'" % context.name
 
-    return None, None, None
+class VariableScope(Mapping):
+    """
+    Read-only view of the variables visible from a context: the context's own
+    variables first, then those of each parent context, then the variables of
+    the main context. Nothing is copied; each lookup searches the chain.
+    """
+    def __init__(self, builder, context):
+        self.layers = []
+        while context is not None:
+            self.layers.append(context.variables)
+            context = context.parent
+
+        self.layers.append(builder.variables)
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if name in layer:
+                return layer[name]
+
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        for layer in self.layers:
+            if name in layer:
+                return True
+
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for layer in self.layers:
+            for name in layer:
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def __len__(self):
+        return len(set().union(*self.layers))
 
 class BotContext(object):
     def __init__(self, name):
-        self.entry = ReDict()
-        self.responses = ReDict()
+        self.entry = PatternDict()
+        self.responses = PatternDict()
         self.contexts = {}
         self.variables = {}
         self.name = name
+        self.parent = None
 
     def add_entry_phrase(self, pattern, response):
-        self.entry[pattern] = response
+        return self.entry.add(pattern, response)
 
     def add_context(self, context_name, context, overwrite=False):
         if (not overwrite) and (context_name in self.contexts):
             return None
 
+        context.parent = self
         self.contexts[context_name] = context
         return context
 
@@ -50,13 +229,24 @@ class BotContext(object):
         self.variables[name] = value
 
     def add_response(self, pattern, response):
-        self.responses[pattern] = response
+        return self.responses.add(pattern, response)
 
     def delete_response(self, pattern):
-        del self.responses[pattern]
+        return self.responses.remove(pattern)
 
     def get_response(self, text):
-        return _check_get_response(self.responses, text)
+        response, groups, _ = _check_get_response(self.responses, text)
+        return response, groups
+
+    def walk(self):
+        """
+        Generator yielding this context and all contexts underneath it
+        """
+        stack = [self]
+        while stack:
+            ctx = stack.pop()
+            yield ctx
+            stack.extend(ctx.contexts.values())
 
     def __str__(self):
         ret = ""
@@ -120,12 +310,36 @@ class BotContext(object):
 
 class BotBuilder(object):
     def __init__(self):
-        self.responses = ReDict()
+        self.responses = PatternDict()
         self.contexts = {}
         self.default_responses = ["I don't know what that means"]
         self.editing_context = None
         self.responding_context = None
         self.variables = {}
+        self.lookup_cache = LookupCache()
+
+        # If True, any context can be entered directly from any other context
+        self.global_entry = const.GLOBAL_CONTEXT_ENTRY
+        self.entry_index = EntryIndex()
+
+        # Normalization applied to message text, for patterns that start with
+        # const.NORMALIZED_PATTERN_PREFIX
+        self.normalizer = Normalizer()
+
+        # (lookup cache generation, MatchSummary) for the bot's patterns
+        self.summary = None
+
+        # Undo journal: list of (description, undo function) tuples, oldest first
+        self.journal = []
+        self.saved_position = 0
+
+        # Variables in each context (None for the main context) as they were
+        # last saved or loaded, since assignments in responses aren't journaled
+        self.saved_variables = {None: {}}
+
+        # Size counted towards the memory budget, as a memory.RunningTotal.
+        # None until first needed, then updated by each edit.
+        self.total = None
 
     def to_json(self):
         ret = {}
@@ -136,12 +350,25 @@ class BotBuilder(object):
         if self.variables:
             ret[VARS_KEY] = {n: self.variables[n] for n in self.variables}
 
+        if self.global_entry:
+            ret[GLOBAL_ENTRY_KEY] = True
+
+        if self.normalizer.options:
+            ret[NORMALIZE_KEY] = self.normalizer.options
+
         return ret
 
     def from_json(self, attrs):
         self.default_responses = []
-        self.responses = ReDict()
+        self.responses = PatternDict()
         self.contexts = {}
+        self.global_entry = const.GLOBAL_CONTEXT_ENTRY
+        self.normalizer = Normalizer()
+        self.lookup_cache.clear()
+        self.entry_index.invalidate()
+        self.journal = []
+        self.saved_position = 0
+        self.total = None
 
         if attrs:
             self.default_responses = attrs[DEFAULT_RESP_KEY]
@@ -154,6 +381,51 @@ class BotBuilder(object):
         if VARS_KEY in attrs:
             self.variables = {n: attrs[VARS_KEY][n] for n in attrs[VARS_KEY]}
 
+        if GLOBAL_ENTRY_KEY in attrs:
+            self.global_entry = attrs[GLOBAL_ENTRY_KEY]
+
+        if NORMALIZE_KEY in attrs:
+            self.normalizer = Normalizer(attrs[NORMALIZE_KEY])
+
+        self._save_variables()
+
+        if self.editing_context:
+            self.editing_context = self._context_by_name(self.editing_context.name)
+
+        if self.responding_context:
+            self.responding_context = self._context_by_name(self.responding_context.name)
+
+        return self
+
+    def merge(self, other):
+        """
+        Replace the contents of this bot with the contents of another BotBuilder
+        instance, keeping contexts and compiled patterns that have not changed.
+        The editing and responding contexts are kept if they still exist.
+        Unsaved changes and undo history are discarded.
+
+        :param BotBuilder other: bot to take the new contents from
+        """
+        contexts = {}
+        for name in other.contexts:
+            contexts[name] = _merge_context(self.contexts.get(name, None),
+                                            other.contexts[name], None)
+
+        if not _same_patterns(self.responses, other.responses):
+            self.responses = other.responses
+
+        self.contexts = contexts
+        self.variables = other.variables
+        self.default_responses = other.default_responses
+        self.global_entry = other.global_entry
+        self.normalizer = other.normalizer
+        self.lookup_cache.clear()
+        self.entry_index.invalidate()
+        self.journal = []
+        self.saved_position = 0
+        self.total = None
+        self._save_variables()
+
         if self.editing_context:
             self.editing_context = self._context_by_name(self.editing_context.name)
 
@@ -197,63 +469,500 @@ class BotBuilder(object):
                                   "No context loaded for responses. Using main context",
                                   self.responding_context)
 
+    def running_total(self):
+        """
+        Returns the size of this bot counted towards its memory budget, as a
+        chatbot_builder.memory.RunningTotal instance
+        """
+        if self.total is None:
+            self.total = memory.running_total(self)
+
+        return self.total
+
+    def _resize(self, patterns=0, contexts=0, size=0):
+        # Nothing to update if the bot has not been measured yet
+        if self.total is not None:
+            self.total.add(patterns, contexts, size)
+
+    def _record(self, description, undo, patterns=0, contexts=0, size=0):
+        # 'patterns', 'contexts' and 'size' are the change in size made by the
+        # edit, which is reversed when the edit is undone
+        self._resize(patterns, contexts, size)
+
+        if patterns or contexts or size:
+            edit_undo = undo
+
+            def undo():
+                edit_undo()
+                self._resize(-patterns, -contexts, -size)
+
+        self.journal.append((description, undo))
+
+        if len(self.journal) > const.UNDO_HISTORY_SIZE:
+            self.journal.pop(0)
+            self.saved_position -= 1
+
+    def undo(self, count=1):
+        """
+        Undo the most recent edits
+
+        :param int count: number of edits to undo
+        :return: list of descriptions of the edits that were undone, most recent first
+        """
+        ret = []
+        while self.journal and (len(ret) < count):
+            description, undo = self.journal.pop()
+            undo()
+            ret.append(description)
+
+        if len(self.journal) < self.saved_position:
+            # The saved state was undone, and new edits would not lead back to it
+            self.saved_position = -1
+
+        return ret
+
+    def mark_saved(self):
+        """
+        Mark the current state as saved, so 'drop_changes' can return to it
+        """
+        self.saved_position = len(self.journal)
+        self._save_variables()
+
+    def _save_variables(self):
+        self.saved_variables = {ctx: dict(ctx.variables) for ctx in self.walk()}
+        self.saved_variables[None] = dict(self.variables)
+
+    def has_unsaved_changes(self):
+        return len(self.journal) != self.saved_position
+
+    def drop_changes(self):
+        """
+        Undo all edits made since the last save, without accessing the disk.
+        Variables assigned by responses since the last save are also reset to
+        their saved values.
+
+        :return: False if the last saved state can no longer be reached by \
+            undoing edits (the caller must re-load from disk instead), True otherwise
+        """
+        if (self.saved_position < 0) or (self.saved_position > len(self.journal)):
+            return False
+
+        self.undo(len(self.journal) - self.saved_position)
+
+        # Updated in place, since undo functions refer to the same dicts
+        self.variables.clear()
+        self.variables.update(self.saved_variables[None])
+        for ctx in self.walk():
+            if ctx in self.saved_variables:
+                ctx.variables.clear()
+                ctx.variables.update(self.saved_variables[ctx])
+
+        self.total = None
+        return True
+
     def add_default_response(self, text):
         self.default_responses.append(text)
+        self._record("added default response '%s'" % text, self.default_responses.pop,
+                     size=memory.string_size(text))
+
+    def set_global_entry(self, enabled):
+        """
+        Enable or disable global entry mode. In global entry mode, if nothing in
+        the responding context or the main context matches, the entry patterns
+        of every context in the bot are tried (shallowest contexts first), so
+        any context can be entered directly.
+        """
+        old = self.global_entry
+        self.global_entry = enabled
+        self.lookup_cache.clear()
+
+        def undo():
+            self.global_entry = old
+            self.lookup_cache.clear()
+
+        self._record("%s global context entry" % ("enabled" if enabled else "disabled"),
+                     undo)
+
+    def set_normalization(self, options):
+        """
+        Set the normalization applied to message text, for patterns that start
+        with const.NORMALIZED_PATTERN_PREFIX
+
+        :param list options: options to apply, from chatbot_builder.normalize.OPTIONS
+        :raises ValueError: if an option is not recognised
+        """
+        old = self.normalizer
+        self.normalizer = Normalizer(options)
+        self.lookup_cache.clear()
+
+        def undo():
+            self.normalizer = old
+            self.lookup_cache.clear()
+
+        self._record("set normalization to '%s'"
+                     % (" ".join(self.normalizer.options) or "off"), undo)
+
+    def variable_scope(self, context):
+        """
+        Returns a read-only view of the variables visible from a context
+
+        :param BotContext context: context to look up variables from, or None \
+            for the main context
+        :return: VariableScope instance
+        """
+        return VariableScope(self, context)
+
+    def assign_variable(self, name, value, budget=None):
+        """
+        Set a variable in the responding context. Used for variable assignments
+        in responses, so the change is not recorded in the undo journal, but
+        'drop_changes' still resets it to its saved value.
+
+        :param str name: variable name
+        :param str value: variable value
+        :param chatbot_builder.memory.Budget budget: if not None, the variable \
+            is only set if this would not put the bot over budget
+        :return: description of the exceeded limit if the variable was not set, \
+            otherwise None
+        """
+        if self.responding_context is None:
+            variables = self.variables
+        else:
+            variables = self.responding_context.variables
+
+        size = memory.assignment_size(variables, name, value)
+        if budget is not None:
+            error = budget.check(self, size=size)
+            if error is not None:
+                return error
+
+        container = sys.getsizeof(variables)
+        variables[name] = value
+        self._resize(size=size + sys.getsizeof(variables) - container)
+        return None
 
     def add_variable(self, name, value):
         if self.editing_context is None:
-            self.variables[name] = value
+            variables = self.variables
+        else:
+            variables = self.editing_context.variables
+
+        missing = name not in variables
+        old = variables.get(name, None)
+        size = memory.assignment_size(variables, name, value) - sys.getsizeof(variables)
+        variables[name] = value
+        size += sys.getsizeof(variables)
+
+        def undo():
+            if missing:
+                del variables[name]
+            else:
+                variables[name] = old
+
+        self._record("set format token '%s' in %s"
+                     % (name, _context_label(self.editing_context)), undo, size=size)
+
+    def _invalidate_responses(self, context):
+        # Responses in the main context may be tried from any responding context
+        if context is None:
+            self.lookup_cache.clear()
+        else:
+            self.lookup_cache.invalidate(context)
+
+    def _invalidate_entry(self, context):
+        # Entry phrases for top-level contexts (or any context, in global entry
+        # mode) may be tried from any responding context, entry phrases for
+        # subcontexts only from the parent context
+        self.entry_index.invalidate()
+        if (context.parent is None) or self.global_entry:
+            self.lookup_cache.clear()
         else:
-            self.editing_context.add_variable(name, value)
+            self.lookup_cache.invalidate(context.parent)
+
+    def _invalidate_removed(self, context):
+        self._invalidate_entry(context)
+        for ctx in context.walk():
+            self.lookup_cache.invalidate(ctx)
 
     def add_context(self, context_name, overwrite=False):
 
         if self.editing_context is None:
             full_name = context_name
+            parent = self
         else:
             full_name = CONTEXT_NAME_SEP.join([self.editing_context.name, context_name])
+            parent = self.editing_context
 
         c = BotContext(full_name)
+        old = parent.contexts.get(context_name, None)
+        container = sys.getsizeof(parent.contexts)
 
         if self.editing_context is None:
-            if (not overwrite) and (context_name in self.contexts):
+            if (not overwrite) and (old is not None):
                 return None
 
             self.contexts[context_name] = c
-            self.editing_context = c
-            return c
+        else:
+            ret = self.editing_context.add_context(context_name, c, overwrite)
+            if ret is None:
+                return None
 
-        ret = self.editing_context.add_context(context_name, c, overwrite)
-        if ret is None:
-            return None
+        if old is not None:
+            self._invalidate_removed(old)
 
+        editing = self.editing_context
         self.editing_context = c
+
+        added = memory.measure_context(c)
+        removed = memory.measure_context(old) if old is not None else memory.MemoryUsage()
+
+        def undo():
+            if old is None:
+                del parent.contexts[context_name]
+            else:
+                parent.contexts[context_name] = old
+
+            self._invalidate_removed(c)
+
+            # Go back to the previous editing context only if the editing
+            # context is being removed
+            removed = [ctx for ctx in c.walk() if ctx is self.editing_context]
+            self._forget_removed(c)
+            if removed:
+                self.editing_context = editing
+
+        self._record("created %s" % _context_label(c), undo,
+                     added.patterns - removed.patterns, added.contexts - removed.contexts,
+                     added.budgeted() - removed.budgeted()
+                     + sys.getsizeof(parent.contexts) - container)
         return c
 
     def add_entry(self, pattern, response):
         if self.editing_context is None:
             return None
 
-        self.editing_context.add_entry_phrase(pattern, response)
-        return self.editing_context
+        context = self.editing_context
+        container = sys.getsizeof(context.entry.patterns)
+        groupname = context.add_entry_phrase(pattern, response)
+        self._invalidate_entry(context)
+
+        if groupname is not None:
+            def undo():
+                context.entry.remove_group(groupname)
+                self._invalidate_entry(context)
+
+            self._record("added entry pattern '%s' to %s"
+                         % (pattern, _context_label(context)), undo, 1, 0,
+                         memory.pair_size(groupname, pattern, response)
+                         + sys.getsizeof(context.entry.patterns) - container)
+
+        return context
 
     def add_response(self, pattern, response):
-        if self.editing_context is None:
-            self.responses[pattern] = response
+        context = self.editing_context
+        if context is None:
+            responses = self.responses
+        else:
+            responses = context.responses
+
+        container = sys.getsizeof(responses.patterns)
+        groupname = responses.add(pattern, response)
+        self._invalidate_responses(context)
+
+        if groupname is not None:
+            def undo():
+                responses.remove_group(groupname)
+                self._invalidate_responses(context)
+
+            self._record("added pattern '%s' to %s"
+                         % (pattern, _context_label(context)), undo, 1, 0,
+                         memory.pair_size(groupname, pattern, response)
+                         + sys.getsizeof(responses.patterns) - container)
+
+    def add_patterns(self, context, is_entry, pairs):
+        """
+        Add many pattern/response pairs to one pattern dict, as a single edit
+        that can be undone at once. Lookup caches are invalidated once, after
+        all pairs have been added.
+
+        :param BotContext context: context to add to, or None for the main context
+        :param bool is_entry: if True, add entry patterns instead of responses
+        :param pairs: iterable of (pattern, response) tuples. Pairs are added as \
+            they are produced, so this may be a generator. If it raises an \
+            exception, the pairs already added are removed again.
+        :return: number of pairs added
+        """
+        if context is None:
+            if is_entry:
+                raise ValueError("The main context has no entry patterns")
+
+            store = self.responses
         else:
-            self.editing_context.add_response(pattern, response)
+            store = context.entry if is_entry else context.responses
+
+        def invalidate():
+            if is_entry:
+                self._invalidate_entry(context)
+            else:
+                self._invalidate_responses(context)
+
+        groupnames = []
+        size = -sys.getsizeof(store.patterns)
+
+        try:
+            for pattern, response in pairs:
+                groupname = store.add(pattern, response)
+                if groupname is not None:
+                    groupnames.append(groupname)
+                    size += memory.pair_size(groupname, pattern, response)
+        except BaseException:
+            # Nothing is added if 'pairs' fails part way through
+            if groupnames:
+                store.remove_groups(groupnames)
+
+            raise
+        finally:
+            invalidate()
+
+        size += sys.getsizeof(store.patterns)
+
+        if groupnames:
+            def undo():
+                store.remove_groups(groupnames)
+                invalidate()
+
+            self._record("imported %d %spattern(s) to %s"
+                         % (len(groupnames), "entry " if is_entry else "",
+                            _context_label(context)), undo, len(groupnames), 0, size)
+
+        return len(groupnames)
 
     def delete_response(self, pattern):
+        context = self.editing_context
+        if context is None:
+            responses = self.responses
+        else:
+            responses = context.responses
+
         try:
-            if self.editing_context is None:
-                del self.responses[pattern]
-            else:
-                self.editing_context.delete_response(pattern)
+            groupname, response, index = responses.remove(pattern)
         except KeyError:
             return None
 
+        self._invalidate_responses(context)
+
+        def undo():
+            responses.restore(groupname, pattern, response, index)
+            self._invalidate_responses(context)
+
+        self._record("deleted pattern '%s' from %s"
+                     % (pattern, _context_label(context)), undo, -1, 0,
+                     -memory.pair_size(groupname, pattern, response))
         return self
 
+    def _forget_removed(self, context):
+        # Unset the editing/responding context if it is part of a removed tree
+        for ctx in context.walk():
+            if self.editing_context is ctx:
+                self.editing_context = None
+
+            if self.responding_context is ctx:
+                self.responding_context = None
+
+    def prune(self, patterns, contexts):
+        """
+        Remove patterns and contexts in one batch, which can be undone as a
+        single edit
+
+        :param patterns: list of tuples of the form (context, is_entry, groupname)
+        :param contexts: list of BotContext instances to remove
+        """
+        undo_steps = []
+        editing = self.editing_context
+        responding = self.responding_context
+        removed = memory.MemoryUsage()
+
+        for context, is_entry, groupname in patterns:
+            if context is None:
+                store = self.responses
+            else:
+                store = context.entry if is_entry else context.responses
+
+            pattern, value, index = store.remove_group(groupname)
+            undo_steps.append((store, (groupname, pattern, value, index)))
+            removed.patterns += 1
+            removed.add(memory.CATEGORY_PATTERNS, memory.pair_size(groupname, pattern, value))
+
+            if is_entry:
+                self._invalidate_entry(context)
+            else:
+                self._invalidate_responses(context)
+
+        for context in contexts:
+            parent = self if context.parent is None else context.parent
+            names = list(parent.contexts.keys())
+            index = [parent.contexts[n] for n in names].index(context)
+
+            del parent.contexts[names[index]]
+            usage = memory.measure_context(context)
+            removed.patterns += usage.patterns
+            removed.contexts += usage.contexts
+            removed.add(memory.CATEGORY_CONTEXTS, usage.budgeted())
+            self._invalidate_removed(context)
+            self._forget_removed(context)
+            undo_steps.append((parent.contexts, (index, names[index], context)))
+
+        def undo():
+            for target, args in reversed(undo_steps):
+                if isinstance(target, PatternDict):
+                    target.restore(*args)
+                else:
+                    _insert_at(target, *args)
+
+            self.lookup_cache.clear()
+            self.entry_index.invalidate()
+            self.editing_context = editing
+            self.responding_context = responding
+
+        self._record("pruned %d pattern(s) and %d context(s)"
+                     % (len(patterns), len(contexts)), undo,
+                     -removed.patterns, -removed.contexts, -removed.budgeted())
+
+    def walk(self):
+        """
+        Generator yielding all contexts in this bot
+        """
+        for name in self.contexts:
+            for ctx in self.contexts[name].walk():
+                yield ctx
+
+    def pattern_dicts(self):
+        """
+        Generator yielding all pattern dicts in this bot, as tuples of the form
+        (context, is_entry, patterns). 'context' is None for the main context.
+        """
+        yield None, False, self.responses
+        for ctx in self.walk():
+            yield ctx, True, ctx.entry
+            yield ctx, False, ctx.responses
+
+    def match_summary(self):
+        """
+        Returns a chatbot_builder.prefilter.MatchSummary of all patterns in this
+        bot, rebuilt the next time it is needed after any lookups may have changed.
+        Each pattern dict keeps its own summary (see PatternDict.match_summary),
+        so only patterns added since the last rebuild are described.
+        """
+        generation = self.lookup_cache.generation
+        if (self.summary is None) or (self.summary[0] != generation):
+            summary = MatchSummary()
+            for _, _, patterns in self.pattern_dicts():
+                summary.merge(patterns.match_summary())
+
+            self.summary = (generation, summary)
+
+        return self.summary[1]
+
     def _context_by_name(self, context_name):
         fields = context_name.split(CONTEXT_NAME_SEP)
         curr = self
@@ -273,6 +982,13 @@ class BotBuilder(object):
 
         return curr
 
+    def find_context(self, context_name):
+        """
+        Returns the context with the given name (e.g. "a::b"), or None if there
+        is no such context
+        """
+        return self._context_by_name(context_name)
+
     def context_tree(self, context_name):
         ctx = self._context_by_name(context_name)
         if ctx is None:
@@ -318,57 +1034,77 @@ class BotBuilder(object):
 
         ctxname = fields[-1].strip()
 
-        if self.editing_context is curr.contexts[ctxname]:
-            self.editing_context = None
-
-        if self.responding_context is curr.contexts[ctxname]:
-            self.repsonding_context = None
-
         try:
-            del curr.contexts[ctxname]
+            ctx = curr.contexts[ctxname]
         except KeyError:
             return False
 
+        editing = self.editing_context
+        responding = self.responding_context
+        index = list(curr.contexts.keys()).index(ctxname)
+
+        if self.editing_context is ctx:
+            self.editing_context = None
+
+        if self.responding_context is ctx:
+            self.responding_context = None
+
+        self._invalidate_removed(ctx)
+        del curr.contexts[ctxname]
+        removed = memory.measure_context(ctx)
+
+        def undo():
+            _insert_at(curr.contexts, index, ctxname, ctx)
+            self._invalidate_removed(ctx)
+            if editing is ctx:
+                self.editing_context = editing
+
+            if responding is ctx:
+                self.responding_context = responding
+
+        self._record("deleted %s" % _context_label(ctx), undo, -removed.patterns,
+                     -removed.contexts, -removed.budgeted())
         return True
 
     def unload_context(self):
         self.editing_context = None
 
-    def get_response(self, text):
-        response = None
-        groups = None
+    def set_responding_context(self, context_name):
+        """
+        Set the responding context by name, or to the main context if
+        'context_name' is None
+        """
+        if context_name is None:
+            self.responding_context = None
+        else:
+            self.responding_context = self._context_by_name(context_name)
 
-        # If currently in a context, try to get a response from the context
-        if self.responding_context:
-            response, groups = self.responding_context.get_response(text)
-            if response is None:
-                # Try entering subcontexts contained in current context, if any
-                context, response, groups = _attempt_context_entry(
-                    self.responding_context.contexts, text)
+        return self.responding_context
 
-                if context is not None:
-                    self.responding_context = context
+    def _lookup(self, text, trace=None):
+        return find_response(self, self.responding_context, text, trace)
 
-        # If no contextual response is available, try to get a response from
-        # the dict of contextless responses
-        if response is None:
-            response, groups = _check_get_response(self.responses, text)
-            if response is not None:
-                # If we are currently in a context but only able to get a
-                # matching response from the contextless dict, set the current
-                # context to None
-                if self.responding_context:
-                    self.responding_context = None
-            else:
-                # No contextless responses available, attempt context entry
-                context, response, groups = _attempt_context_entry(
-                    self.contexts, text)
+    def lookup(self, text, trace=None):
+        """
+        Find the response for the given text, and update the responding context.
+        Results are cached per responding context.
 
-                if context is not None:
-                    self.responding_context = context
-                else:
-                    #response = random.choice(self.default_responses)
-                    response = None
-                    groups = None
+        :param str text: text to find a response for
+        :param chatbot_builder.tracing.Trace trace: if not None, each pattern \
+            dict tried is recorded in this trace
+        :return: LookupResult instance
+        """
+        ret = self.lookup_cache.get(self.responding_context, text)
+        if trace is not None:
+            trace.cached = ret is not None
 
-        return response, groups
+        if ret is None:
+            ret = self._lookup(text, trace)
+            self.lookup_cache.put(self.responding_context, text, ret)
+
+        self.responding_context = ret.context
+        return ret
+
+    def get_response(self, text):
+        ret = self.lookup(text)
+        return ret.response, ret.groups
@@ -1,11 +1,19 @@
 import os
-import re
 import traceback
 import json
 import time
+import threading
 
 from chatbot_builder.bot_builder import BotBuilder
 from chatbot_builder import constants as const
+from chatbot_builder import metrics
+from chatbot_builder import regex_lint
+from chatbot_builder import reachability
+from chatbot_builder import memory
+from chatbot_builder import compiler
+from chatbot_builder import bulk_import
+from chatbot_builder import normalize
+from chatbot_builder.profiler import Profiler
 
 # Command word definitions
 CMD_HELP = "help"
@@ -23,6 +31,13 @@ CMD_DROP = "drop"
 CMD_TREE = "tree"
 CMD_SETVAR = "set"
 CMD_GETVAR = "get"
+CMD_UNDO = "undo"
+CMD_LINT = "lint"
+CMD_PRUNE = "prune"
+CMD_PROFILE = "profile"
+CMD_MEMORY = "memory"
+CMD_GLOBAL = "global"
+CMD_NORMALIZE = "normalize"
 
 RESPONSE_FORMAT_TEXT = """
 ----- FORMAT TOKENS -----
@@ -148,9 +163,94 @@ This command saves all changes made since the last save operation.
 CMD_DROP_HELP = """
 {0}
 
-Drops all changes made since the last save operation.
+Drops all changes made since the last save operation. Variables assigned by
+responses (see "help on") since the last save are also reset to their saved
+values.
 """
 
+CMD_UNDO_HELP = """
+{0} [count]
+
+Undoes the last [count] changes (or only the last change, if [count] is not
+provided). Changes made before the last save operation can also be undone,
+up to a limit of %d changes.
+""" % const.UNDO_HISTORY_SIZE
+
+CMD_LINT_HELP = """
+{0}
+
+Shows all patterns in the bot that may take a very long time to match some
+messages (for example, patterns with nested repetition like "(a+)+"). Patterns
+like this can freeze the bot, and new ones are %s when added.
+""" % {regex_lint.POLICY_REJECT: "rejected",
+       regex_lint.POLICY_WARN: "allowed with a warning",
+       regex_lint.POLICY_REWRITE: "rewritten"}.get(const.REGEX_LINT_POLICY, "checked")
+
+CMD_PRUNE_HELP = """
+{0} [check]
+
+Deletes all patterns that can never match because an earlier pattern always
+matches first (for example, any pattern added after a catch-all pattern like
+"(.*)"), and all contexts that can never be entered. The bot's responses will
+not change. If "check" is provided, the patterns and contexts are only shown,
+not deleted.
+"""
+
+CMD_PROFILE_HELP = """
+{0} [count] [seconds]s
+
+Measures where the bot spends its time and memory while responding to the next
+[count] messages, or for the next [seconds] seconds (for example "%s 30s"),
+whichever comes first. Profiling stops by itself, and the results are saved to
+disk. If neither is provided, the next %d messages are profiled. Only the last
+%d results are kept.
+
+"{0} stop" stops profiling early. "{0}" on its own shows progress, or the
+results of the last profile once it has finished.
+""" % (CMD_PROFILE, const.PROFILE_DEFAULT_MESSAGES, const.PROFILE_MAX_DUMPS)
+
+CMD_MEMORY_HELP = """
+{0}
+
+Shows an estimate of how much memory the bot is using, and the limits on the
+number of patterns, number of contexts and memory use. Commands that would take
+the bot over any of these limits are rejected, and so are variable assignments in
+responses that would take the bot over the memory limit. Compiled patterns, the
+lookup cache and the undo history don't count towards the memory limit.
+"""
+
+CMD_GLOBAL_HELP = """
+{0} [on|off]
+
+Turns global context entry on or off. Normally, the bot can only enter top-level
+contexts, or subcontexts of the context it is currently responding with. With
+global context entry on, the entry patterns of every context are also tried
+(after the responses in the current context and the main context), so any
+context can be entered directly, no matter how deep it is. If neither "on" nor
+"off" is provided, shows whether global context entry is on.
+"""
+
+CMD_NORMALIZE_HELP = """
+{0} [off|option ...]
+
+Sets how message text is normalized before it is matched against patterns that
+start with "%s". For example, with "casefold punctuation whitespace" turned
+on, the pattern "%shello world" matches "Hello,   World!". Message text is
+only normalized once, no matter how many patterns need it, and groups in these
+patterns still give the original text. Since these patterns match normalized
+text, they should be written in normalized form (e.g. "ss" instead of "ß" with
+casefold on). Patterns that don't start with "%s" always match the original
+text. Options:
+
+%s
+
+"{0} off" turns normalization off. If no options are provided, shows the
+options that are on.
+""" % (const.NORMALIZED_PATTERN_PREFIX, const.NORMALIZED_PATTERN_PREFIX,
+       const.NORMALIZED_PATTERN_PREFIX,
+       "\n".join(["  %-12s %s" % (o, normalize.OPTION_DESCRIPTIONS[o])
+                  for o in normalize.OPTIONS]))
+
 CMD_TREE_HELP = """
 {0} [context_name]
 
@@ -162,6 +262,28 @@ DEFAULT_JSON = os.path.join(os.path.expanduser('~'), 'bot-builder-database.json'
 
 command_table = {}
 
+# Metrics
+_messages = metrics.registry.counter("chatbot_builder_messages_total",
+                                     "Messages processed, by outcome", ["outcome"])
+_messages_command = _messages.labels("command")
+_messages_match = _messages.labels("match")
+_messages_nomatch = _messages.labels("no_match")
+_messages_error = _messages.labels("error")
+
+_messages_prefiltered = metrics.registry.counter("chatbot_builder_messages_prefiltered_total",
+                                                 "Messages that couldn't match any pattern, "
+                                                 "rejected without a lookup")
+
+_match_seconds = metrics.registry.histogram("chatbot_builder_match_seconds",
+                                            "Time spent finding a matching response")
+_format_seconds = metrics.registry.histogram("chatbot_builder_format_seconds",
+                                             "Time spent formatting a matched response")
+_save_seconds = metrics.registry.histogram("chatbot_builder_save_seconds",
+                                           "Time spent saving a bot to disk")
+_file_access_rejected = metrics.registry.counter("chatbot_builder_file_access_rejected_total",
+                                                 "Save/drop commands rejected due to "
+                                                 "too much file access")
+
 class Command(object):
     def __init__(self, word, handler, helptext):
         self.word = word
@@ -225,11 +347,33 @@ def _split_args(text):
 
     return ret
 
+def _check_pattern(cli, pattern):
+    # Returns a tuple of the form (pattern, error, warning). 'pattern' may have
+    # been rewritten according to the lint policy.
+    return regex_lint.check_pattern(pattern, cli.lint_policy)
+
+def _with_warning(text, warning):
+    if warning is None:
+        return text
+
+    return "%s\n%s\n" % (text, warning)
+
 # Command handlers
+def _check_budget(cli, patterns=0, contexts=0, strings=()):
+    error = cli.budget.check(cli.builder, patterns, contexts, memory.string_size(*strings))
+    if error is None:
+        return None
+
+    return "Can't do that, %s" % error
+
 def _on_new(cli, args):
     if len(args) < 1:
         return "Please provide a context name"
 
+    error = _check_budget(cli, contexts=1, strings=args[:1])
+    if error is not None:
+        return error
+
     ctx = cli.builder.add_context(args[0])
     if ctx is None:
         return "Failed to add new context '%s'" % args[0]
@@ -240,33 +384,45 @@ def _on_entry(cli, args):
     if len(args) < 2:
         return "Please provide an entry pattern and repsonse"
 
-    ret = cli.builder.add_entry(args[0], args[1])
+    if cli.builder.editing_context is None:
+        return "No context is loaded for editing."
+
+    pattern, error, warning = _check_pattern(cli, args[0])
+    if error is None:
+        error = _check_budget(cli, patterns=1, strings=(pattern, args[1]))
+
+    if error is not None:
+        return error
+
+    ret = cli.builder.add_entry(pattern, args[1])
     if ret is None:
         return "No context is loaded for editing."
 
     ctxname = cli.builder.editing_context.name
-    return ("Added new entry pattern/response to %s:\n\npattern  : %s\n\nresponse : %s\n"
-            % (ctxname, args[0], args[1]))
+    return _with_warning("Added new entry pattern/response to %s:\n\npattern  : %s\n\n"
+                         "response : %s\n" % (ctxname, pattern, args[1]), warning)
 
 def _on_on(cli, args):
     if len(args) < 2:
         return "Please provide a pattern and a response"
 
     # Make sure a valid regex has been provided
-    try:
-        _ = re.compile(args[0])
-    except Exception:
-        return "Invalid regular expression"
+    pattern, error, warning = _check_pattern(cli, args[0])
+    if error is None:
+        error = _check_budget(cli, patterns=1, strings=(pattern, args[1]))
+
+    if error is not None:
+        return error
 
-    cli.builder.add_response(args[0], args[1])
+    cli.builder.add_response(pattern, args[1])
 
     if cli.builder.editing_context is None:
         ctxname = "main context"
     else:
         ctxname = "context '%s'" % cli.builder.editing_context.name
 
-    return ("Added new pattern/response to %s:\n\npattern  : %s\n\nresponse : %s\n"
-            % (ctxname, args[0], args[1]))
+    return _with_warning("Added new pattern/response to %s:\n\npattern  : %s\n\n"
+                         "response : %s\n" % (ctxname, pattern, args[1]), warning)
 
 def _on_forget(cli, args):
     if len(args) < 1:
@@ -325,12 +481,35 @@ def _on_save(cli, args):
     return "All changes saved"
 
 def _on_drop(cli, args):
+    if cli.builder.drop_changes():
+        return "All unsaved changes dropped"
+
+    # Too many changes to undo, re-load from disk
     if not cli.file_access_allowed():
         return "Too much file access, please wait a bit and try again"
 
     cli.load()
     return "All unsaved changes dropped"
 
+def _on_undo(cli, args):
+    count = 1
+    if len(args) > 0:
+        try:
+            count = int(args[0])
+        except ValueError:
+            count = 0
+
+        if count < 1:
+            return "Please provide a positive number of changes to undo"
+
+    undone = cli.builder.undo(count)
+    if not undone:
+        return "Nothing to undo"
+
+    ret = "Undid %d change(s):\n\n" % len(undone)
+    ret += "\n".join(["  %s" % d for d in undone])
+    return ret
+
 def _on_tree(cli, args):
     if len(args) < 1:
         return "Please provide name of context to get tree for"
@@ -341,6 +520,107 @@ def _on_tree(cli, args):
 
     return ret
 
+def _on_lint(cli, args):
+    risky = regex_lint.lint_bot(cli.builder)
+    if not risky:
+        return "No risky patterns found"
+
+    ret = "%d risky pattern(s) found:\n" % len(risky)
+    for context, is_entry, pattern, findings in risky:
+        ctxname = "main context" if context is None else "context '%s'" % context.name
+        kind = "entry pattern" if is_entry else "pattern"
+
+        ret += '\n%s in %s: "%s"\n' % (kind, ctxname, pattern)
+        ret += "\n".join(["  %s" % f for f in findings]) + "\n"
+
+    return ret
+
+def _on_prune(cli, args):
+    analysis = reachability.analyze(cli.builder)
+    if analysis.empty():
+        return "No shadowed patterns or unreachable contexts found"
+
+    if (len(args) > 0) and (args[0] == "check"):
+        return analysis.describe()
+
+    patterns = [(s.context, s.is_entry, s.groupname) for s in analysis.shadowed]
+    contexts = [u.context for u in analysis.unreachable]
+    cli.builder.prune(patterns, contexts)
+
+    return ("Deleted %d pattern(s) and %d context(s):\n\n%s"
+            % (len(patterns), len(contexts), analysis.describe()))
+
+def _on_profile(cli, args):
+    if len(args) == 0:
+        if cli.profiler is not None:
+            return cli.profiler.status()
+
+        if cli.profile_summary is None:
+            return "No profile results available"
+
+        return cli.profile_summary
+
+    if args[0] == "stop":
+        if cli.profiler is None:
+            return "Not profiling"
+
+        return cli.stop_profile()
+
+    if cli.profiler is not None:
+        return "Already profiling. %s" % cli.profiler.status()
+
+    messages = None
+    seconds = None
+
+    for arg in args:
+        try:
+            if arg.endswith("s"):
+                seconds = float(arg[:-1])
+            else:
+                messages = int(arg)
+        except ValueError:
+            return "Invalid message count or duration '%s'" % arg
+
+    if (((messages is not None) and (messages < 1)) or
+            ((seconds is not None) and not (0 < seconds < float('inf')))):
+        return "Please provide a positive message count or duration"
+
+    # Profile results are written to disk
+    if not cli.file_access_allowed():
+        return "Too much file access, please wait a bit and try again"
+
+    profiler = cli.start_profile(messages, seconds)
+    return ("Profiling the next %d message(s), for up to %.1f second(s)"
+            % (profiler.max_messages, profiler.max_seconds))
+
+def _on_memory(cli, args):
+    return memory.measure(cli.builder).describe(cli.budget)
+
+def _on_global(cli, args):
+    if len(args) == 0:
+        return "Global context entry is %s" % ("on" if cli.builder.global_entry else "off")
+
+    if args[0] not in ["on", "off"]:
+        return "Please provide 'on' or 'off'"
+
+    cli.builder.set_global_entry(args[0] == "on")
+    return "Global context entry turned %s" % args[0]
+
+def _on_normalize(cli, args):
+    if len(args) == 0:
+        options = cli.builder.normalizer.options
+        return "Normalization is %s" % (" ".join(options) if options else "off")
+
+    if args == ["off"]:
+        args = []
+
+    try:
+        cli.builder.set_normalization(args)
+    except ValueError as e:
+        return "%s, please provide any of: %s" % (e, " ".join(normalize.OPTIONS))
+
+    return "Normalization set to %s" % (" ".join(cli.builder.normalizer.options) or "off")
+
 def _on_help(cli, args):
     if len(args) < 1:
         ret = ("Please provide the name of a command name to get help with. "
@@ -357,23 +637,18 @@ def _on_setvar(cli, args):
     if len(args) < 2:
         return "Please provide a token name and token value"
 
-    if cli.builder.editing_context is None:
-        v = cli.builder.variables
-    else:
-        v = cli.builder.editing_context.variables
+    error = _check_budget(cli, strings=args[:2])
+    if error is not None:
+        return error
 
-    v[args[0]] = args[1]
+    cli.builder.add_variable(args[0], args[1])
     return "value '%s' assigned to format token '%s'" % (args[1], args[0])
 
 def _on_getvar(cli, args):
     if len(args) < 1:
         return "Please provide a token name"
 
-    if cli.builder.editing_context is None:
-        v = cli.builder.variables
-    else:
-        v = cli.builder.editing_context.variables
-
+    v = cli.builder.variable_scope(cli.builder.editing_context)
     if args[0] not in v:
         return "No format token named '%s' in context currently loaded for editing" % args[0]
 
@@ -395,26 +670,118 @@ command_table.update({
     CMD_DROP:        Command(CMD_DROP, _on_drop, CMD_DROP_HELP),
     CMD_TREE:        Command(CMD_TREE, _on_tree, CMD_TREE_HELP),
     CMD_SETVAR:      Command(CMD_SETVAR, _on_setvar, CMD_SETVAR_HELP),
-    CMD_GETVAR:      Command(CMD_GETVAR, _on_getvar, CMD_GETVAR_HELP)
+    CMD_GETVAR:      Command(CMD_GETVAR, _on_getvar, CMD_GETVAR_HELP),
+    CMD_UNDO:        Command(CMD_UNDO, _on_undo, CMD_UNDO_HELP),
+    CMD_LINT:        Command(CMD_LINT, _on_lint, CMD_LINT_HELP),
+    CMD_PRUNE:       Command(CMD_PRUNE, _on_prune, CMD_PRUNE_HELP),
+    CMD_PROFILE:     Command(CMD_PROFILE, _on_profile, CMD_PROFILE_HELP),
+    CMD_MEMORY:      Command(CMD_MEMORY, _on_memory, CMD_MEMORY_HELP),
+    CMD_GLOBAL:      Command(CMD_GLOBAL, _on_global, CMD_GLOBAL_HELP),
+    CMD_NORMALIZE:   Command(CMD_NORMALIZE, _on_normalize, CMD_NORMALIZE_HELP)
 })
 
+class FormatTokens(object):
+    """
+    Format tokens available to a response, looked up only when the response
+    uses them: groups from the matching pattern ("p0", "p1", ...), then
+    client-specific tokens, then variables visible from the responding context
+    """
+    def __init__(self, groups, extra, variables):
+        self.groups = groups
+        self.extra = extra
+        self.variables = variables
+
+    def __getitem__(self, name):
+        if self.groups and name.startswith('p') and name[1:].isdigit():
+            index = int(name[1:])
+            if index < len(self.groups):
+                return self.groups[index]
+
+        if name in self.extra:
+            return self.extra[name]
+
+        return self.variables[name]
+
 class BotBuilderCLI(object):
     """
     Creates a BotBuilder instance, and provides an API for processing input text
     to get a response.
     """
-    def __init__(self, json_filename=DEFAULT_JSON):
+    def __init__(self, json_filename=DEFAULT_JSON, load_compiled=const.LOAD_COMPILED_BOTS):
         self.json_filename = json_filename
-        self.builder = BotBuilder()
+        self._builder = BotBuilder()
         self.command = None
         self.last_file_access_time = 0
+        self.file_signature = None
+        self.lint_policy = const.REGEX_LINT_POLICY
+
+        # Bot prepared by 'prepare_reload', set by the file watcher thread and
+        # taken by the message thread, always while holding 'reload_lock'
+        self.pending_reload = None
+        self.reload_lock = threading.Lock()
+        self.budget = memory.Budget()
+
+        # chatbot_builder.tracing.Tracer instance, if lookups should be traced
+        self.tracer = None
+
+        self.profiler = None
+        self.profile_summary = None
+
+        # chatbot_builder.compiler.CompiledBot instance, if responses are found
+        # using the bot's compiled module instead of 'builder'
+        self.compiled = None
 
         if os.path.isfile(json_filename):
-            self.load(json_filename)
+            compiled = compiler.load_compiled(json_filename) if load_compiled else None
+            if compiled is None:
+                self.load(json_filename)
+            else:
+                self.use_compiled(compiled)
 
         # Reset file access time so save/load works immediately
         self.last_file_access_time = 0
 
+    @property
+    def builder(self):
+        """
+        BotBuilder instance for this bot. If the bot was loaded from its compiled
+        module, the .json file is loaded the first time this is used, and the
+        compiled module is no longer used.
+        """
+        if self.compiled is not None:
+            compiled = self.compiled
+            access_time = self.last_file_access_time
+
+            self.compiled = None
+            self.load(self.json_filename)
+            compiled.transfer_state(self._builder)
+            self.last_file_access_time = access_time
+
+        return self._builder
+
+    @builder.setter
+    def builder(self, builder):
+        self._builder = builder
+        self.compiled = None
+
+    def use_compiled(self, compiled):
+        """
+        Find responses using a compiled module, which must be up to date with
+        the .json file, until 'builder' is next used
+
+        :param chatbot_builder.compiler.CompiledBot compiled: compiled bot
+        """
+        self.compiled = compiled
+        self._builder = None
+        self.file_signature = self._stat_file(self.json_filename)
+
+    def responder(self):
+        """
+        Returns the object used to find responses: 'compiled' if the bot was
+        loaded from its compiled module, otherwise 'builder'
+        """
+        return self.builder if self.compiled is None else self.compiled
+
     def message_response_extra_format_tokens(self, msg, resp):
         return {}
 
@@ -438,7 +805,17 @@ class BotBuilderCLI(object):
                 attrs = {}
 
         self.last_file_access_time = time.time()
+        if self._builder is None:
+            self._builder = BotBuilder()
+
         self.builder.from_json(attrs)
+        self.file_signature = self._stat_file(filename)
+
+        if const.LINT_ON_LOAD:
+            risky = regex_lint.lint_bot(self.builder)
+            if risky:
+                print("%s: %d risky pattern(s), run the '%s' command for details"
+                      % (filename, len(risky), CMD_LINT))
 
     def save(self, filename=None):
         """
@@ -447,18 +824,118 @@ class BotBuilderCLI(object):
         if filename is None:
             filename = self.json_filename
 
+        start = time.perf_counter()
+
         with open(filename, 'w') as fh:
             json.dump(self.builder.to_json(), fh, indent=4)
 
+        _save_seconds.observe(time.perf_counter() - start)
+        self.builder.mark_saved()
         self.last_file_access_time = time.time()
 
+        if filename == self.json_filename:
+            self.file_signature = self._stat_file(filename)
+
+    def import_file(self, filename, context_name=None, entry=False, reject_filename=None,
+                    fmt=None, processes=None):
+        """
+        Import pattern/response pairs from a CSV, TSV or JSONL file into this bot,
+        as a single edit. Changes are not saved.
+
+        :param str filename: file to import
+        :param str context_name: context to import into, or None for the main context
+        :param bool entry: if True, import entry patterns instead of responses
+        :param str reject_filename: if not None, rows that were not imported \
+            are written to this file
+        :param str fmt: file format, default is to choose by the file's extension
+        :param int processes: number of worker processes for checking patterns
+        :return: chatbot_builder.bulk_import.ImportResult instance
+        """
+        return bulk_import.import_file(self, filename, context_name, entry, reject_filename,
+                                       fmt, processes)
+
+    def _stat_file(self, filename):
+        if filename is None:
+            return None
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        return (st.st_mtime_ns, st.st_size)
+
+    def file_changed(self):
+        """
+        Returns True if the .json file has changed since it was last loaded or saved
+        """
+        return self._stat_file(self.json_filename) != self.file_signature
+
+    def prepare_reload(self):
+        """
+        Read and parse the .json file, and keep the result to be swapped in before
+        the next message is processed. This does not touch the current bot, so it
+        can be called from a background thread.
+
+        :return: True if a reload is pending
+        """
+        signature = self._stat_file(self.json_filename)
+        if signature == self.file_signature:
+            return False
+
+        with open(self.json_filename, 'r') as fh:
+            attrs = json.load(fh)
+
+        pending = (signature, BotBuilder().from_json(attrs))
+        with self.reload_lock:
+            self.pending_reload = pending
+        return True
+
+    def apply_pending_reload(self):
+        """
+        Swap in the bot prepared by 'prepare_reload', if any. Contexts that have
+        not changed are kept as they are. Does nothing if there are unsaved changes.
+
+        :return: True if a new bot was swapped in
+        """
+        with self.reload_lock:
+            pending = self.pending_reload
+            self.pending_reload = None
+
+        if pending is None:
+            return False
+        signature, builder = pending
+
+        if signature == self.file_signature:
+            # Already up to date, e.g. the change was made by our own save
+            return False
+
+        if self.compiled is not None:
+            # No changes can have been made, so just swap in the new bot
+            self.compiled.transfer_state(builder)
+            self.builder = builder
+            self.file_signature = signature
+            return True
+
+        if self.builder.has_unsaved_changes():
+            print("Not reloading %s, there are unsaved changes" % self.json_filename)
+            return False
+
+        self.builder.merge(builder)
+        self.file_signature = signature
+        return True
+
     def file_access_allowed(self):
         """
         Returns true if the last file access was at least const.FILE_ACCESS_DELAY_SECS
         in the past.
         """
         delta = time.time() - self.last_file_access_time
-        return delta >= const.FILE_ACCESS_DELAY_SECS
+        if delta < const.FILE_ACCESS_DELAY_SECS:
+            _file_access_rejected.inc()
+            return False
+
+        return True
 
     def process_command(self, text):
         """
@@ -483,7 +960,7 @@ class BotBuilderCLI(object):
         text, ass = const.VAR_ASSIGNMENT_SEP.join(fields[:-1]), fields[-1]
 
         try:
-            ass = ass.format(**fmtargs)
+            ass = ass.format_map(fmtargs)
         except KeyError:
             return "Invalid format token in variable assignment"
 
@@ -495,55 +972,159 @@ class BotBuilderCLI(object):
             if len(names) != 2:
                 return resp
 
-            self.builder.add_variable(names[0].strip(), names[1].strip())
+            name = names[0].strip()
+            error = self.builder.assign_variable(name, names[1].strip(), self.budget)
+            if error is not None:
+                return "Can't assign format token '%s', %s" % (name, error)
 
         return text
 
+    def trace_name(self):
+        """
+        Name used to identify this bot in lookup traces
+        """
+        name = os.path.basename(self.json_filename)
+        if name.endswith('.json'):
+            name = name[:-len('.json')]
+
+        return name
+
     def get_response_and_format(self, msg):
-        resp, groups = self.builder.get_response(self.get_message_content(msg))
+        text = self.get_message_content(msg)
 
-        if resp is None:
+        bot = self.responder()
+
+        # Normalized once, for both the summary and the lookup
+        text = bot.normalizer.prepare(text)
+        if const.PREFILTER_MESSAGES and (not bot.match_summary().may_match(text)):
+            _messages_prefiltered.inc()
             return None
 
-        # Build format args for match groups
-        if groups is None:
-            fmtargs = {}
-        else:
-            fmtargs = {"p%d" % i: groups[i] for i in range(len(groups))}
+        trace = None
+        if (self.tracer is not None) and self.tracer.sample():
+            trace = self.tracer.begin(self.trace_name(), text, bot.responding_context)
 
-        resp = self.get_var_assignments_from_response(resp, fmtargs)
+        start = time.perf_counter()
+        result = bot.lookup(text, trace)
+        matched = time.perf_counter()
+        _match_seconds.observe(matched - start)
 
-        # Get variables for current context
-        if self.builder.editing_context is None:
-            variables = self.builder.variables
+        ret = None
+        formatted = matched
+        if result.response is not None:
+            ret = self.format_response(msg, result.response, result.groups)
+            formatted = time.perf_counter()
+            _format_seconds.observe(formatted - matched)
+
+        if trace is not None:
+            trace.finish(result, matched - start, formatted - matched)
+            self.tracer.write(trace)
+
+        return ret
+
+    def _format_error(self, msg, context, resp):
+        if context is None:
+            ctxname = "main context"
         else:
-            variables = self.builder.editing_context.variables
+            ctxname = "context %s" % context.name
 
-        # Add variables to format args
-        fmtargs.update(variables)
+        ret = "Invalid format token in response (%s):\n\n  %s" % (ctxname, resp)
+        return self.format_command_response(msg, ret)
 
-        # Add user defined format args
-        fmtargs.update(self.message_response_extra_format_tokens(msg, resp))
+    def format_response(self, msg, resp, groups):
+        """
+        Format a matched response, using the groups from the matching pattern
+        """
+        if self.compiled is not None:
+            return self.format_compiled_response(msg, resp, groups)
+
+        fmtargs = FormatTokens(groups, self.message_response_extra_format_tokens(msg, resp),
+                               self.builder.variable_scope(self.builder.responding_context))
+
+        resp = self.get_var_assignments_from_response(resp, fmtargs)
 
         # Do the formatting
         try:
-            fmtd = resp.format(**fmtargs)
-        except (KeyError, IndexError):
-            if self.builder.editing_context is None:
-                ctxname = "main context"
-            else:
-                ctxname = "context %s" % self.builder.editing_context.name
-
-            ret = "Invalid format token in response (%s):\n\n  %s" % (ctxname, resp)
-            return self.format_command_response(msg, ret)
+            fmtd = resp.format_map(fmtargs)
+        except (KeyError, IndexError, ValueError):
+            return self._format_error(msg, self.builder.responding_context, resp)
 
         return fmtd
 
+    def format_compiled_response(self, msg, template, groups):
+        """
+        Same as 'format_response', for a response found by the compiled module
+
+        :param chatbot_builder.compiler.Template template: matched response
+        """
+        context = self.compiled.responding_context
+        fmtargs = FormatTokens(groups,
+                               self.message_response_extra_format_tokens(msg, template.raw),
+                               self.compiled.variable_scope(context))
+
+        text, fields = self.compiled.assign_variables(template, fmtargs, self.budget)
+
+        try:
+            return compiler.format_fields(text, fields, fmtargs)
+        except (KeyError, IndexError, ValueError):
+            return self._format_error(msg, context, text)
+
+    def start_profile(self, messages=None, seconds=None, directory=const.PROFILE_DIR):
+        """
+        Start profiling calls to 'process_message' for this bot only. Profiling
+        stops after 'messages' messages or 'seconds' seconds, whichever is first,
+        and the summary is then available as 'profile_summary'.
+
+        :param int messages: maximum number of messages to profile
+        :param float seconds: maximum number of seconds to profile for
+        :param str directory: directory to write full profile results to
+        :return: chatbot_builder.profiler.Profiler instance
+        """
+        self.profiler = Profiler(self.trace_name(), messages, seconds, directory)
+        self.last_file_access_time = time.time()
+        return self.profiler
+
+    def stop_profile(self):
+        """
+        Stop profiling, if profiling is running
+
+        :return: profile summary text, or None if profiling was not running
+        """
+        if self.profiler is None:
+            return None
+
+        profiler = self.profiler
+        self.profiler = None
+
+        try:
+            self.profile_summary = profiler.finish()
+        except OSError as e:
+            self.profile_summary = "Failed to save profile results: %s" % e
+
+        return self.profile_summary
+
     def process_message(self, message):
         """
         Process an input string (either a command or some conversational text),
         and return the response
         """
+        if self.profiler is None:
+            return self._process_message(message)
+
+        if self.profiler.expired():
+            self.stop_profile()
+            return self._process_message(message)
+
+        ret = self.profiler.run(self._process_message, message)
+        if (self.profiler is not None) and self.profiler.expired():
+            self.stop_profile()
+
+        return ret
+
+    def _process_message(self, message):
+        if self.pending_reload is not None:
+            self.apply_pending_reload()
+
         try:
             text = self.get_message_content(message).strip()
 
@@ -551,10 +1132,19 @@ class BotBuilderCLI(object):
                 return None
 
             if text.startswith(const.COMMAND_TOKEN):
-                return self.format_command_response(message, self.process_command(text))
+                ret = self.format_command_response(message, self.process_command(text))
+                _messages_command.inc()
+                return ret
+
+            ret = self.get_response_and_format(message)
+            if ret is None:
+                _messages_nomatch.inc()
             else:
-                return self.get_response_and_format(message)
+                _messages_match.inc()
+
+            return ret
         except Exception as e:
+            _messages_error.inc()
             return "Uh, Something bad happened.\n\n" + traceback.format_exc()
 
     def get_message_content(self, message):
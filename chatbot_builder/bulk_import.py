@@ -0,0 +1,410 @@
+import os
+import csv
+import json
+import argparse
+import itertools
+import collections
+import multiprocessing
+
+from chatbot_builder.pattern_dict import order_keys
+from chatbot_builder import regex_lint
+from chatbot_builder import memory
+from chatbot_builder import constants as const
+
+FORMAT_CSV = "csv"
+FORMAT_TSV = "tsv"
+FORMAT_JSONL = "jsonl"
+
+_EXTENSIONS = {
+    ".csv": FORMAT_CSV,
+    ".tsv": FORMAT_TSV,
+    ".tab": FORMAT_TSV,
+    ".jsonl": FORMAT_JSONL,
+    ".ndjson": FORMAT_JSONL
+}
+
+# Keys for JSONL rows, and column names for an optional CSV/TSV header row
+PATTERN_KEY = "pattern"
+RESPONSE_KEY = "response"
+
+# Keys used in reject files. Each line of a reject file is a JSON object
+# describing one row that was not imported.
+KEY_LINE = "line"
+KEY_ERROR = "error"
+
+# Number of reject errors kept for the summary
+_NUM_ERRORS_SHOWN = 10
+
+def detect_format(filename):
+    """
+    Returns the format of a file to import, from its extension
+
+    :raises ValueError: if the extension is not recognised
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in _EXTENSIONS:
+        raise ValueError("Can't tell the format of '%s', expected one of: %s"
+                         % (filename, ", ".join(sorted(_EXTENSIONS))))
+
+    return _EXTENSIONS[ext]
+
+def _valid_utf8(*strings):
+    # Files are decoded with errors='surrogateescape', so that a bad byte only
+    # rejects the row it is in
+    try:
+        for s in strings:
+            s.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+
+    return True
+
+def _read_delimited(fh, delimiter):
+    reader = csv.reader(fh, delimiter=delimiter)
+    first = True
+
+    while True:
+        try:
+            fields = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, None, "Malformed row: %s" % e
+            continue
+
+        if first:
+            first = False
+            if [f.strip().lower() for f in fields] == [PATTERN_KEY, RESPONSE_KEY]:
+                continue
+
+        if not fields:
+            continue
+
+        if len(fields) != 2:
+            yield reader.line_num, None, None, ("Expected 2 columns (pattern and "
+                                                "response), found %d" % len(fields))
+        elif not _valid_utf8(*fields):
+            yield reader.line_num, None, None, "Invalid UTF-8"
+        else:
+            yield reader.line_num, fields[0], fields[1], None
+
+def _read_jsonl(fh):
+    for line_num, line in enumerate(fh, 1):
+        if not line.strip():
+            continue
+
+        if not _valid_utf8(line):
+            yield line_num, None, None, "Invalid UTF-8"
+            continue
+
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, None, None, "Invalid JSON"
+            continue
+
+        if isinstance(row, dict):
+            row = [row.get(PATTERN_KEY, None), row.get(RESPONSE_KEY, None)]
+
+        if (not isinstance(row, list)) or (len(row) != 2):
+            yield line_num, None, None, ("Expected an object with '%s' and '%s' keys, or "
+                                         "a list of two strings" % (PATTERN_KEY,
+                                                                    RESPONSE_KEY))
+        elif not (isinstance(row[0], str) and isinstance(row[1], str)):
+            yield line_num, None, None, "Pattern and response must be strings"
+        else:
+            yield line_num, row[0], row[1], None
+
+def read_rows(filename, fmt=None):
+    """
+    Read pattern/response pairs from a CSV, TSV or JSONL file, one row at a time
+
+    :param str filename: file to read
+    :param str fmt: one of FORMAT_CSV, FORMAT_TSV or FORMAT_JSONL. If None, the \
+        format is chosen by the file's extension.
+    :return: generator yielding tuples of the form (line number, pattern, \
+        response, error), where 'error' is None if the row could be read
+    """
+    if fmt is None:
+        fmt = detect_format(filename)
+
+    with open(filename, 'r', encoding='utf-8-sig', errors='surrogateescape',
+              newline='') as fh:
+        if fmt == FORMAT_JSONL:
+            rows = _read_jsonl(fh)
+        elif fmt == FORMAT_TSV:
+            rows = _read_delimited(fh, '\t')
+        elif fmt == FORMAT_CSV:
+            rows = _read_delimited(fh, ',')
+        else:
+            raise ValueError("Unknown import format '%s'" % fmt)
+
+        for row in rows:
+            yield row
+
+def _check_row(row):
+    # Runs in a worker process. Returns a tuple of the form (line number,
+    # pattern, response, error, rewritten, order keys).
+    line_num, pattern, response, error, policy = row
+    if error is not None:
+        return line_num, pattern, response, error, False, None
+
+    if (not pattern) or (not response):
+        error = "Pattern and response must not be empty"
+        return line_num, pattern, response, error, False, None
+
+    checked, error, _ = regex_lint.check_pattern(pattern, policy)
+    if error is not None:
+        return line_num, pattern, response, error, False, None
+
+    return line_num, checked, response, None, checked != pattern, order_keys(checked)
+
+def _batches(rows, size):
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+
+        yield batch
+
+def _checked_batches(rows, policy, processes, batch_size, unchecked):
+    # Yields lists of checked rows. Rows are checked in a process pool, with
+    # at most two batches read ahead of the batch being added. Batches read
+    # from 'rows' but not yet yielded are kept in the 'unchecked' deque, and
+    # closing the generator stops the pool.
+    batches = _batches(((r + (policy,)) for r in rows), batch_size)
+    first = next(batches, None)
+    if first is None:
+        return
+
+    if (processes <= 1) or (len(first) < batch_size):
+        for batch in itertools.chain([first], batches):
+            yield [_check_row(row) for row in batch]
+
+        return
+
+    chunksize = max(1, batch_size // (processes * 4))
+    with multiprocessing.Pool(processes) as pool:
+        unchecked.append(first)
+        pending = pool.map_async(_check_row, first, chunksize)
+        for batch in batches:
+            unchecked.append(batch)
+            job = pool.map_async(_check_row, batch, chunksize)
+            checked = pending.get()
+            unchecked.popleft()
+            yield checked
+            pending = job
+
+        checked = pending.get()
+        unchecked.popleft()
+        yield checked
+
+class ImportResult(object):
+    """
+    Counts of rows imported and rejected by 'import_rows'
+
+    :ivar int added: number of pairs added to the bot
+    :ivar int rejected: number of rows not added
+    :ivar int rewritten: number of patterns added after being rewritten to \
+        avoid slow matching (see chatbot_builder.regex_lint)
+    :ivar list errors: (line number, error) tuples for the first few rejected rows
+    :ivar str stopped: reason the import stopped early, or None
+    """
+    def __init__(self):
+        self.added = 0
+        self.rejected = 0
+        self.rewritten = 0
+        self.errors = []
+        self.stopped = None
+
+    def reject(self, line_num, error):
+        self.rejected += 1
+        if len(self.errors) < _NUM_ERRORS_SHOWN:
+            self.errors.append((line_num, error.split('\n')[0]))
+
+    def summary(self):
+        ret = "Imported %d pair(s), rejected %d row(s)" % (self.added, self.rejected)
+        if self.rewritten:
+            ret += ", rewrote %d risky pattern(s)" % self.rewritten
+
+        ret += "\n"
+        if self.stopped is not None:
+            ret += "Import stopped early: %s\n" % self.stopped
+
+        for line_num, error in self.errors:
+            ret += "  line %d: %s\n" % (line_num, error)
+
+        if self.rejected > len(self.errors):
+            ret += "  ...\n"
+
+        return ret
+
+def import_rows(cli, rows, context_name=None, entry=False, rejects=None,
+                processes=None, batch_size=const.IMPORT_BATCH_SIZE):
+    """
+    Check pattern/response pairs in a process pool, and add the valid ones to
+    a bot as a single edit. Patterns are checked in the same way as for the
+    'on' and 'entry' commands, and rows with invalid or rejected patterns, or
+    patterns already in the target context, are not added. Rows are read and
+    checked in batches, so memory use doesn't depend on the number of rows.
+
+    :param chatbot_builder.bot_builder_cli.BotBuilderCLI cli: bot to add to
+    :param rows: iterable of (line number, pattern, response, error) tuples, \
+        as produced by 'read_rows'
+    :param str context_name: context to add to, or None for the main context
+    :param bool entry: if True, add entry patterns instead of responses
+    :param rejects: if not None, a file object that rejected rows are written \
+        to, one JSON object per line
+    :param int processes: number of worker processes, default is the number of CPUs
+    :param int batch_size: number of rows to check at a time
+    :return: ImportResult instance
+    :raises ValueError: if the target context doesn't exist
+    """
+    builder = cli.builder
+    context = None
+    if context_name:
+        context = builder.find_context(context_name)
+        if context is None:
+            raise ValueError("No context by the name of '%s'" % context_name)
+
+    if context is None:
+        if entry:
+            raise ValueError("The main context has no entry patterns")
+
+        store = builder.responses
+    else:
+        store = context.entry if entry else context.responses
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    result = ImportResult()
+    seen = set([p for p, _ in store.iteritems()])
+
+    def reject(line_num, pattern, response, error):
+        result.reject(line_num, error)
+        if rejects is not None:
+            rejects.write(json.dumps({KEY_LINE: line_num, PATTERN_KEY: pattern,
+                                      RESPONSE_KEY: response, KEY_ERROR: error},
+                                     ensure_ascii=False) + '\n')
+
+    def pairs():
+        remaining = iter(rows)
+        unchecked = collections.deque()
+        batches = _checked_batches(remaining, cli.lint_policy, processes, batch_size,
+                                   unchecked)
+
+        # Size of the batches accepted so far, which isn't counted in the bot's
+        # running total until the import is finished
+        patterns = 0
+        size = 0
+
+        for batch in batches:
+            accepted = [r for r in batch if r[3] is None]
+            patterns += len(accepted)
+            size += memory.string_size(*[s for r in accepted for s in r[1:3]])
+            error = cli.budget.check(builder, patterns, 0, size)
+
+            if error is not None:
+                result.stopped = error
+                batches.close()
+
+                # Count the rest of the rows, without checking them
+                rest = [r for b in unchecked for r in b]
+                for row in itertools.chain(batch, rest, remaining):
+                    line_num, pattern, response = row[:3]
+                    reject(line_num, pattern, response, "Not imported, %s" % error)
+
+                return
+
+            for line_num, pattern, response, error, rewritten, keys in batch:
+                if error is None and pattern in seen:
+                    error = "Duplicate pattern, it would never match"
+
+                if error is not None:
+                    reject(line_num, pattern, response, error)
+                    continue
+
+                # Saves working these out again when the pattern order is updated
+                store.pattern_keys[pattern] = keys
+
+                seen.add(pattern)
+                result.rewritten += int(rewritten)
+                yield pattern, response
+
+    result.added = builder.add_patterns(context, entry, pairs())
+    return result
+
+def import_file(cli, filename, context_name=None, entry=False, reject_filename=None,
+                fmt=None, processes=None):
+    """
+    Import pattern/response pairs from a CSV, TSV or JSONL file, see 'import_rows'.
+    CSV and TSV files have two columns, pattern and response, and may start
+    with a header row naming them. JSONL files have one JSON object per line,
+    with "pattern" and "response" keys.
+
+    :param str reject_filename: if not None, rejected rows are written to this file
+    :param str fmt: file format, default is to choose by the file's extension
+    :return: ImportResult instance
+    """
+    rows = read_rows(filename, fmt)
+    if reject_filename is None:
+        return import_rows(cli, rows, context_name, entry, None, processes)
+
+    with open(reject_filename, 'w', encoding='utf-8') as rejects:
+        return import_rows(cli, rows, context_name, entry, rejects, processes)
+
+def main():
+    from chatbot_builder.bot_builder_cli import BotBuilderCLI
+
+    parser = argparse.ArgumentParser(description="Import pattern/response pairs from "
+                                     "CSV, TSV or JSONL files into a bot database file")
+    parser.add_argument('json_file', help="Bot database file to import into (created "
+                        "if it doesn't exist)")
+    parser.add_argument('input_files', nargs='+', help="Files to import")
+    parser.add_argument('-c', '--context', default=None,
+                        help="Context to import into (e.g. 'a::b'), default is the "
+                        "main context")
+    parser.add_argument('-e', '--entry', action='store_true',
+                        help="Import entry patterns for the context, instead of responses")
+    parser.add_argument('-f', '--format', default=None,
+                        choices=[FORMAT_CSV, FORMAT_TSV, FORMAT_JSONL],
+                        help="Format of the input files, default is to choose by "
+                        "file extension")
+    parser.add_argument('-r', '--rejects', default=None,
+                        help="Write rejected rows to this file, default is "
+                        "<input file>.rejects.jsonl")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="Number of worker processes for checking patterns")
+    parser.add_argument('--no-budget', action='store_true',
+                        help="Don't limit the size of the bot")
+    args = parser.parse_args()
+
+    cli = BotBuilderCLI(args.json_file, load_compiled=False)
+    if args.no_budget:
+        cli.budget = memory.Budget(float('inf'), float('inf'), float('inf'))
+
+    total = 0
+    for i, filename in enumerate(args.input_files):
+        reject_filename = args.rejects
+        mode = 'w' if i == 0 else 'a'
+        if reject_filename is None:
+            reject_filename = filename + ".rejects.jsonl"
+            mode = 'w'
+
+        with open(reject_filename, mode, encoding='utf-8') as rejects:
+            result = import_rows(cli, read_rows(filename, args.format), args.context,
+                                 args.entry, rejects, args.processes)
+
+        print("%s: %s" % (filename, result.summary()))
+        if result.rejected:
+            print("Rejected rows written to %s" % reject_filename)
+
+        total += result.added
+
+    if total:
+        cli.save()
+        print("Saved %d new pair(s) to %s" % (total, args.json_file))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import os
+import re
+import json
+import time
+import hmac
+import hashlib
+
+from chatbot_builder.bot_builder import BotBuilder
+from chatbot_builder import constants as const
+
+# Name of the message log in a capture directory
+CAPTURE_FILE = "messages.log"
+
+CAPTURE_VERSION = 1
+
+# Each line of a capture file is JSON. The first line is a header object, and
+# the rest are either message records, which are lists of the form
+# [milliseconds since start, guild key, user key, text], or guild records,
+# which are objects that mark the first message for a guild and hold the
+# conversation state of the guild's bot at that time.
+KEY_VERSION = "v"
+KEY_START = "t"
+KEY_GUILD = "g"
+KEY_RESPONDING = "r"
+KEY_EDITING = "e"
+
+# Discord mentions of users (<@123>, <@!123>), roles (<@&123>) and channels (<#123>)
+_mention_regex = re.compile(r'<(@!?|@&|#)(\d+)>')
+
+_MENTION_KINDS = {"@": "u", "@!": "u", "@&": "r", "#": "c"}
+
+def _context_name(context):
+    return None if context is None else context.name
+
+def _snapshot(cli):
+    # Returns a BotBuilder holding the current state of a bot. A bot loaded
+    # from its compiled module is copied from its .json file, which the module
+    # is up to date with, rather than switching it over to a BotBuilder.
+    if cli.compiled is None:
+        return cli.builder
+
+    with open(cli.json_filename, 'r') as fh:
+        builder = BotBuilder().from_json(json.load(fh))
+
+    cli.compiled.transfer_state(builder)
+    return builder
+
+class Recorder(object):
+    """
+    Records the messages received by a client to a new capture directory, so
+    they can be replayed later (see chatbot_builder.clients.replay). Guild and
+    user IDs are replaced with keys derived from a secret, and so are the IDs
+    in user, role and channel mentions. The first time a message is recorded
+    for a guild, the guild's bot is saved to "<guild key>.json" in the capture
+    directory, so that replays start from the same state.
+
+    :param str directory: directory to create the capture directory in
+    :param bytes secret: secret for anonymizing IDs. If None, a random secret \
+        is used.
+    :param int max_bytes: stop recording when the capture file reaches this size
+    """
+    def __init__(self, directory, secret=None, max_bytes=const.CAPTURE_MAX_BYTES):
+        self.secret = os.urandom(32) if secret is None else secret
+        self.max_bytes = max_bytes
+        self.start = time.time()
+        self.guilds = set()
+        self.stopped = False
+
+        parent = os.path.expanduser(directory)
+        name = time.strftime("capture-%Y%m%d-%H%M%S", time.localtime(self.start))
+        self.directory = os.path.join(parent, name)
+
+        i = 1
+        while os.path.exists(self.directory):
+            self.directory = os.path.join(parent, "%s-%d" % (name, i))
+            i += 1
+
+        os.makedirs(self.directory)
+        self.filename = os.path.join(self.directory, CAPTURE_FILE)
+
+        # Line buffered, so that a capture is usable even if the client is killed
+        self.fh = open(self.filename, 'w', encoding='utf-8', buffering=1)
+        self.size = 0
+        self._write({KEY_VERSION: CAPTURE_VERSION, KEY_START: round(self.start, 3)})
+
+    def _digest(self, kind, ident):
+        msg = ("%s:%s" % (kind, ident)).encode('utf-8')
+        return hmac.new(self.secret, msg, hashlib.sha256).hexdigest()
+
+    def guild_key(self, guild_id):
+        return self._digest("g", guild_id)[:16]
+
+    def user_key(self, user_id):
+        # Numeric, so that anonymized mentions still look like mentions
+        return int(self._digest("u", user_id)[:12], 16)
+
+    def anonymize(self, text):
+        """
+        Replace the IDs in any mentions in 'text' with anonymized keys
+        """
+        def replace(m):
+            kind = _MENTION_KINDS[m.group(1)]
+            return "<%s%d>" % (m.group(1), int(self._digest(kind, m.group(2))[:12], 16))
+
+        return _mention_regex.sub(replace, text)
+
+    def _write(self, record):
+        if self.stopped:
+            return
+
+        line = json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n'
+        size = len(line.encode('utf-8'))
+        if (self.size + size) > self.max_bytes:
+            print("Capture file %s is full, recording stopped" % self.filename)
+            self.close()
+            return
+
+        self.fh.write(line)
+        self.size += size
+
+    def record(self, guild_id, user_id, text, cli):
+        """
+        Record a message, before it is processed
+
+        :param str guild_id: ID of the guild the message belongs to
+        :param user_id: ID of the user that sent the message
+        :param str text: message text
+        :param chatbot_builder.bot_builder_cli.BotBuilderCLI cli: the guild's bot
+        """
+        if self.stopped:
+            return
+
+        key = self.guild_key(guild_id)
+        if key not in self.guilds:
+            self.guilds.add(key)
+            builder = _snapshot(cli)
+            with open(os.path.join(self.directory, "%s.json" % key), 'w') as fh:
+                json.dump(builder.to_json(), fh)
+
+            self._write({KEY_GUILD: key,
+                         KEY_RESPONDING: _context_name(builder.responding_context),
+                         KEY_EDITING: _context_name(builder.editing_context)})
+
+        millis = int(round((time.time() - self.start) * 1000.0))
+        self._write([millis, key, self.user_key(user_id), self.anonymize(text)])
+
+    def close(self):
+        self.stopped = True
+        self.fh.close()
+
+def read_capture(directory):
+    """
+    Read a capture
+
+    :param str directory: capture directory, as created by a Recorder
+    :return: tuple of the form (header, records), where 'records' is a list \
+        of message records and guild records, in the order they were recorded
+    """
+    filename = os.path.join(os.path.expanduser(directory), CAPTURE_FILE)
+    header = None
+    records = []
+
+    with open(filename, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partially written last line
+                continue
+
+            if header is None:
+                header = record
+                if header.get(KEY_VERSION, None) != CAPTURE_VERSION:
+                    raise ValueError("%s: unsupported capture version" % filename)
+            else:
+                records.append(record)
+
+    if header is None:
+        raise ValueError("%s: empty capture file" % filename)
+
+    return header, records
@@ -0,0 +1,154 @@
+import os
+
+from chatbot_builder import constants as const
+from chatbot_builder import metrics
+from chatbot_builder import memory
+from chatbot_builder.file_watcher import FileWatcher
+from chatbot_builder.tracing import Tracer
+from chatbot_builder.capture import Recorder
+
+_cached_guilds = metrics.registry.gauge("chatbot_builder_cached_guilds",
+                                        "Number of guilds with a bot loaded in memory")
+_bot_memory = metrics.registry.gauge("chatbot_builder_bot_memory_bytes",
+                                     "Estimated memory used by each guild's bot", ["guild"])
+
+def _memory_bytes(cli):
+    # Called on the metrics server thread, so the bot may change while it is
+    # being measured. Bots using their compiled module aren't measured, since
+    # that would load the .json file.
+    if cli.compiled is not None:
+        return float('nan')
+
+    try:
+        return memory.measure(cli.builder).total()
+    except RuntimeError:
+        return float('nan')
+
+def start_metrics_from_environment():
+    """
+    Serve metrics over HTTP, if the metrics port environment variable is set
+    """
+    if const.DISCORD_METRICS_PORT_ENV_VAR in os.environ:
+        port = int(os.environ[const.DISCORD_METRICS_PORT_ENV_VAR])
+        metrics.start_http_server(port)
+        print("Serving metrics on http://127.0.0.1:%d/metrics" % port)
+
+def tracer_from_environment():
+    """
+    Returns a Tracer if the trace file environment variable is set, else None
+    """
+    if const.DISCORD_TRACE_FILE_ENV_VAR not in os.environ:
+        return None
+
+    rate = float(os.environ.get(const.DISCORD_TRACE_SAMPLE_RATE_ENV_VAR, 1.0))
+    tracer = Tracer(os.environ[const.DISCORD_TRACE_FILE_ENV_VAR], rate)
+    print("Tracing %.1f%% of lookups to %s" % (rate * 100.0, tracer.filename))
+    return tracer
+
+def recorder_from_environment():
+    """
+    Returns a Recorder if the capture directory environment variable is set,
+    else None
+    """
+    if const.DISCORD_CAPTURE_DIR_ENV_VAR not in os.environ:
+        return None
+
+    secret = os.environ.get(const.DISCORD_CAPTURE_SECRET_ENV_VAR, None)
+    if secret is not None:
+        secret = secret.encode('utf-8')
+
+    recorder = Recorder(os.environ[const.DISCORD_CAPTURE_DIR_ENV_VAR], secret)
+    print("Recording messages to %s" % recorder.directory)
+    return recorder
+
+class BotCache(object):
+    """
+    Holds one BotBuilderCLI instance per bot ID (a discord guild, or any other
+    ID chosen by a client), each saved to "<bot ID>.json" in 'json_dir'. Bots
+    are loaded from disk the first time they are needed. If 'hot_reload' is
+    True, bots are reloaded when their .json file changes on disk.
+
+    The IDs of bots with a .json file are listed when the cache is created,
+    so 'find' can tell whether a bot exists without touching the disk. If
+    'hot_reload' is False, .json files created by anything else after that
+    are only found by 'find' after 'refresh' is called.
+
+    :param cli_class: BotBuilderCLI subclass to create for each bot
+    :param str json_dir: directory for bot database files
+    :param bool hot_reload: if True, watch 'json_dir' for changed files
+    :param chatbot_builder.tracing.Tracer tracer: tracer to use for all bots
+    """
+    def __init__(self, cli_class, json_dir=const.JSON_DIR, hot_reload=False, tracer=None):
+        self.cli_class = cli_class
+        self.tracer = tracer
+        self.clis = {}
+        _cached_guilds.set_function(lambda: len(self.clis))
+
+        self.json_dir = os.path.join(os.path.expanduser(json_dir))
+        if not os.path.isdir(self.json_dir):
+            os.mkdir(self.json_dir)
+
+        # IDs of bots that have a .json file
+        self.known = set()
+        self.refresh()
+
+        self.watcher = None
+        if hot_reload:
+            self.watcher = FileWatcher(self.json_dir, self._on_json_changed, '.json',
+                                       const.JSON_POLL_INTERVAL_SECS)
+            self.watcher.start()
+
+    def _on_json_changed(self, filename):
+        # Called on the file watcher thread
+        bot_id = os.path.basename(filename)[:-len('.json')]
+        self.known.add(bot_id)
+
+        cli = self.clis.get(bot_id, None)
+        if cli is None:
+            # Not loaded yet, will be read from disk when first needed
+            return
+
+        try:
+            if cli.prepare_reload():
+                print("Reloading %s" % filename)
+        except (OSError, ValueError) as e:
+            print("Failed to reload %s: %s" % (filename, e))
+
+    def refresh(self):
+        """
+        List the bots that have a .json file again
+        """
+        self.known.update([n[:-len('.json')] for n in os.listdir(self.json_dir)
+                           if n.endswith('.json')])
+
+    def find(self, bot_id):
+        """
+        Returns the BotBuilderCLI instance for a bot ID, loading it if needed,
+        or None if the bot isn't loaded and has no .json file. Unlike 'get',
+        nothing is created for bots that don't exist.
+        """
+        cli = self.clis.get(bot_id, None)
+        if (cli is None) and (bot_id in self.known):
+            cli = self.get(bot_id)
+
+        return cli
+
+    def get(self, bot_id):
+        """
+        Returns the BotBuilderCLI instance for a bot ID, loading it if needed
+        """
+        cli = self.clis.get(bot_id, None)
+        if cli is not None:
+            return cli
+
+        filename = os.path.join(self.json_dir, "%s.json" % bot_id)
+        cli = self.cli_class(json_filename=filename)
+        cli.tracer = self.tracer
+        self.clis[bot_id] = cli
+        _bot_memory.labels(bot_id).set_function(lambda: _memory_bytes(cli))
+        return cli
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
@@ -1,7 +1,13 @@
 import os
+import time
 
 import discord
 
+from chatbot_builder import metrics
+
+_send_seconds = metrics.registry.histogram("chatbot_builder_send_seconds",
+                                           "Time spent sending a response to discord")
+
 class MessageResponse(object):
     def __init__(self, response_data, channel=None, member=None):
         self.channel = channel
@@ -9,10 +15,14 @@ class MessageResponse(object):
         self.response_data = response_data
 
 class DiscordBot(object):
-    def __init__(self, token, server):
+    def __init__(self, token, server, client=None):
         self.token = token
         self.server = server
-        self.client = discord.Client()
+
+        if client is None:
+            client = discord.Client()
+
+        self.client = client
 
         @self.client.event
         async def on_connect():
@@ -28,6 +38,8 @@ class DiscordBot(object):
             if resp is None:
                 return
 
+            start = time.perf_counter()
+
             if resp.member is not None:
                 # Response should be sent in a DM to given member
                 await message.author.create_dm()
@@ -39,6 +51,8 @@ class DiscordBot(object):
                 raise RuntimeError("malformed response: either member or "
                                    "channel must be set")
 
+            _send_seconds.observe(time.perf_counter() - start)
+
     def run(self):
         self.client.run(self.token)
 
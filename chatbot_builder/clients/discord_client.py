@@ -3,11 +3,13 @@ import os
 from chatbot_builder.bot_builder_cli import BotBuilderCLI
 from chatbot_builder.clients.discord_bot import DiscordBot, MessageResponse
 from chatbot_builder import constants as const
+from chatbot_builder.clients.bot_cache import (BotCache, start_metrics_from_environment,
+                                               tracer_from_environment,
+                                               recorder_from_environment)
 
 MSG_AUTHOR_MENTION_FMT_TOKEN = "author_mention"
 MSG_AUTHOR_FMT_TOKEN = "author"
 
-
 class DiscordBotBuilderCLI(BotBuilderCLI):
     def format_command_response(self, msg, resp):
         return "```\n%s```" % resp
@@ -22,13 +24,15 @@ class DiscordBotBuilderCLI(BotBuilderCLI):
         return msg.content
 
 class DiscordBotBuilderClient(DiscordBot):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, json_dir=const.JSON_DIR, hot_reload=False, tracer=None,
+                 recorder=None, **kwargs):
         super(DiscordBotBuilderClient, self).__init__(*args, **kwargs)
-        self.clis = {}
+        self.bots = BotCache(DiscordBotBuilderCLI, json_dir, hot_reload, tracer)
+        self.clis = self.bots.clis
+        self.json_dir = self.bots.json_dir
 
-        self.json_dir = os.path.join(os.path.expanduser(const.JSON_DIR))
-        if not os.path.isdir(self.json_dir):
-            os.mkdir(self.json_dir)
+        # chatbot_builder.capture.Recorder instance, if messages should be recorded
+        self.recorder = recorder
 
     def _get_message_guild_id(self, message):
         name = "default"
@@ -39,7 +43,7 @@ class DiscordBotBuilderClient(DiscordBot):
             if hasattr(message.author, 'guild'):
                 # DM from a user within a guild
                 name = message.author.guild.name
-                ident = message.author.build.id
+                ident = message.author.guild.id
             else:
                 # DM from a user outside of a guild
                 name = message.author.name
@@ -62,11 +66,21 @@ class DiscordBotBuilderClient(DiscordBot):
             return
 
         guild_id = self._get_message_guild_id(message)
-        if guild_id not in self.clis:
-            filename = os.path.join(self.json_dir, "%s.json" % guild_id)
-            self.clis[guild_id] = DiscordBotBuilderCLI(json_filename=filename)
+        cli = self.bots.find(guild_id)
+        if cli is None:
+            # A guild that has never programmed the bot has nothing to respond
+            # with, so it only needs a bot once it sends a command. Captures
+            # still record a bot for every guild.
+            if ((self.recorder is None) and
+                    (not message.content.strip().startswith(const.COMMAND_TOKEN))):
+                return None
+
+            cli = self.bots.get(guild_id)
+
+        if self.recorder is not None:
+            self.recorder.record(guild_id, message.author.id, message.content, cli)
 
-        resp = self.clis[guild_id].process_message(message)
+        resp = cli.process_message(message)
         if resp is None:
             return None
 
@@ -79,8 +93,17 @@ def main():
 
     token = os.environ[const.DISCORD_TOKEN_ENV_VAR]
 
-    b = DiscordBotBuilderClient(token, '')
-    b.run()
+    start_metrics_from_environment()
+    tracer = tracer_from_environment()
+    recorder = recorder_from_environment()
+
+    b = DiscordBotBuilderClient(token, '', hot_reload=True, tracer=tracer, recorder=recorder)
+
+    try:
+        b.run()
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,322 @@
+import os
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+from chatbot_builder.clients.discord_client import DiscordBotBuilderClient
+
+# Default conversational text sent by the load generator, if none is provided
+DEFAULT_MESSAGES = [
+    "hi",
+    "hello",
+    "lol",
+    "gm",
+    "how are you?",
+    "what are you doing",
+    "I like cats and dogs",
+    "good night",
+]
+
+class FakeUser(object):
+    """
+    Stands in for discord.User / discord.Member. If 'guild' is set, the user
+    behaves like a guild member (which is how DMs from guild members look)
+    """
+    def __init__(self, name, ident, guild=None):
+        self.name = name
+        self.id = ident
+        self.mention = "<@%d>" % ident
+        self.dm_channel = None
+
+        if guild is not None:
+            self.guild = guild
+
+    async def create_dm(self):
+        if self.dm_channel is None:
+            self.dm_channel = FakeChannel("dm_%s" % self.name, self.id)
+
+        return self.dm_channel
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and (other.id == self.id)
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeGuild(object):
+    """
+    Stands in for discord.Guild
+    """
+    def __init__(self, name, ident):
+        self.name = name
+        self.id = ident
+
+class FakeChannel(object):
+    """
+    Stands in for discord.TextChannel / discord.DMChannel. Sent messages are
+    counted rather than stored, so long load tests don't grow without bound
+    """
+    def __init__(self, name, ident, guild=None):
+        self.name = name
+        self.id = ident
+        self.guild = guild
+        self.num_sent = 0
+        self.last_sent = None
+
+    async def send(self, content):
+        self.num_sent += 1
+        self.last_sent = content
+
+class FakeMessage(object):
+    """
+    Stands in for discord.Message
+    """
+    def __init__(self, content, author, channel, guild=None):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+
+class FakeClient(object):
+    """
+    Stands in for discord.Client. Event handlers registered with the 'event'
+    decorator are stored by name, and can be invoked with 'dispatch'
+    """
+    def __init__(self, user=None):
+        if user is None:
+            user = FakeUser("chatbot_builder", 1)
+
+        self.user = user
+        self.events = {}
+
+    def event(self, coro):
+        self.events[coro.__name__] = coro
+        return coro
+
+    async def dispatch(self, event_name, *args):
+        if event_name in self.events:
+            await self.events[event_name](*args)
+
+    def run(self, token):
+        raise RuntimeError("FakeClient cannot connect to discord")
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+
+    index = int(round((pct / 100.0) * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+class LoadTestResults(object):
+    """
+    End-to-end latencies (in seconds) and throughput for a single load test run.
+    Latency is measured from the time a message was *scheduled* to be received,
+    so any queueing delay caused by the bot falling behind is included
+    """
+    def __init__(self):
+        self.latencies = []
+        self.num_messages = 0
+        self.num_responses = 0
+        self.num_errors = 0
+        self.elapsed = 0.0
+
+    def throughput(self):
+        if self.elapsed <= 0.0:
+            return 0.0
+
+        return self.num_messages / self.elapsed
+
+    def summary(self):
+        lat = sorted(self.latencies)
+        mean = (sum(lat) / len(lat)) if lat else 0.0
+
+        ret = "messages    : %d\n" % self.num_messages
+        ret += "responses   : %d\n" % self.num_responses
+        ret += "errors      : %d\n" % self.num_errors
+        ret += "elapsed     : %.3fs\n" % self.elapsed
+        ret += "throughput  : %.1f msgs/sec\n" % self.throughput()
+        ret += "latency avg : %.3fms\n" % (mean * 1000.0)
+
+        for pct in [50, 90, 99, 99.9]:
+            ret += "latency p%-4s: %.3fms\n" % (pct, _percentile(lat, pct) * 1000.0)
+
+        ret += "latency max : %.3fms\n" % ((lat[-1] if lat else 0.0) * 1000.0)
+        return ret
+
+class LoadGenerator(object):
+    """
+    Generates multi-guild, multi-user traffic at a target rate, and drives it
+    through the on_message event handler of a DiscordBot instance that was
+    created with a FakeClient
+    """
+    def __init__(self, bot, num_guilds=10, users_per_guild=10, messages=None,
+                 dm_ratio=0.0, seed=None):
+        self.bot = bot
+        self.messages = DEFAULT_MESSAGES if messages is None else messages
+        self.dm_ratio = dm_ratio
+        self.random = random.Random(seed)
+        self.guilds = []
+        self.channels = {}
+        self.users = {}
+
+        ident = 1000
+        for i in range(num_guilds):
+            guild = FakeGuild("guild%d" % i, ident)
+            ident += 1
+
+            self.guilds.append(guild)
+            self.channels[guild.id] = FakeChannel("general", ident, guild)
+            ident += 1
+
+            users = []
+            for j in range(users_per_guild):
+                users.append(FakeUser("user%d_%d" % (i, j), ident, guild))
+                ident += 1
+
+            self.users[guild.id] = users
+
+    def guild_ids(self):
+        """
+        Returns the guild ID strings that DiscordBotBuilderClient will use for
+        the generated guilds
+        """
+        return ["%s_%s" % (g.name, g.id) for g in self.guilds]
+
+    def next_message(self):
+        guild = self.random.choice(self.guilds)
+        author = self.random.choice(self.users[guild.id])
+        text = self.random.choice(self.messages)
+
+        if self.random.random() < self.dm_ratio:
+            # DM from a guild member
+            if author.dm_channel is None:
+                author.dm_channel = FakeChannel("dm_%s" % author.name, author.id)
+
+            return FakeMessage(text, author, author.dm_channel)
+
+        return FakeMessage(text, author, self.channels[guild.id], guild)
+
+    def _num_responses(self):
+        ret = sum([c.num_sent for c in self.channels.values()])
+        for users in self.users.values():
+            ret += sum([u.dm_channel.num_sent for u in users if u.dm_channel])
+
+        return ret
+
+    async def _deliver(self, message, scheduled, results):
+        try:
+            await self.bot.client.dispatch("on_message", message)
+        except Exception:
+            results.num_errors += 1
+
+        results.latencies.append(time.perf_counter() - scheduled)
+
+    async def run(self, rate=100.0, duration=10.0, count=None):
+        """
+        Send messages at 'rate' messages per second, for 'duration' seconds, or
+        until 'count' messages have been sent if 'count' is set. A rate of 0
+        sends messages as fast as possible.
+
+        :return: LoadTestResults instance
+        """
+        results = LoadTestResults()
+        responses_before = self._num_responses()
+        tasks = []
+
+        start = time.perf_counter()
+        while True:
+            if count is not None:
+                if results.num_messages >= count:
+                    break
+            elif (time.perf_counter() - start) >= duration:
+                break
+
+            if rate > 0:
+                scheduled = start + (results.num_messages / rate)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+
+            message = self.next_message()
+            tasks.append(asyncio.ensure_future(self._deliver(message, scheduled, results)))
+            results.num_messages += 1
+
+            # Give pending deliveries a chance to run
+            if rate <= 0:
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*tasks)
+
+        results.elapsed = time.perf_counter() - start
+        results.num_responses = self._num_responses() - responses_before
+        return results
+
+def create_fake_bot(json_dir, client=None):
+    """
+    Create a DiscordBotBuilderClient that uses a FakeClient, so that it can be
+    driven without connecting to discord
+
+    :param str json_dir: directory to use for guild database files
+    """
+    if client is None:
+        client = FakeClient()
+
+    return DiscordBotBuilderClient('', '', client=client, json_dir=json_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test "
+                                     "for DiscordBotBuilderClient")
+
+    parser.add_argument('-g', '--guilds', type=int, default=10,
+                        help="Number of simulated guilds")
+    parser.add_argument('-u', '--users', type=int, default=10,
+                        help="Number of simulated users per guild")
+    parser.add_argument('-r', '--rate', type=float, default=100.0,
+                        help="Target message rate, in messages per second "
+                        "(0 sends as fast as possible)")
+    parser.add_argument('-d', '--duration', type=float, default=10.0,
+                        help="Test duration in seconds")
+    parser.add_argument('-c', '--count', type=int, default=None,
+                        help="Send this many messages, instead of running "
+                        "for a fixed duration")
+    parser.add_argument('--dm-ratio', type=float, default=0.0,
+                        help="Fraction of messages that should be sent as DMs")
+    parser.add_argument('-m', '--messages', default=None,
+                        help="File containing message text to send, one "
+                        "message per line")
+    parser.add_argument('-j', '--json', default=None,
+                        help="Bot database file to install for every simulated guild")
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help="Random seed for traffic generation")
+    args = parser.parse_args()
+
+    messages = None
+    if args.messages is not None:
+        with open(args.messages, 'r') as fh:
+            messages = [line.rstrip('\n') for line in fh if line.strip()]
+
+    json_dir = tempfile.mkdtemp(prefix="chatbot_builder_load_")
+
+    try:
+        bot = create_fake_bot(json_dir)
+        gen = LoadGenerator(bot, args.guilds, args.users, messages,
+                            args.dm_ratio, args.seed)
+
+        if args.json is not None:
+            for guild_id in gen.guild_ids():
+                shutil.copyfile(args.json, os.path.join(json_dir, "%s.json" % guild_id))
+
+            bot.bots.refresh()
+
+        results = asyncio.run(gen.run(args.rate, args.duration, args.count))
+        print(results.summary())
+    finally:
+        shutil.rmtree(json_dir)
+
+if __name__ == "__main__":
+    main()
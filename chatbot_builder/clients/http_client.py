@@ -0,0 +1,280 @@
+import re
+import json
+import time
+import asyncio
+import argparse
+import http.client
+
+from chatbot_builder.bot_builder_cli import BotBuilderCLI
+from chatbot_builder import constants as const
+from chatbot_builder import metrics
+from chatbot_builder.clients.bot_cache import (BotCache, start_metrics_from_environment,
+                                               tracer_from_environment)
+
+MSG_AUTHOR_FMT_TOKEN = "author"
+
+TEXT_KEY = "text"
+USER_KEY = "user"
+MESSAGES_KEY = "messages"
+RESPONSE_KEY = "response"
+RESPONSES_KEY = "responses"
+ERROR_KEY = "error"
+
+ROUTE_MESSAGE = "messages"
+ROUTE_BATCH = "batch"
+
+# Bot IDs are used as file names, so only allow safe characters
+_route_regex = re.compile(r'^/bots/([A-Za-z0-9_-][A-Za-z0-9_.-]*)/(%s|%s)/?$'
+                          % (ROUTE_MESSAGE, ROUTE_BATCH))
+
+_requests = metrics.registry.counter("chatbot_builder_http_requests_total",
+                                     "HTTP requests handled, by route and status code",
+                                     ["route", "status"])
+_request_seconds = metrics.registry.histogram("chatbot_builder_http_request_seconds",
+                                              "Time spent handling HTTP requests")
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+class HttpBotBuilderCLI(BotBuilderCLI):
+    """
+    BotBuilderCLI for messages received over HTTP. Messages are dicts with a
+    "text" key, and optionally a "user" key naming the sender.
+    """
+    def message_response_extra_format_tokens(self, msg, resp):
+        return {MSG_AUTHOR_FMT_TOKEN: msg.get(USER_KEY, "")}
+
+    def get_message_content(self, msg):
+        return msg[TEXT_KEY]
+
+def _parse_message(item):
+    if isinstance(item, str):
+        return {TEXT_KEY: item}
+
+    if (not isinstance(item, dict)) or (not isinstance(item.get(TEXT_KEY, None), str)):
+        raise HttpError(400, "Each message must be a string, or an object with a "
+                             "string '%s' field" % TEXT_KEY)
+
+    if not isinstance(item.get(USER_KEY, ""), str):
+        raise HttpError(400, "'%s' must be a string" % USER_KEY)
+
+    return item
+
+class BotBuilderHttpServer(object):
+    """
+    asyncio HTTP/1.1 server that passes messages to the bot for a bot ID:
+
+        POST /bots/<bot ID>/messages  {"text": "hello", "user": "bob"}
+            -> {"response": "hi bob"}
+
+        POST /bots/<bot ID>/batch     {"messages": ["hello", {"text": "bye"}]}
+            -> {"responses": ["hi", "see you"]}
+
+        POST /bots/<bot ID>/batch     ["hello", {"text": "bye"}]
+            -> {"responses": ["hi", "see you"]}
+
+    "response" is null if the bot has no response for a message. Messages in
+    a batch are processed in order, as if they were sent one at a time.
+    Connections are kept alive between requests unless the client asks to
+    close them. Bots are stored the same way as for the discord client.
+
+    :param BotCache bots: bots to serve
+    :param str host: address to listen on
+    :param int port: port to listen on (0 picks a free port)
+    """
+    def __init__(self, bots, host=const.HTTP_DEFAULT_HOST, port=const.HTTP_DEFAULT_PORT):
+        self.bots = bots
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    def _process(self, bot_id, msgs):
+        # Returns a response for each message. A bot ID that has never been
+        # programmed has nothing to respond with, so a bot is only created for
+        # it once it is sent a command.
+        cli = self.bots.find(bot_id)
+        ret = []
+
+        for msg in msgs:
+            if cli is None:
+                if not msg[TEXT_KEY].strip().startswith(const.COMMAND_TOKEN):
+                    ret.append(None)
+                    continue
+
+                cli = self.bots.get(bot_id)
+
+            ret.append(cli.process_message(msg))
+
+        return ret
+
+    def handle_request(self, method, path, body):
+        """
+        Handle one request
+
+        :param str method: HTTP method
+        :param str path: request path
+        :param bytes body: request body
+        :return: tuple of the form (route, response object)
+        """
+        m = _route_regex.match(path.split('?', 1)[0])
+        if m is None:
+            raise HttpError(404, "No such endpoint '%s'" % path)
+
+        bot_id, route = m.groups()
+        if method != "POST":
+            raise HttpError(405, "Only POST is supported")
+
+        try:
+            data = json.loads(body.decode('utf-8'))
+        except ValueError:
+            raise HttpError(400, "Request body must be JSON")
+
+        if route == ROUTE_MESSAGE:
+            msg = _parse_message(data)
+            return route, {RESPONSE_KEY: self._process(bot_id, [msg])[0]}
+
+        if isinstance(data, dict):
+            data = data.get(MESSAGES_KEY, None)
+
+        if not isinstance(data, list):
+            raise HttpError(400, "Request body must be a list of messages, or an "
+                                 "object with a '%s' list" % MESSAGES_KEY)
+
+        if len(data) > const.HTTP_MAX_BATCH_SIZE:
+            raise HttpError(413, "At most %d messages are allowed in a batch"
+                            % const.HTTP_MAX_BATCH_SIZE)
+
+        # Check every message before processing any of them
+        msgs = [_parse_message(item) for item in data]
+        return route, {RESPONSES_KEY: self._process(bot_id, msgs)}
+
+    async def _read_request(self, reader):
+        # Returns (method, path, version, headers, body), or None if the
+        # connection was closed before a new request started
+        try:
+            line = await asyncio.wait_for(reader.readline(), const.HTTP_KEEPALIVE_TIMEOUT_SECS)
+        except asyncio.TimeoutError:
+            return None
+
+        if not line:
+            return None
+
+        fields = line.decode('latin-1').split()
+        if len(fields) != 3:
+            raise HttpError(400, "Malformed request line")
+
+        method, path, version = fields
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'transfer-encoding' in headers:
+            raise HttpError(411, "Chunked requests are not supported, send Content-Length")
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+
+        if length > const.HTTP_MAX_BODY_BYTES:
+            raise HttpError(413, "Request body is too large")
+
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method, path, version, headers, body
+
+    def _keep_alive(self, version, headers):
+        connection = headers.get('connection', '').lower()
+        if version == "HTTP/1.0":
+            return connection == "keep-alive"
+
+        return connection != "close"
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                route = "unknown"
+                start = time.perf_counter()
+
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+
+                    method, path, version, headers, body = request
+                    keep_alive = self._keep_alive(version, headers)
+                    route, payload = self.handle_request(method, path, body)
+                    status = 200
+                except HttpError as e:
+                    status = e.status
+                    payload = {ERROR_KEY: str(e)}
+                except asyncio.IncompleteReadError:
+                    break
+                except Exception as e:
+                    status = 500
+                    payload = {ERROR_KEY: "Internal error: %s" % e}
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(("HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                              "Content-Length: %d\r\nConnection: %s\r\n\r\n"
+                              % (status, http.client.responses.get(status, ""), len(data),
+                                 "keep-alive" if keep_alive else "close")).encode('latin-1'))
+                writer.write(data)
+                await writer.drain()
+
+                _requests.labels(route, status).inc()
+                _request_seconds.observe(time.perf_counter() - start)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve bots over HTTP")
+    parser.add_argument('-H', '--host', default=const.HTTP_DEFAULT_HOST,
+                        help="Address to listen on")
+    parser.add_argument('-p', '--port', type=int, default=const.HTTP_DEFAULT_PORT,
+                        help="Port to listen on")
+    parser.add_argument('-j', '--json-dir', default=const.JSON_DIR,
+                        help="Directory for bot database files")
+    args = parser.parse_args()
+
+    start_metrics_from_environment()
+    bots = BotCache(HttpBotBuilderCLI, args.json_dir, hot_reload=True,
+                    tracer=tracer_from_environment())
+
+    server = BotBuilderHttpServer(bots, args.host, args.port)
+    print("Serving bots on http://%s:%d/bots/<bot ID>/" % (args.host, args.port))
+
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bots.stop()
+
+if __name__ == "__main__":
+    main()
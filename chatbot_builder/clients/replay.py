@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from chatbot_builder.clients.discord_client import DiscordBotBuilderCLI
+from chatbot_builder.clients.fake_discord import FakeUser, FakeGuild, FakeChannel, FakeMessage
+from chatbot_builder import capture
+
+RESULTS_VERSION = 1
+
+# Each line of a results file is JSON. The first line is a header object, and
+# the rest are lists of the form [guild key, text, response, microseconds],
+# one per replayed message
+KEY_VERSION = "v"
+KEY_CAPTURE = "capture"
+KEY_REALTIME = "realtime"
+KEY_ELAPSED = "elapsed"
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+
+    index = int(round((pct / 100.0) * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+class ReplayCLI(DiscordBotBuilderCLI):
+    """
+    DiscordBotBuilderCLI for replays. Saving and loading are always allowed,
+    since replays don't run at the original speed, and responses must not
+    depend on timing.
+    """
+    def file_access_allowed(self):
+        return True
+
+class ReplayResults(object):
+    """
+    Responses and latencies for every message in a replayed capture
+
+    :param str capture_dir: capture directory that was replayed
+    :param bool realtime: True if messages were replayed at the original timing
+    """
+    def __init__(self, capture_dir, realtime=False):
+        self.capture_dir = capture_dir
+        self.realtime = realtime
+        self.messages = []
+        self.elapsed = 0.0
+
+    def add(self, guild, text, response, seconds):
+        self.messages.append([guild, text, response, int(round(seconds * 1000000))])
+
+    def throughput(self):
+        if self.elapsed <= 0.0:
+            return 0.0
+
+        return len(self.messages) / self.elapsed
+
+    def latencies(self):
+        """
+        Returns a sorted list of latencies in milliseconds
+        """
+        return sorted([m[3] / 1000.0 for m in self.messages])
+
+    def save(self, filename):
+        with open(filename, 'w', encoding='utf-8') as fh:
+            fh.write(json.dumps({KEY_VERSION: RESULTS_VERSION, KEY_CAPTURE: self.capture_dir,
+                                 KEY_REALTIME: self.realtime,
+                                 KEY_ELAPSED: self.elapsed}) + '\n')
+
+            for message in self.messages:
+                fh.write(json.dumps(message, separators=(',', ':'), ensure_ascii=False) + '\n')
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8') as fh:
+            header = json.loads(fh.readline())
+            if header.get(KEY_VERSION, None) != RESULTS_VERSION:
+                raise ValueError("%s: unsupported results version" % filename)
+
+            ret = cls(header[KEY_CAPTURE], header[KEY_REALTIME])
+            ret.elapsed = header[KEY_ELAPSED]
+            ret.messages = [json.loads(line) for line in fh if line.strip()]
+
+        return ret
+
+    def summary(self):
+        lat = self.latencies()
+        mean = (sum(lat) / len(lat)) if lat else 0.0
+
+        ret = "messages    : %d\n" % len(self.messages)
+        ret += "responses   : %d\n" % len([m for m in self.messages if m[2] is not None])
+        ret += "elapsed     : %.3fs\n" % self.elapsed
+        ret += "throughput  : %.1f msgs/sec\n" % self.throughput()
+        ret += "latency avg : %.3fms\n" % mean
+
+        for pct in [50, 90, 99, 99.9]:
+            ret += "latency p%-4s: %.3fms\n" % (pct, _percentile(lat, pct))
+
+        ret += "latency max : %.3fms\n" % (lat[-1] if lat else 0.0)
+        return ret
+
+def replay(directory, realtime=False, speed=1.0, seed=0):
+    """
+    Replay a capture against the guild bots saved in it. The saved bots are
+    copied to a temporary directory first, so the capture can be replayed any
+    number of times.
+
+    :param str directory: capture directory, as created by a \
+        chatbot_builder.capture.Recorder
+    :param bool realtime: if True, messages are sent at their original times \
+        (divided by 'speed'), otherwise as fast as possible
+    :param float speed: playback speed, if 'realtime' is True
+    :param int seed: seed for the 'random' module, so that random responses \
+        are the same for every replay
+    :return: ReplayResults instance
+    """
+    directory = os.path.expanduser(directory)
+    header, records = capture.read_capture(directory)
+    results = ReplayResults(directory, realtime)
+    workdir = tempfile.mkdtemp(prefix="chatbot_builder_replay_")
+    guilds = {}
+    users = {}
+
+    random.seed(seed)
+
+    try:
+        first = None
+        start = time.perf_counter()
+
+        for record in records:
+            if isinstance(record, dict):
+                key = record[capture.KEY_GUILD]
+                filename = os.path.join(workdir, "%s.json" % key)
+                shutil.copyfile(os.path.join(directory, "%s.json" % key), filename)
+
+                cli = ReplayCLI(json_filename=filename)
+                cli.builder.set_responding_context(record[capture.KEY_RESPONDING])
+                if record[capture.KEY_EDITING] is not None:
+                    cli.builder.load_context(record[capture.KEY_EDITING])
+
+                guild = FakeGuild(key, len(guilds))
+                guilds[key] = (cli, guild, FakeChannel("general", len(guilds), guild))
+                continue
+
+            millis, key, user_key, text = record
+            if realtime:
+                if first is None:
+                    first = millis
+
+                scheduled = start + (((millis - first) / 1000.0) / speed)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+
+            cli, guild, channel = guilds[key]
+            if user_key not in users:
+                users[user_key] = FakeUser(str(user_key), user_key, guild)
+
+            response = cli.process_message(FakeMessage(text, users[user_key], channel, guild))
+            results.add(key, text, response, time.perf_counter() - scheduled)
+
+        results.elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir)
+
+    return results
+
+def _change(old, new):
+    if old == 0.0:
+        return ""
+
+    return "(%+.1f%%)" % (((new - old) / old) * 100.0)
+
+def compare(old, new, num_diffs=10):
+    """
+    Compare the results of replaying the same capture with two builds
+
+    :param ReplayResults old: baseline results
+    :param ReplayResults new: results to compare with the baseline
+    :param int num_diffs: number of differing responses to show
+    :return: tuple of the form (differences, report), where 'differences' is \
+        the number of messages with different responses
+    """
+    if len(old.messages) != len(new.messages):
+        raise ValueError("Results have different numbers of messages (%d and %d), they "
+                         "are not from the same capture" % (len(old.messages),
+                                                            len(new.messages)))
+
+    diffs = [i for i in range(len(old.messages)) if old.messages[i][2] != new.messages[i][2]]
+    old_lat = old.latencies()
+    new_lat = new.latencies()
+
+    rows = [("throughput (msgs/sec)", old.throughput(), new.throughput())]
+    rows.append(("latency avg (ms)", sum(old_lat) / max(1, len(old_lat)),
+                 sum(new_lat) / max(1, len(new_lat))))
+
+    for pct in [50, 90, 99, 99.9]:
+        rows.append(("latency p%s (ms)" % pct, _percentile(old_lat, pct),
+                     _percentile(new_lat, pct)))
+
+    report = "%d messages, %d with different responses\n\n" % (len(old.messages), len(diffs))
+    report += "%-24s %12s %12s\n" % ("", "old", "new")
+    for name, a, b in rows:
+        report += "%-24s %12.3f %12.3f %s\n" % (name, a, b, _change(a, b))
+
+    for i in diffs[:num_diffs]:
+        guild, text, a, _ = old.messages[i]
+        report += ('\nmessage %d (guild %s): "%s"\n  old: %r\n  new: %r\n'
+                   % (i, guild, text, a, new.messages[i][2]))
+
+    return len(diffs), report
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured discord traffic, "
+                                     "and compare the results of different builds")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    p = subparsers.add_parser("run", help="Replay a capture")
+    p.add_argument('capture', help="Capture directory")
+    p.add_argument('-o', '--output', default=None,
+                   help="Write responses and latencies to this file, for 'compare'")
+    p.add_argument('-r', '--realtime', action='store_true',
+                   help="Send messages at their original times, instead of as "
+                   "fast as possible")
+    p.add_argument('-x', '--speed', type=float, default=1.0,
+                   help="Playback speed for --realtime")
+    p.add_argument('-s', '--seed', type=int, default=0,
+                   help="Random seed")
+    p.add_argument('-c', '--compare', default=None,
+                   help="Results file from an earlier replay to compare with")
+
+    p = subparsers.add_parser("compare", help="Compare two results files")
+    p.add_argument('old', help="Baseline results file")
+    p.add_argument('new', help="Results file to compare with the baseline")
+    p.add_argument('-n', '--num', type=int, default=10,
+                   help="Number of differing responses to show")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = replay(args.capture, args.realtime, args.speed, args.seed)
+        print(results.summary())
+
+        if args.output is not None:
+            results.save(args.output)
+
+        if args.compare is None:
+            return
+
+        old = ReplayResults.load(args.compare)
+    else:
+        old = ReplayResults.load(args.old)
+        results = ReplayResults.load(args.new)
+
+    diffs, report = compare(old, results, getattr(args, 'num', 10))
+    print(report)
+    if diffs:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
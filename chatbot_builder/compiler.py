@@ -0,0 +1,664 @@
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import array
+import base64
+import random
+import string
+import hashlib
+import argparse
+import py_compile
+import importlib.util
+
+try:
+    from re import _parser as sre_parse
+    from re import _compiler as sre_compile
+except ImportError:
+    import sre_parse
+    import sre_compile
+
+import _sre
+
+from chatbot_builder.bot_builder import BotBuilder, VariableScope
+from chatbot_builder.lookup_cache import LookupResult
+from chatbot_builder.pattern_dict import PatternDict, group_ends
+from chatbot_builder.normalize import (Normalizer, is_normalized_pattern, normalized_text,
+                                       match_groups)
+from chatbot_builder.regex_lint import pattern_info
+from chatbot_builder.prefilter import MatchSummary
+from chatbot_builder import memory
+from chatbot_builder import constants as const
+
+COMPILER_VERSION = 4
+
+# Compiled bots are saved next to the .json file, e.g. "bot.json" -> "bot.compiled.py"
+COMPILED_SUFFIX = ".compiled.py"
+
+# Regular expressions can be rebuilt directly from their compiled code, without
+# parsing them again, only by the same version of the regex engine
+SRE_VERSION = (sys.version_info[0], sys.version_info[1], _sre.MAGIC, _sre.CODESIZE)
+
+_formatter = string.Formatter()
+
+_HEADER = '''# Generated by chatbot_builder.compiler from %s, do not edit.
+#
+# CONTEXTS: (name, key in parent, parent index or None, variables) for each
+#     context
+# TEMPLATES: (response, text, text fields, assignment, assignment fields,
+#     response fields) for each distinct response, see Template
+# SEGMENTS: (entries, regexes, normalized) for each list of patterns that
+#     are tried in order. Entries are (pattern, template index, next state),
+#     regexes are (source, flags, groups, groupindex, indexgroup, code), and
+#     normalized is True for each regex that matches normalized text
+# NORMALIZATION: normalization options, see chatbot_builder.normalize
+# STATES: segment indices to try, for each responding context. State 0 is the
+#     main context, and state i is CONTEXTS[i - 1].
+# BUDGET: (patterns, contexts, bytes) counted towards the bot's memory budget
+# SUMMARY: prefilter summary of all patterns, see MatchSummary.dump
+'''
+
+def compiled_filename(json_filename):
+    """
+    Returns the name of the compiled module for a bot database file
+    """
+    if json_filename.endswith('.json'):
+        json_filename = json_filename[:-len('.json')]
+
+    return json_filename + COMPILED_SUFFIX
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _split_fields(text):
+    # Returns the (literal text, field name) tuples that format_map would use
+    # for 'text', or None if 'text' uses anything but plain named fields
+    try:
+        fields = list(_formatter.parse(text))
+    except ValueError:
+        return None
+
+    ret = []
+    for literal, name, spec, conversion in fields:
+        if name is not None:
+            if ((name == '') or name.isdigit() or ('.' in name) or ('[' in name) or
+                    spec or (conversion is not None)):
+                return None
+
+        ret.append((literal, name))
+
+    return tuple(ret)
+
+def format_fields(text, fields, tokens):
+    """
+    Same as text.format_map(tokens), using fields split out in advance
+
+    :param str text: text to format
+    :param fields: fields of 'text', or None to use format_map
+    :param tokens: format tokens
+    """
+    if fields is None:
+        return text.format_map(tokens)
+
+    ret = ""
+    for literal, name in fields:
+        ret += literal
+        if name is not None:
+            ret += format(tokens[name])
+
+    return ret
+
+class Template(object):
+    """
+    A response split in advance into text and variable assignments, with the
+    format fields of each
+
+    :ivar raw: the response
+    :ivar text: the response without variable assignments
+    :ivar assignment: variable assignments, or None if there are none
+    """
+    __slots__ = ['raw', 'text', 'text_fields', 'assignment', 'assignment_fields',
+                 'raw_fields']
+
+    def __init__(self, raw, text, text_fields, assignment, assignment_fields, raw_fields):
+        self.raw = raw
+        self.text = text
+        self.text_fields = text_fields
+        self.assignment = assignment
+        self.assignment_fields = assignment_fields
+        self.raw_fields = raw_fields
+
+def _template_data(response):
+    fields = response.split(const.VAR_ASSIGNMENT_SEP)
+    if len(fields) < 2:
+        split = _split_fields(response)
+        return (response, response, split, None, None, split)
+
+    text = const.VAR_ASSIGNMENT_SEP.join(fields[:-1])
+    return (response, text, _split_fields(text), fields[-1], _split_fields(fields[-1]),
+            _split_fields(response))
+
+def _regex_data(compiled):
+    code = None
+    try:
+        parsed = sre_parse.parse(compiled.pattern, compiled.flags)
+        words = array.array('I', sre_compile._code(parsed, compiled.flags))
+        if words.itemsize == _sre.CODESIZE:
+            code = base64.b64encode(zlib.compress(words.tobytes(), 9)).decode('ascii')
+    except Exception:
+        # Regex engine internals are different in this Python version, so the
+        # regex will be parsed when the module is loaded
+        code = None
+
+    indexgroup = [None] * (compiled.groups + 1)
+    for name, index in compiled.groupindex.items():
+        indexgroup[index] = name
+
+    return (compiled.pattern, compiled.flags, compiled.groups, dict(compiled.groupindex),
+            tuple(indexgroup), code)
+
+def _segment_data(entries):
+    # 'entries' is a list of (pattern, template index, next state) tuples.
+    # Patterns are combined in the same way as in a PatternDict.
+    patterns = PatternDict()
+    regexes = []
+    normalized = []
+
+    i = 0
+    while i < len(entries):
+        kind = is_normalized_pattern(entries[i][0])
+        end = i + 1
+        while ((end < len(entries)) and ((end - i) < patterns.groups_per_regex) and
+               (is_normalized_pattern(entries[end][0]) == kind)):
+            end += 1
+
+        block = ['(?P<g%d>^%s$)' % (j, entries[j][0]) for j in range(i, end)]
+        block_regexes = [_regex_data(c) for c in patterns._block_to_regexs(block)]
+        regexes.extend(block_regexes)
+        normalized.extend([kind] * len(block_regexes))
+        i = end
+
+    return (tuple(entries), tuple(regexes), tuple(normalized))
+
+def generate(builder, source_name, digest):
+    """
+    Generate a compiled module for a bot. For each responding context, all
+    the pattern dicts that would be tried are combined in the order they
+    would be tried, so a lookup is one pass over a few regular expressions.
+
+    :param BotBuilder builder: bot to compile
+    :param str source_name: name of the bot database file
+    :param str digest: SHA-256 digest of the bot database file
+    :return: module source code
+    """
+    contexts = []
+    states = {None: 0}
+
+    keys = {}
+
+    stack = list(reversed(list(builder.contexts.items())))
+    while stack:
+        key, ctx = stack.pop()
+        states[ctx] = len(contexts) + 1
+        keys[ctx] = key
+        contexts.append(ctx)
+        stack.extend(reversed(list(ctx.contexts.items())))
+
+    templates = []
+    template_index = {}
+
+    def entry(pattern, response, ctx):
+        if response not in template_index:
+            template_index[response] = len(templates)
+            templates.append(_template_data(response))
+
+        return (pattern, template_index[response], states[ctx])
+
+    # Tried in every state, after the responding context's own patterns
+    shared = [entry(p, r, None) for p, r in builder.responses.iteritems()]
+    if builder.global_entry:
+        index = builder.entry_index.build(builder)
+        shared.extend([entry(p, r, ctx) for p, (ctx, r) in index.iteritems()])
+    else:
+        for ctx in builder.contexts.values():
+            shared.extend([entry(p, r, ctx) for p, r in ctx.entry.iteritems()])
+
+    segments = [_segment_data(shared)]
+    state_segments = [(0,)]
+
+    for ctx in contexts:
+        own = [entry(p, r, ctx) for p, r in ctx.responses.iteritems()]
+        for sub in ctx.contexts.values():
+            own.extend([entry(p, r, sub) for p, r in sub.entry.iteritems()])
+
+        if own:
+            state_segments.append((len(segments), 0))
+            segments.append(_segment_data(own))
+        else:
+            state_segments.append((0,))
+
+    context_data = []
+    for ctx in contexts:
+        parent = None if ctx.parent is None else states[ctx.parent] - 1
+        context_data.append((ctx.name, keys[ctx], parent, dict(ctx.variables)))
+
+    ret = _HEADER % os.path.basename(source_name)
+    ret += "\nCOMPILER_VERSION = %r\n" % COMPILER_VERSION
+    ret += "SOURCE_DIGEST = %r\n" % digest
+    ret += "SRE_VERSION = %r\n" % (SRE_VERSION,)
+    ret += "VARIABLES = %r\n" % (dict(builder.variables),)
+    ret += "CONTEXTS = %r\n" % (tuple(context_data),)
+    ret += "TEMPLATES = %r\n" % (tuple(templates),)
+    ret += "SEGMENTS = %r\n" % (tuple(segments),)
+    ret += "STATES = %r\n" % (tuple(state_segments),)
+    ret += "NORMALIZATION = %r\n" % (tuple(builder.normalizer.options),)
+
+    total = builder.running_total()
+    ret += "BUDGET = %r\n" % ((total.patterns, total.contexts, total.size),)
+    ret += "SUMMARY = %r\n" % (builder.match_summary().dump(),)
+    return ret
+
+def compile_file(json_filename, output=None):
+    """
+    Compile a bot database file to a Python module
+
+    :param str json_filename: bot database file
+    :param str output: module file to write. Default is next to the .json file, \
+        where BotBuilderCLI will find it.
+    :return: name of the module file
+    :raises Exception: if the module can't be loaded. The module file is \
+        removed, so the .json file is used instead.
+    """
+    if output is None:
+        output = compiled_filename(json_filename)
+
+    with open(json_filename, 'rb') as fh:
+        data = fh.read()
+
+    builder = BotBuilder().from_json(json.loads(data.decode('utf-8')))
+    source = generate(builder, json_filename, _digest(data))
+
+    with open(output, 'w', encoding='utf-8') as fh:
+        fh.write(source)
+
+    # Write the bytecode now, so even the first load doesn't parse the module,
+    # and make sure the module can be loaded
+    try:
+        py_compile.compile(output, doraise=True)
+        CompiledBot(load_module(output))
+    except Exception:
+        os.remove(output)
+        raise
+
+    return output
+
+def load_module(filename):
+    """
+    Import a compiled module. Bytecode is cached in __pycache__ like for any
+    other module, so the module is only parsed if it has changed since it was
+    compiled.
+    """
+    name = "_chatbot_builder_compiled_%s" % _digest(filename.encode('utf-8'))[:16]
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_compiled(json_filename):
+    """
+    Load the compiled module for a bot database file, if there is one and it
+    was compiled from the current contents of the file
+
+    :param str json_filename: bot database file
+    :return: CompiledBot instance, or None
+    """
+    filename = compiled_filename(json_filename)
+    if not (os.path.isfile(filename) and os.path.isfile(json_filename)):
+        return None
+
+    try:
+        module = load_module(filename)
+        if getattr(module, 'COMPILER_VERSION', None) != COMPILER_VERSION:
+            print("%s was compiled by a different version, ignoring it" % filename)
+            return None
+
+        with open(json_filename, 'rb') as fh:
+            if module.SOURCE_DIGEST != _digest(fh.read()):
+                print("%s is out of date, ignoring it" % filename)
+                return None
+
+        return CompiledBot(module)
+    except Exception as e:
+        print("Failed to load %s: %s" % (filename, e))
+        return None
+
+def _load_regex(data, use_code):
+    source, flags, groups, groupindex, indexgroup, code = data
+    if use_code and (code is not None):
+        words = array.array('I')
+        words.frombytes(zlib.decompress(base64.b64decode(code)))
+        return _sre.compile(source, flags, words.tolist(), groups, groupindex, indexgroup)
+
+    return re.compile(source, flags)
+
+class CompiledContext(object):
+    """
+    A context in a compiled bot. Only the name, parent and variables are kept,
+    since patterns and responses belong to the compiled segments.
+    """
+    def __init__(self, name, key, parent, variables, state):
+        self.name = name
+        self.key = key
+        self.parent = parent
+        self.variables = dict(variables)
+        self.state = state
+
+class CompiledSegment(object):
+    """
+    A list of patterns that are tried in order, combined into as few regular
+    expressions as possible. Each item in 'regexes' is a tuple of the form
+    (regex, slots, normalized), where 'slots' maps the index of the group
+    wrapping each pattern to (entry, end of the pattern's groups), and
+    'normalized' is True if the regex matches normalized text.
+    """
+    def __init__(self, data, templates, use_code):
+        entries, regexes, normalized = data
+        self.entries = [(pattern, templates[t], state) for pattern, t, state in entries]
+        self.regexes = []
+
+        # Patterns may have named groups of their own
+        wrappers = set(["g%d" % i for i in range(len(self.entries))])
+
+        for regex_data, is_normalized in zip(regexes, normalized):
+            regex = _load_regex(regex_data, use_code)
+            slots = {}
+            for name, end in group_ends(regex, wrappers).items():
+                slots[regex.groupindex[name]] = (self.entries[int(name[1:])], end)
+
+            self.regexes.append((regex, slots, is_normalized))
+
+class CompiledBot(object):
+    """
+    Finds responses using a compiled module, in the same way as a BotBuilder
+    loaded from the same bot database file. Can be used in place of a
+    BotBuilder for responding, via 'responding_context', 'variables',
+    'lookup', 'variable_scope' and 'assign_variable', but can't be changed.
+
+    :param module: module generated by 'generate'
+    """
+    def __init__(self, module):
+        use_code = tuple(module.SRE_VERSION) == SRE_VERSION
+        templates = [Template(*t) for t in module.TEMPLATES]
+
+        self.variables = dict(module.VARIABLES)
+        self.contexts = []
+        for i, (name, key, parent, variables) in enumerate(module.CONTEXTS):
+            parent = None if parent is None else self.contexts[parent]
+            self.contexts.append(CompiledContext(name, key, parent, variables, i + 1))
+
+        segments = [CompiledSegment(s, templates, use_code) for s in module.SEGMENTS]
+        self.states = [[segments[i] for i in s] for s in module.STATES]
+        self.normalizer = Normalizer(module.NORMALIZATION)
+        self.responding_context = None
+        self.summary = MatchSummary.load(module.SUMMARY)
+        self.total = memory.RunningTotal(*module.BUDGET)
+
+    def lookup(self, text, trace=None):
+        """
+        Find the response for the given text, and update the responding context
+
+        :param str text: text to find a response for
+        :param chatbot_builder.tracing.Trace trace: if not None, the lookup is \
+            recorded in this trace
+        :return: LookupResult instance, where 'response' is a Template
+        """
+        state = 0 if self.responding_context is None else self.responding_context.state
+        start = time.perf_counter()
+        chunks = 0
+
+        text = self.normalizer.prepare(text)
+        normalized = None
+
+        for segment in self.states[state]:
+            for regex, slots, is_normalized in segment.regexes:
+                chunks += 1
+                if is_normalized:
+                    if normalized is None:
+                        normalized = normalized_text(text)
+
+                    m = regex.match(normalized)
+                else:
+                    m = regex.match(text)
+
+                if m and m.lastgroup:
+                    (pattern, template, state), end = slots[m.lastindex]
+                    if state == 0:
+                        self.responding_context = None
+                    else:
+                        self.responding_context = self.contexts[state - 1]
+
+                    if trace is not None:
+                        trace.step("compiled", time.perf_counter() - start, chunks, pattern)
+
+                    return LookupResult(template, match_groups(m, end, text, is_normalized),
+                                        pattern, self.responding_context)
+
+        if trace is not None:
+            trace.step("compiled", time.perf_counter() - start, chunks, None)
+
+        return LookupResult(None, None, None, self.responding_context)
+
+    def match_summary(self):
+        """
+        Returns a chatbot_builder.prefilter.MatchSummary of all patterns in the
+        compiled module, as summarized when the module was generated
+        """
+        return self.summary
+
+    def variable_scope(self, context):
+        return VariableScope(self, context)
+
+    def running_total(self):
+        """
+        Returns the size of this bot counted towards its memory budget, as a
+        chatbot_builder.memory.RunningTotal instance
+        """
+        return self.total
+
+    def assign_variable(self, name, value, budget=None):
+        """
+        Same as BotBuilder.assign_variable
+        """
+        if self.responding_context is None:
+            variables = self.variables
+        else:
+            variables = self.responding_context.variables
+
+        size = memory.assignment_size(variables, name, value)
+        if budget is not None:
+            error = budget.check(self, size=size)
+            if error is not None:
+                return error
+
+        variables[name] = value
+        self.total.add(size=size)
+        return None
+
+    def assign_variables(self, template, tokens, budget=None):
+        """
+        Do the variable assignments in a response, like
+        BotBuilderCLI.get_var_assignments_from_response
+
+        :param Template template: response
+        :param tokens: format tokens
+        :param chatbot_builder.memory.Budget budget: if not None, variables are \
+            only set if this would not put the bot over budget
+        :return: tuple of the form (text, fields) for the rest of the response
+        """
+        if template.assignment is None:
+            return template.text, template.text_fields
+
+        try:
+            assignment = format_fields(template.assignment, template.assignment_fields, tokens)
+        except KeyError:
+            return "Invalid format token in variable assignment", None
+
+        for field in assignment.split(','):
+            names = field.split('=')
+            if len(names) != 2:
+                return template.raw, template.raw_fields
+
+            name = names[0].strip()
+            error = self.assign_variable(name, names[1].strip(), budget)
+            if error is not None:
+                return "Can't assign format token '%s', %s" % (name, error), None
+
+        return template.text, template.text_fields
+
+    def transfer_state(self, builder):
+        """
+        Copy the responding context and variables of this bot to a BotBuilder
+        loaded from the same bot database file
+        """
+        builder.variables = dict(self.variables)
+        builder.responding_context = None
+
+        for ctx in self.contexts:
+            copy = self._find(builder, ctx)
+            if copy is not None:
+                copy.variables = dict(ctx.variables)
+                if ctx is self.responding_context:
+                    builder.responding_context = copy
+
+    def _find(self, builder, ctx):
+        # Contexts are found by their keys, since context names are not
+        # necessarily the path to the context
+        keys = []
+        while ctx is not None:
+            keys.insert(0, ctx.key)
+            ctx = ctx.parent
+
+        ret = builder
+        for key in keys:
+            ret = ret.contexts.get(key, None)
+            if ret is None:
+                return None
+
+        return ret
+
+def _sample_texts(builder, count, seed):
+    # Texts that match, or nearly match, the bot's patterns
+    rng = random.Random(seed)
+    candidates = []
+    for _, _, patterns in builder.pattern_dicts():
+        for pattern, _ in patterns.iteritems():
+            try:
+                info = pattern_info(pattern)
+            except Exception:
+                continue
+
+            if info.literals:
+                candidates.extend(info.literals)
+            elif info.prefix:
+                candidates.append(info.prefix)
+
+    words = ["hello", "yes", "no", "what", "the", "12", "ok", "?", "!", " "]
+    if not candidates:
+        candidates = words
+
+    ret = []
+    for _ in range(count):
+        text = rng.choice(candidates)
+        roll = rng.random()
+        if roll < 0.3:
+            text += rng.choice(words)
+        elif roll < 0.4:
+            text = text.upper()
+        elif roll < 0.5:
+            text = rng.choice(words) + " " + text
+
+        if text.strip() and not text.strip().startswith(const.COMMAND_TOKEN):
+            ret.append(text)
+
+    return ret
+
+def verify(json_filename, texts):
+    """
+    Send the same texts to a bot loaded from a bot database file and to the
+    bot's compiled module, and compare the responses. Nothing is saved.
+
+    :param str json_filename: bot database file, which must have an up to date \
+        compiled module
+    :param list texts: texts to send, in order
+    :return: list of (index, text, expected, actual) tuples, for each text \
+        with a different response
+    """
+    from chatbot_builder.bot_builder_cli import BotBuilderCLI
+
+    dynamic = BotBuilderCLI(json_filename, load_compiled=False)
+    compiled = BotBuilderCLI(json_filename, load_compiled=True)
+    if compiled.compiled is None:
+        raise ValueError("%s has no up to date compiled module" % json_filename)
+
+    ret = []
+    for i, text in enumerate(texts):
+        expected = dynamic.process_message(text)
+        actual = compiled.process_message(text)
+        if expected != actual:
+            ret.append((i, text, expected, actual))
+
+    return ret
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile bot database files to "
+                                     "Python modules, which load and respond faster")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    p = subparsers.add_parser("compile", help="Compile bot database files")
+    p.add_argument('json_files', nargs='+', help="Bot database files")
+
+    p = subparsers.add_parser("verify", help="Check that a compiled module gives the "
+                              "same responses as its bot database file")
+    p.add_argument('json_file', help="Bot database file")
+    p.add_argument('-m', '--messages', default=None,
+                   help="File with one message per line to send, instead of "
+                   "generated messages")
+    p.add_argument('-n', '--num', type=int, default=10000,
+                   help="Number of messages to generate")
+    p.add_argument('-s', '--seed', type=int, default=0,
+                   help="Random seed for generating messages")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        for filename in args.json_files:
+            start = time.perf_counter()
+            output = compile_file(filename)
+            print("%s -> %s (%.3fs)" % (filename, output, time.perf_counter() - start))
+
+        return
+
+    if args.messages is None:
+        with open(args.json_file, 'r') as fh:
+            builder = BotBuilder().from_json(json.load(fh))
+
+        texts = _sample_texts(builder, args.num, args.seed)
+    else:
+        with open(args.messages, 'r', encoding='utf-8') as fh:
+            texts = [line.rstrip('\n') for line in fh]
+
+        texts = [t for t in texts if not t.strip().startswith(const.COMMAND_TOKEN)]
+
+    diffs = verify(args.json_file, texts)
+    print("%d messages, %d with different responses" % (len(texts), len(diffs)))
+    for i, text, expected, actual in diffs[:10]:
+        print('\nmessage %d: "%s"\n  expected: %r\n  compiled: %r' % (i, text, expected, actual))
+
+    if diffs:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
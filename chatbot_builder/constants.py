@@ -1,6 +1,9 @@
 DISCORD_SERVER_ENV_VAR = "DISCORD_BOTBUILDER_SERVER"
 DISCORD_TOKEN_ENV_VAR = "DISCORD_BOTBUILDER_TOKEN"
 
+# If set, metrics will be served over HTTP on this port
+DISCORD_METRICS_PORT_ENV_VAR = "DISCORD_BOTBUILDER_METRICS_PORT"
+
 JSON_DIR = "~/.chatbot_builder"
 
 # Input text starting with this will be considered a command
@@ -12,3 +15,121 @@ VAR_ASSIGNMENT_SEP = ';;'
 # Bot commands that access the .JSON file will not be allowed within
 # this many seconds of each other, to help prevent the disk getting spammed
 FILE_ACCESS_DELAY_SECS = 5.0
+
+# Maximum number of response lookup results cached per bot
+LOOKUP_CACHE_SIZE = 1024
+
+# Maximum number of edits that can be undone with the 'undo' command. Dropping
+# unsaved changes will re-load from disk if more edits than this have been made.
+UNDO_HISTORY_SIZE = 256
+
+# Seconds between checks for changed .json files, on systems without inotify
+JSON_POLL_INTERVAL_SECS = 2.0
+
+# What to do when a pattern that may take exponential time to match is added:
+# "reject" it, "warn" about it but add it anyway, or "rewrite" it to avoid
+# backtracking (see chatbot_builder.regex_lint)
+REGEX_LINT_POLICY = "reject"
+
+# If True, all patterns are checked for risky constructs when a bot is loaded
+LINT_ON_LOAD = True
+
+# If set, a sample of response lookups will be traced and written to this file
+DISCORD_TRACE_FILE_ENV_VAR = "DISCORD_BOTBUILDER_TRACE_FILE"
+
+# Fraction of response lookups to trace, between 0.0 and 1.0
+DISCORD_TRACE_SAMPLE_RATE_ENV_VAR = "DISCORD_BOTBUILDER_TRACE_SAMPLE_RATE"
+
+# Trace files are rotated when they reach this size, keeping this many old files
+TRACE_FILE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_FILE_BACKUPS = 3
+
+# Message text recorded in traces is truncated to this many characters
+TRACE_MAX_TEXT = 80
+
+# If set, messages received by the discord client are recorded to a new
+# capture in this directory, for replaying with chatbot_builder.clients.replay
+DISCORD_CAPTURE_DIR_ENV_VAR = "DISCORD_BOTBUILDER_CAPTURE_DIR"
+
+# Secret used to anonymize guild and user IDs in captures. If not set, a random
+# secret is used, so IDs in different captures can't be linked to each other.
+DISCORD_CAPTURE_SECRET_ENV_VAR = "DISCORD_BOTBUILDER_CAPTURE_SECRET"
+
+# Recording stops when a capture file reaches this size
+CAPTURE_MAX_BYTES = 100 * 1024 * 1024
+
+# Profile dumps written by the 'profile' command are saved in this directory
+PROFILE_DIR = "~/.chatbot_builder/profiles"
+
+# Number of messages to profile if no message count or duration is given
+PROFILE_DEFAULT_MESSAGES = 100
+
+# Profiling always stops after this many messages or seconds, whichever is first
+PROFILE_MAX_MESSAGES = 10000
+PROFILE_MAX_SECS = 600.0
+
+# Number of functions and allocation sites shown in profile summaries
+PROFILE_SUMMARY_SIZE = 10
+
+# Number of profile dumps kept for each bot. Older dumps are deleted when a new
+# profile finishes.
+PROFILE_MAX_DUMPS = 5
+
+# Default limits on the size of a single bot. Commands that would take a bot
+# over any of these limits are rejected.
+MAX_PATTERNS_PER_BOT = 10000
+MAX_CONTEXTS_PER_BOT = 1000
+MAX_BYTES_PER_BOT = 32 * 1024 * 1024
+
+# Default for new bots: if True, any context can be entered directly by its
+# entry patterns, not only top-level contexts and subcontexts of the responding
+# context. Can be changed per bot with the 'global' command.
+GLOBAL_CONTEXT_ENTRY = False
+
+# If True, patterns that can't match the same text are tried in order of how
+# often they match, instead of the order they were added in. This never
+# changes which pattern matches a message.
+ADAPTIVE_PATTERN_ORDER = True
+
+# Number of matches in a pattern dict between updates to its pattern order
+PATTERN_REORDER_INTERVAL = 1000
+
+# The pattern order is only changed if that reduces the expected number of
+# patterns tried for each match by at least this fraction
+PATTERN_REORDER_MIN_GAIN = 0.1
+
+# Default address for the HTTP client (chatbot_builder.clients.http_client)
+HTTP_DEFAULT_HOST = "127.0.0.1"
+HTTP_DEFAULT_PORT = 8080
+
+# Requests with bodies larger than this are rejected by the HTTP client
+HTTP_MAX_BODY_BYTES = 1024 * 1024
+
+# Maximum number of messages in one request to the HTTP batch endpoint
+HTTP_MAX_BATCH_SIZE = 1000
+
+# Idle keep-alive connections to the HTTP client are closed after this long
+HTTP_KEEPALIVE_TIMEOUT_SECS = 30.0
+
+# If True, bots are loaded from their compiled module ("<name>.compiled.py",
+# see chatbot_builder.compiler) when it is up to date with the .json file.
+# The .json file is then only loaded when a command needs it.
+LOAD_COMPILED_BOTS = True
+
+# Rows imported from a file (see chatbot_builder.bulk_import) are read and
+# checked in batches of this many rows, so memory use doesn't depend on the
+# size of the file
+IMPORT_BATCH_SIZE = 5000
+
+# Patterns starting with this (a regex comment) match the bot's normalized
+# message text instead of the original text (see chatbot_builder.normalize)
+NORMALIZED_PATTERN_PREFIX = "(?#n)"
+
+# If True, each message is first checked against a summary of all of the bot's
+# patterns (shortest match, and the text that matches must start with), and
+# messages that can't match any pattern skip the response lookup
+PREFILTER_MESSAGES = True
+
+# Length of the message prefixes checked by the summary above. Longer prefixes
+# reject more messages, but take longer to check.
+PREFILTER_PREFIX_LENGTH = 4
@@ -0,0 +1,49 @@
+from chatbot_builder.pattern_dict import PatternDict
+
+class EntryIndex(object):
+    """
+    A single PatternDict holding the entry patterns of every context in a bot,
+    so that any context can be entered with one lookup. Shallower contexts come
+    first; contexts at the same depth keep the order of their parents and
+    siblings, and each context's entry patterns keep their own order. The index
+    is rebuilt the next time it is needed after 'invalidate' is called.
+    """
+    def __init__(self):
+        self.patterns = None
+
+        # Maps group names in the index to (context, group name) tuples for
+        # the entry pattern in the context
+        self.sources = None
+
+    def invalidate(self):
+        self.patterns = None
+        self.sources = None
+
+    def build(self, builder):
+        """
+        Build the index for the given bot, if it is not already built
+
+        :param BotBuilder builder: bot to index
+        :return: PatternDict of the form {pattern: (context, response)}
+        """
+        if self.patterns is not None:
+            return self.patterns
+
+        patterns = PatternDict()
+        sources = {}
+        level = list(builder.contexts.values())
+
+        while level:
+            nextlevel = []
+            for ctx in level:
+                for groupname in ctx.entry.patterns:
+                    pattern, response = ctx.entry.patterns[groupname]
+                    sources[patterns.add(pattern, (ctx, response))] = (ctx, groupname)
+
+                nextlevel.extend(ctx.contexts.values())
+
+            level = nextlevel
+
+        self.sources = sources
+        self.patterns = patterns
+        return patterns
@@ -0,0 +1,155 @@
+import os
+import sys
+import errno
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+# inotify event flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+def _load_inotify():
+    if not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    return libc
+
+class FileWatcher(object):
+    """
+    Watches a directory on a background thread, and calls 'callback' with the
+    full path of any file ending with 'suffix' that is created or modified.
+    Uses inotify where available, and falls back to polling file modification
+    times otherwise.
+
+    :param str directory: directory to watch
+    :param callback: function to call with the path of each changed file
+    :param str suffix: only report files whose names end with this string
+    :param float poll_interval: seconds between directory scans when polling
+    """
+    def __init__(self, directory, callback, suffix='', poll_interval=2.0):
+        self.directory = directory
+        self.callback = callback
+        self.suffix = suffix
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.libc = _load_inotify()
+
+    def uses_inotify(self):
+        return self.libc is not None
+
+    def start(self):
+        target = self._inotify_loop if self.uses_inotify() else self._poll_loop
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _notify(self, filename):
+        if not filename.endswith(self.suffix):
+            return
+
+        try:
+            self.callback(os.path.join(self.directory, filename))
+        except Exception as e:
+            print("Error handling change to %s: %s" % (filename, e))
+
+    def _scan(self):
+        ret = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return ret
+
+        for entry in entries:
+            if not entry.name.endswith(self.suffix):
+                continue
+
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+
+            ret[entry.name] = (st.st_mtime_ns, st.st_size)
+
+        return ret
+
+    def _poll_loop(self):
+        last = self._scan()
+
+        while not self.stop_event.wait(self.poll_interval):
+            current = self._scan()
+            for name in current:
+                if last.get(name, None) != current[name]:
+                    self._notify(name)
+
+            last = current
+
+    def _inotify_loop(self):
+        fd = self.libc.inotify_init()
+        if fd < 0:
+            # Fall back to polling (e.g. if the inotify instance limit is reached)
+            self.libc = None
+            self._poll_loop()
+            return
+
+        try:
+            wd = self.libc.inotify_add_watch(fd, os.fsencode(self.directory),
+                                             IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for %s"
+                              % self.directory)
+
+            while not self.stop_event.is_set():
+                ready, _, _ = select.select([fd], [], [], self.poll_interval)
+                if not ready:
+                    continue
+
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+
+                for name in self._parse_events(data):
+                    self._notify(name)
+        finally:
+            os.close(fd)
+
+    def _parse_events(self, data):
+        ret = []
+        pos = 0
+
+        while (pos + _INOTIFY_EVENT.size) <= len(data):
+            _, mask, _, namelen = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = data[pos:pos + namelen].split(b'\0', 1)[0]
+            pos += namelen
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, report every file
+                ret.extend(self._scan().keys())
+            elif name:
+                name = os.fsdecode(name)
+                if name not in ret:
+                    ret.append(name)
+
+        return ret
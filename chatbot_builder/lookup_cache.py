@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+from chatbot_builder import constants as const
+from chatbot_builder import metrics
+
+_hits = metrics.registry.counter("chatbot_builder_lookup_cache_hits_total",
+                                 "Response lookups served from the lookup cache")
+_misses = metrics.registry.counter("chatbot_builder_lookup_cache_misses_total",
+                                   "Response lookups not found in the lookup cache")
+
+class LookupResult(object):
+    """
+    Result of a single response lookup. 'response', 'groups' and 'pattern' are
+    None if nothing matched. 'context' is the responding context after the
+    lookup (None for the main context)
+    """
+    __slots__ = ['response', 'groups', 'pattern', 'context']
+
+    def __init__(self, response, groups, pattern, context):
+        self.response = response
+        self.groups = groups
+        self.pattern = pattern
+        self.context = context
+
+class LookupCache(object):
+    """
+    Bounded LRU cache of response lookup results, keyed by the responding context
+    the lookup started in (None for the main context) and the message text.
+    Misses are cached too. Entries can be invalidated per responding context.
+    """
+    def __init__(self, maxsize=const.LOOKUP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.texts_by_context = {}
+        self.hits = 0
+        self.misses = 0
+
+        # Incremented whenever entries are dropped because lookups may now give
+        # different results, so anything else derived from the bot's patterns
+        # can tell when it is out of date
+        self.generation = 0
+
+    def get(self, context, text):
+        key = (context, text)
+
+        try:
+            ret = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            _misses.inc()
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        _hits.inc()
+        return ret
+
+    def put(self, context, text, result):
+        if self.maxsize <= 0:
+            return
+
+        key = (context, text)
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+
+        if context not in self.texts_by_context:
+            self.texts_by_context[context] = set()
+
+        self.texts_by_context[context].add(text)
+
+        while len(self.entries) > self.maxsize:
+            (oldctx, oldtext), _ = self.entries.popitem(last=False)
+            texts = self.texts_by_context[oldctx]
+            texts.discard(oldtext)
+            if not texts:
+                del self.texts_by_context[oldctx]
+
+    def invalidate(self, context):
+        """
+        Drop all cached lookups that started in responding context 'context'
+        """
+        self.generation += 1
+        texts = self.texts_by_context.pop(context, None)
+        if texts is None:
+            return
+
+        for text in texts:
+            del self.entries[(context, text)]
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.texts_by_context.clear()
+
+    def stats(self):
+        """
+        Returns a dict of cache statistics
+        """
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (float(self.hits) / total) if total else 0.0
+        }
@@ -0,0 +1,276 @@
+import sys
+
+from chatbot_builder import constants as const
+
+# Memory usage categories
+CATEGORY_PATTERNS = "patterns"
+CATEGORY_COMPILED = "compiled patterns"
+CATEGORY_RESPONSES = "responses"
+CATEGORY_VARIABLES = "variables"
+CATEGORY_CONTEXTS = "contexts"
+CATEGORY_CACHE = "lookup cache"
+CATEGORY_UNDO = "undo history"
+
+CATEGORIES = [CATEGORY_PATTERNS, CATEGORY_COMPILED, CATEGORY_RESPONSES,
+              CATEGORY_VARIABLES, CATEGORY_CONTEXTS, CATEGORY_CACHE, CATEGORY_UNDO]
+
+# Categories counted towards a bot's memory budget. Compiled patterns are
+# derived from the patterns, and the lookup cache and undo history grow and
+# shrink with traffic and edits, so they are left out.
+BUDGETED_CATEGORIES = [CATEGORY_PATTERNS, CATEGORY_RESPONSES, CATEGORY_VARIABLES,
+                       CATEGORY_CONTEXTS]
+
+def format_size(size):
+    for unit in ["B", "KiB", "MiB"]:
+        if abs(size) < 1024:
+            return "%.1f %s" % (size, unit)
+
+        size /= 1024.0
+
+    return "%.1f GiB" % size
+
+def string_size(*strings):
+    """
+    Returns the total size in bytes of the given strings
+    """
+    return sum([sys.getsizeof(s) for s in strings])
+
+def pair_size(groupname, pattern, value):
+    """
+    Returns the size in bytes of a pattern/value pair stored in a PatternDict,
+    as counted by 'measure'
+    """
+    return (sys.getsizeof(groupname) + string_size(pattern) + sys.getsizeof((pattern, value))
+            + sys.getsizeof(value))
+
+def variable_size(name, value):
+    """
+    Returns the size in bytes of a variable, as counted by 'measure'
+    """
+    return sys.getsizeof(name) + sys.getsizeof(value)
+
+def assignment_size(variables, name, value):
+    """
+    Returns the change in size in bytes from setting a variable
+
+    :param dict variables: variables the new value will be set in
+    :param str name: variable name
+    :param str value: new value
+    """
+    ret = variable_size(name, value)
+    if name in variables:
+        ret -= variable_size(name, variables[name])
+
+    return ret
+
+def _dict_size(d):
+    ret = sys.getsizeof(d)
+    for key in d:
+        ret += sys.getsizeof(key) + sys.getsizeof(d[key])
+
+    return ret
+
+class MemoryUsage(object):
+    """
+    Estimated memory retained by a single bot, in bytes, by category. Objects
+    shared between categories or with other bots (e.g. interned strings) are
+    counted every time they are seen, so this is an upper bound on the memory
+    that would be freed by deleting the bot.
+    """
+    def __init__(self):
+        self.categories = {c: 0 for c in CATEGORIES}
+        self.patterns = 0
+        self.contexts = 0
+
+    def total(self):
+        return sum(self.categories.values())
+
+    def budgeted(self):
+        """
+        Returns the part of the total counted towards the memory budget
+        """
+        return sum([self.categories[c] for c in BUDGETED_CATEGORIES])
+
+    def add(self, category, size):
+        self.categories[category] += size
+
+    def describe(self, budget=None):
+        if budget is None:
+            ret = ("Estimated memory use: %s\npatterns: %d\ncontexts: %d\n\n"
+                   % (format_size(self.total()), self.patterns, self.contexts))
+        else:
+            ret = ("Estimated memory use: %s, %s of which counts towards the limit "
+                   "(limit %s)\npatterns: %d (limit %d)\ncontexts: %d (limit %d)\n\n"
+                   % (format_size(self.total()), format_size(self.budgeted()),
+                      format_size(budget.max_bytes), self.patterns, budget.max_patterns,
+                      self.contexts, budget.max_contexts))
+
+        for category in CATEGORIES:
+            ret += "  %-20s %12s\n" % (category, format_size(self.categories[category]))
+
+        return ret
+
+def _measure_pattern_dict(usage, patterns):
+    usage.patterns += len(patterns.patterns)
+    usage.add(CATEGORY_PATTERNS, sys.getsizeof(patterns) + sys.getsizeof(patterns.patterns))
+
+    for groupname in patterns.patterns:
+        pattern, value = patterns.patterns[groupname]
+        usage.add(CATEGORY_PATTERNS, sys.getsizeof(groupname) + string_size(pattern)
+                  + sys.getsizeof(patterns.patterns[groupname]))
+        usage.add(CATEGORY_RESPONSES, sys.getsizeof(value))
+
+    if patterns.compiled:
+        usage.add(CATEGORY_COMPILED, sys.getsizeof(patterns.compiled)
+                  + sum([sys.getsizeof(c) for c in patterns.compiled])
+                  + sys.getsizeof(patterns.normalized))
+
+    # Hit counts and pattern order, for adaptive ordering
+    usage.add(CATEGORY_COMPILED, _dict_size(patterns.hits) + sys.getsizeof(patterns.pattern_keys)
+              + sys.getsizeof(patterns.group_ends))
+    if patterns.match_order is not None:
+        usage.add(CATEGORY_COMPILED, sys.getsizeof(patterns.match_order))
+
+    # Prefilter requirements for each pattern
+    usage.add(CATEGORY_CACHE, sys.getsizeof(patterns.requirements))
+    if patterns.summary is not None:
+        _measure_summary(usage, patterns.summary[1])
+
+def _measure_context(usage, context):
+    usage.contexts += 1
+    usage.add(CATEGORY_CONTEXTS, sys.getsizeof(context) + sys.getsizeof(context.__dict__)
+              + sys.getsizeof(context.contexts) + string_size(context.name))
+    usage.add(CATEGORY_VARIABLES, _dict_size(context.variables))
+
+def _measure_cache(usage, cache):
+    usage.add(CATEGORY_CACHE, sys.getsizeof(cache.entries))
+
+    for key in cache.entries:
+        result = cache.entries[key]
+        usage.add(CATEGORY_CACHE, sys.getsizeof(key) + string_size(key[1])
+                  + sys.getsizeof(result) + sys.getsizeof(result.groups))
+
+def _measure_summary(usage, summary):
+    for requirements in [summary.plain, summary.normalized]:
+        if requirements.prefixes is not None:
+            usage.add(CATEGORY_CACHE, sys.getsizeof(requirements.prefixes)
+                      + string_size(*requirements.prefixes))
+
+def _measure_journal(usage, journal):
+    usage.add(CATEGORY_UNDO, sys.getsizeof(journal))
+
+    for entry in journal:
+        description, undo = entry
+        usage.add(CATEGORY_UNDO, sys.getsizeof(entry) + string_size(description)
+                  + sys.getsizeof(undo))
+
+def measure_context(context):
+    """
+    Estimate the memory retained by a context and all contexts underneath it,
+    not counting compiled patterns
+
+    :param BotContext context: context to measure
+    :return: MemoryUsage instance
+    """
+    usage = MemoryUsage()
+    for ctx in context.walk():
+        _measure_context(usage, ctx)
+        _measure_pattern_dict(usage, ctx.entry)
+        _measure_pattern_dict(usage, ctx.responses)
+
+    return usage
+
+def measure(builder):
+    """
+    Walk a bot and estimate the memory it retains
+
+    :param BotBuilder builder: bot to measure
+    :return: MemoryUsage instance
+    """
+    usage = MemoryUsage()
+
+    for context, is_entry, patterns in builder.pattern_dicts():
+        _measure_pattern_dict(usage, patterns)
+
+    for context in builder.walk():
+        _measure_context(usage, context)
+
+    usage.add(CATEGORY_RESPONSES, sys.getsizeof(builder.default_responses)
+              + string_size(*builder.default_responses))
+    usage.add(CATEGORY_VARIABLES, _dict_size(builder.variables))
+    usage.add(CATEGORY_CONTEXTS, sys.getsizeof(builder.contexts))
+
+    _measure_cache(usage, builder.lookup_cache)
+    if builder.summary is not None:
+        _measure_summary(usage, builder.summary[1])
+
+    _measure_journal(usage, builder.journal)
+    return usage
+
+class RunningTotal(object):
+    """
+    Size of a bot, as counted towards its budget. Measured once, and then kept
+    up to date by each edit, so the budget can be checked without walking the
+    whole bot.
+
+    :param int patterns: number of patterns, including entry patterns
+    :param int contexts: number of contexts
+    :param int size: estimated memory use, in bytes, of BUDGETED_CATEGORIES
+    """
+    def __init__(self, patterns=0, contexts=0, size=0):
+        self.patterns = patterns
+        self.contexts = contexts
+        self.size = size
+
+    def add(self, patterns=0, contexts=0, size=0):
+        self.patterns += patterns
+        self.contexts += contexts
+        self.size += size
+
+def running_total(builder):
+    """
+    Measure a bot, and return its size as a RunningTotal instance
+    """
+    usage = measure(builder)
+    return RunningTotal(usage.patterns, usage.contexts, usage.budgeted())
+
+class Budget(object):
+    """
+    Limits on the size of a single bot
+
+    :param int max_patterns: maximum number of patterns, including entry patterns
+    :param int max_contexts: maximum number of contexts
+    :param int max_bytes: maximum estimated memory use, in bytes
+    """
+    def __init__(self, max_patterns=const.MAX_PATTERNS_PER_BOT,
+                 max_contexts=const.MAX_CONTEXTS_PER_BOT,
+                 max_bytes=const.MAX_BYTES_PER_BOT):
+        self.max_patterns = max_patterns
+        self.max_contexts = max_contexts
+        self.max_bytes = max_bytes
+
+    def check(self, builder, patterns=0, contexts=0, size=0):
+        """
+        Check whether a bot can grow by the given amounts without going over
+        budget
+
+        :param builder: bot to check, a BotBuilder or a \
+            chatbot_builder.compiler.CompiledBot
+        :param int patterns: number of patterns that will be added
+        :param int contexts: number of contexts that will be added
+        :param int size: estimated number of bytes that will be added
+        :return: description of the exceeded limit, or None if within budget
+        """
+        total = builder.running_total()
+
+        if (patterns > 0) and ((total.patterns + patterns) > self.max_patterns):
+            return "this bot already has the maximum of %d patterns" % self.max_patterns
+
+        if (contexts > 0) and ((total.contexts + contexts) > self.max_contexts):
+            return "this bot already has the maximum of %d contexts" % self.max_contexts
+
+        if (size > 0) and ((total.size + size) > self.max_bytes):
+            return ("this bot is already using the maximum of %s of memory"
+                    % format_size(self.max_bytes))
+
+        return None
@@ -0,0 +1,253 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ""
+
+    return "{%s}" % ",".join(['%s="%s"' % (n, _escape(v)) for n, v in pairs])
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric(object):
+    """
+    Base class for metrics. A metric with label names holds one child per
+    distinct set of label values; a metric without label names is its own child
+    """
+    typename = None
+
+    def __init__(self, name, helptext, labelnames=()):
+        self.name = name
+        self.helptext = helptext
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+        if not self.labelnames:
+            self.children[()] = self
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *labelvalues):
+        """
+        Returns the child metric for the given label values. Children are cheap
+        to look up, but callers on a hot path should look them up once and keep
+        a reference
+        """
+        labelvalues = tuple([str(v) for v in labelvalues])
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError("Expected %d label values for metric '%s'"
+                             % (len(self.labelnames), self.name))
+
+        try:
+            return self.children[labelvalues]
+        except KeyError:
+            pass
+
+        with self.lock:
+            if labelvalues not in self.children:
+                self.children[labelvalues] = self._new_child()
+
+            return self.children[labelvalues]
+
+    def remove(self, *labelvalues):
+        """
+        Remove the child metric for the given label values, if any
+        """
+        with self.lock:
+            self.children.pop(tuple([str(v) for v in labelvalues]), None)
+
+    def _samples(self, labelvalues, child):
+        raise NotImplementedError()
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.helptext),
+                 "# TYPE %s %s" % (self.name, self.typename)]
+
+        for labelvalues, child in list(self.children.items()):
+            lines.extend(self._samples(labelvalues, child))
+
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count
+    """
+    typename = "counter"
+
+    def __init__(self, name, helptext, labelnames=()):
+        self.value = 0
+        super(Counter, self).__init__(name, helptext, labelnames)
+
+    def _new_child(self):
+        return Counter(self.name, self.helptext)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def _samples(self, labelvalues, child):
+        return ["%s%s %s" % (self.name, _format_labels(self.labelnames, labelvalues),
+                             _format_value(child.value))]
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. If 'func' is set, it will be called to
+    get the current value whenever the gauge is rendered
+    """
+    typename = "gauge"
+
+    def __init__(self, name, helptext, labelnames=(), func=None):
+        self.value = 0
+        self.func = func
+        super(Gauge, self).__init__(name, helptext, labelnames)
+
+    def _new_child(self):
+        return Gauge(self.name, self.helptext)
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, func):
+        self.func = func
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get(self):
+        if self.func is not None:
+            return self.func()
+
+        return self.value
+
+    def _samples(self, labelvalues, child):
+        return ["%s%s %s" % (self.name, _format_labels(self.labelnames, labelvalues),
+                             _format_value(child.get()))]
+
+class Histogram(_Metric):
+    """
+    Counts observed values in buckets, for latency distributions
+    """
+    typename = "histogram"
+
+    def __init__(self, name, helptext, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        super(Histogram, self).__init__(name, helptext, labelnames)
+
+    def _new_child(self):
+        return Histogram(self.name, self.helptext, buckets=self.bounds)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def _samples(self, labelvalues, child):
+        ret = []
+        total = 0
+        counts = list(child.counts)
+        bounds = list(child.bounds) + [float('inf')]
+
+        for bound, count in zip(bounds, counts):
+            total += count
+            labels = _format_labels(self.labelnames, labelvalues, ("le", _format_value(bound)))
+            ret.append("%s_bucket%s %d" % (self.name, labels, total))
+
+        labels = _format_labels(self.labelnames, labelvalues)
+        ret.append("%s_sum%s %s" % (self.name, labels, _format_value(child.sum)))
+        ret.append("%s_count%s %d" % (self.name, labels, total))
+        return ret
+
+class MetricsRegistry(object):
+    """
+    Collection of named metrics, which can be rendered in the prometheus text
+    exposition format
+    """
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            if name in self.metrics:
+                metric = self.metrics[name]
+                if not isinstance(metric, cls):
+                    raise ValueError("Metric '%s' already registered as %s"
+                                     % (name, metric.typename))
+                return metric
+
+            metric = cls(name, *args, **kwargs)
+            self.metrics[name] = metric
+            return metric
+
+    def counter(self, name, helptext, labelnames=()):
+        return self._register(Counter, name, helptext, labelnames)
+
+    def gauge(self, name, helptext, labelnames=(), func=None):
+        return self._register(Gauge, name, helptext, labelnames, func=func)
+
+    def histogram(self, name, helptext, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, helptext, labelnames, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        return "\n".join([m.render() for m in metrics]) + "\n"
+
+# Default registry used by all chatbot_builder modules
+registry = MetricsRegistry()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+def start_http_server(port, addr='127.0.0.1', metrics_registry=registry):
+    """
+    Serve metrics from 'metrics_registry' over HTTP on a background thread
+
+    :param int port: port number to listen on
+    :param str addr: address to listen on
+    :return: HTTP server instance. Call 'shutdown()' on it to stop serving.
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": metrics_registry})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
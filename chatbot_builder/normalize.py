@@ -0,0 +1,195 @@
+import unicodedata
+
+from chatbot_builder import constants as const
+
+# Normalization options, applied in this order
+OPTION_NFKC = "nfkc"
+OPTION_CASEFOLD = "casefold"
+OPTION_PUNCTUATION = "punctuation"
+OPTION_WHITESPACE = "whitespace"
+
+OPTIONS = [OPTION_NFKC, OPTION_CASEFOLD, OPTION_PUNCTUATION, OPTION_WHITESPACE]
+
+OPTION_DESCRIPTIONS = {
+    OPTION_NFKC: "Unicode NFKC normalization (e.g. full-width and accented forms)",
+    OPTION_CASEFOLD: "case folding (like lowercase, but for all languages)",
+    OPTION_PUNCTUATION: "remove punctuation",
+    OPTION_WHITESPACE: "collapse whitespace to single spaces, and trim both ends"
+}
+
+# ASCII punctuation, by the same definition as for other characters (Unicode
+# category P), for the ASCII fast path
+_ASCII_PUNCTUATION = {i: None for i in range(128)
+                      if unicodedata.category(chr(i)).startswith('P')}
+
+def is_normalized_pattern(pattern):
+    """
+    Returns True if a pattern should match normalized text rather than the
+    original text, i.e. it starts with const.NORMALIZED_PATTERN_PREFIX
+    """
+    return pattern.startswith(const.NORMALIZED_PATTERN_PREFIX)
+
+def _is_punctuation(c):
+    return unicodedata.category(c).startswith('P')
+
+class Normalizer(object):
+    """
+    Normalizes message text for patterns that match normalized text. Never
+    modified once created, so it can be shared between versions of a bot.
+
+    :param options: list of options to apply, from OPTIONS
+    """
+    def __init__(self, options=()):
+        for option in options:
+            if option not in OPTIONS:
+                raise ValueError("Unknown normalization option '%s'" % option)
+
+        self.options = [o for o in OPTIONS if o in options]
+        self.nfkc = OPTION_NFKC in self.options
+        self.casefold = OPTION_CASEFOLD in self.options
+        self.punctuation = OPTION_PUNCTUATION in self.options
+        self.whitespace = OPTION_WHITESPACE in self.options
+
+    def prepare(self, text):
+        """
+        Prepare message text for looking up a response. The normalized text is
+        worked out the first time a pattern needs it, and then shared by every
+        pattern tried for the message.
+
+        :param str text: message text
+        :return: NormalizedText instance, or 'text' if there are no options
+        """
+        if (not self.options) or isinstance(text, NormalizedText):
+            return text
+
+        return NormalizedText(text, self)
+
+    def _normalize_chars(self, chars):
+        if self.nfkc:
+            chars = unicodedata.normalize('NFKC', chars)
+
+        if self.casefold:
+            chars = chars.casefold()
+
+        if self.punctuation:
+            chars = ''.join([c for c in chars if not _is_punctuation(c)])
+
+        return chars
+
+    def normalize(self, text):
+        """
+        Returns the normalized form of some text
+        """
+        if text.isascii():
+            # NFKC doesn't change ASCII text, and case folding is lowercasing
+            if self.punctuation:
+                text = text.translate(_ASCII_PUNCTUATION)
+
+            if self.casefold:
+                text = text.lower()
+
+            if self.whitespace:
+                text = ' '.join(text.split())
+
+            return text
+
+        return self.normalize_with_spans(text)[0]
+
+    def normalize_with_spans(self, text):
+        """
+        Normalize some text, and work out where each normalized character came
+        from. Each character is normalized together with any combining marks
+        that follow it.
+
+        :return: tuple of the form (normalized text, spans), where spans[i] is \
+            the (start, end) span in 'text' of the characters that normalized \
+            character i came from
+        """
+        ret = []
+        spans = []
+        space = None
+        start = 0
+
+        for end in range(1, len(text) + 1):
+            if (end < len(text)) and unicodedata.combining(text[end]):
+                continue
+
+            for c in self._normalize_chars(text[start:end]):
+                if self.whitespace and c.isspace():
+                    if space is None:
+                        space = (start, end)
+
+                    continue
+
+                if space is not None:
+                    if ret:
+                        ret.append(' ')
+                        spans.append(space)
+
+                    space = None
+
+                ret.append(c)
+                spans.append((start, end))
+
+            start = end
+
+        return ''.join(ret), spans
+
+class NormalizedText(str):
+    """
+    Message text (the string value is the original text), with its normalized
+    form, worked out the first time it is needed
+    """
+    def __new__(cls, text, normalizer):
+        ret = super(NormalizedText, cls).__new__(cls, text)
+        ret.normalizer = normalizer
+        ret._normalized = None
+        ret._spans = None
+        return ret
+
+    @property
+    def normalized(self):
+        if self._normalized is None:
+            self._normalized = self.normalizer.normalize(str(self))
+
+        return self._normalized
+
+    def original(self, start, end):
+        """
+        Returns the original text that the normalized text between 'start' and
+        'end' came from
+        """
+        if self._spans is None:
+            self._spans = self.normalizer.normalize_with_spans(str(self))[1]
+
+        if start >= end:
+            return ""
+
+        return str(self)[self._spans[start][0]:self._spans[end - 1][1]]
+
+def normalized_text(text):
+    """
+    Returns the text that patterns matching normalized text should match
+    """
+    return text.normalized if isinstance(text, NormalizedText) else text
+
+def match_groups(m, end, text, normalized):
+    """
+    Returns the groups of the pattern that matched, in a match of combined
+    patterns (see chatbot_builder.pattern_dict.group_ends). For patterns that
+    matched normalized text, groups hold the original text.
+
+    :param m: match object
+    :param int end: index in m.groups() just past the last group of the pattern
+    :param text: text that was looked up
+    :param bool normalized: True if 'm' is a match on the normalized text
+    """
+    if (not normalized) or (not isinstance(text, NormalizedText)):
+        return m.groups()[m.lastindex:end]
+
+    ret = []
+    for i in range(m.lastindex + 1, end + 1):
+        start, stop = m.span(i)
+        ret.append(None if start < 0 else text.original(start, stop))
+
+    return tuple(ret)
@@ -0,0 +1,483 @@
+import re
+import bisect
+
+from chatbot_utils.redict import ReDict
+
+from chatbot_builder.regex_lint import pattern_info
+from chatbot_builder.normalize import is_normalized_pattern, normalized_text, match_groups
+from chatbot_builder.prefilter import MatchSummary, pattern_requirements
+from chatbot_builder import constants as const
+
+def order_keys(pattern):
+    """
+    Describe the strings a pattern can match, for deciding which patterns can
+    be safely reordered. Keys are lowercase ASCII, since patterns are matched
+    ignoring case, and trailing newlines are dropped, since '$' also matches
+    before a newline at the end of the text.
+
+    :param str pattern: pattern to describe
+    :return: list of tuples of the form (text, exact). If 'exact' is True the \
+        pattern can match 'text', otherwise it can match strings starting with \
+        'text'. Returns None if the pattern might match anything.
+    """
+    # Patterns matching normalized text can match different messages than
+    # their keys suggest, so they are never moved
+    if is_normalized_pattern(pattern):
+        return None
+
+    try:
+        info = pattern_info(pattern)
+    except re.error:
+        return None
+
+    if info.unanchored or info.scoped_flags:
+        return None
+
+    if (info.literals is not None) and all([s.isascii() for s in info.literals]):
+        return list(set([(s.lower().rstrip('\n'), True) for s in info.literals]))
+
+    prefix = info.prefix.rstrip('\n')
+    if not prefix:
+        return None
+
+    return [(prefix, False)]
+
+def _order_segment(segment, hits):
+    # 'segment' is a list of (index, keys) tuples. Patterns whose keys overlap
+    # are joined into groups which keep their own order, and the groups are
+    # sorted by hits per pattern, which puts the most frequently matched
+    # patterns first without moving any pattern past one it overlaps with.
+    if len(segment) < 2:
+        return [index for index, _ in segment]
+
+    keys = sorted([(text, exact, i) for i, (_, pkeys) in enumerate(segment)
+                   for text, exact in pkeys])
+    texts = [k[0] for k in keys]
+    parent = list(range(len(segment)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+
+        return i
+
+    # Keys are sorted, so the keys overlapping with each key form a range
+    # starting at that key: equal texts for an exact key, or all texts
+    # starting with the key's text for a prefix key
+    joined = 0
+    for lo, (text, exact, _) in enumerate(keys):
+        if exact:
+            hi = bisect.bisect_right(texts, text)
+        else:
+            hi = bisect.bisect_left(texts, text + '\U0010ffff')
+
+        for j in range(max(lo, joined), hi - 1):
+            parent[find(keys[j][2])] = find(keys[j + 1][2])
+
+        joined = max(joined, hi - 1)
+
+    groups = {}
+    for i in range(len(segment)):
+        groups.setdefault(find(i), []).append(segment[i][0])
+
+    groups = sorted(groups.values(), key=lambda g: (-float(sum([hits[i] for i in g])) / len(g),
+                                                    g[0]))
+    return [index for group in groups for index in group]
+
+def match_order(keys, hits):
+    """
+    Find an order to try patterns in, with the most frequently matched
+    patterns as early as possible, that always gives the same first match as
+    the original order. Two patterns only change places if their keys show
+    that no text can match both of them.
+
+    :param list keys: keys for each pattern in the original order, as \
+        returned by 'order_keys'
+    :param list hits: number of times each pattern has matched
+    :return: list of indices into 'keys'
+    """
+    ret = []
+    segment = []
+
+    for i in range(len(keys)):
+        if keys[i] is None:
+            # Might overlap with anything, so every pattern before it has to
+            # stay before it, and every pattern after it has to stay after it
+            ret.extend(_order_segment(segment, hits))
+            ret.append(i)
+            segment = []
+        else:
+            segment.append((i, keys[i]))
+
+    ret.extend(_order_segment(segment, hits))
+    return ret
+
+def group_ends(compiled, groupnames):
+    """
+    Each pattern is wrapped in a named group when patterns are combined into
+    one regular expression, so a match's groups also include the groups of
+    all later patterns in the same expression. This finds where each
+    pattern's own groups end, so that only those groups are returned.
+
+    :param compiled: compiled regular expression of combined patterns
+    :param groupnames: names of the groups wrapping each pattern
+    :return: dict mapping each group name in 'compiled' to the index, in \
+        match.groups(), just past the last group inside it
+    """
+    wrappers = sorted([(i, g) for g, i in compiled.groupindex.items() if g in groupnames])
+    ret = {}
+
+    for j in range(len(wrappers)):
+        index, groupname = wrappers[j]
+        if (j + 1) < len(wrappers):
+            ret[groupname] = wrappers[j + 1][0] - 1
+        else:
+            ret[groupname] = compiled.groups
+
+    return ret
+
+def _cost(order, hits):
+    # Total number of patterns tried before reaching each hit
+    return sum([hits[index] * position for position, index in enumerate(order)])
+
+class PatternDict(ReDict):
+    """
+    ReDict that can also return the matching pattern along with the value and
+    groups, as a single value rather than via state stored in the dict.
+
+    If 'adaptive' is True, the dict counts how often each pattern matches, and
+    every const.PATTERN_REORDER_INTERVAL matches it may change the order that
+    patterns are tried in, so that frequently matched patterns are tried
+    first (see 'match_order'). The stored order, used for saving and listing
+    patterns, never changes.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PatternDict, self).__init__(*args, **kwargs)
+
+        # Incremented whenever a pattern is added or removed
+        self.version = 0
+        self.frozen_copy = None
+
+        self.adaptive = const.ADAPTIVE_PATTERN_ORDER
+        self.hits = {}
+        self.matches = 0
+
+        # Order that patterns are tried in, as indices into 'patterns', or None
+        # for the stored order. Reset whenever a pattern is added or removed.
+        self.match_order = None
+
+        # Keys for each pattern, as returned by 'order_keys'
+        self.pattern_keys = {}
+
+        # Index of the last group belonging to each pattern, see 'group_ends'
+        self.group_ends = {}
+
+        # True for each compiled regex that matches normalized text
+        self.normalized = []
+
+        # Prefilter requirements for each pattern, as returned by
+        # 'pattern_requirements', and (version, MatchSummary) for all patterns
+        self.requirements = {}
+        self.summary = None
+
+    def __setitem__(self, pattern, value):
+        super(PatternDict, self).__setitem__(pattern, value)
+        self.version += 1
+        self.match_order = None
+
+    def __delitem__(self, pattern):
+        self.remove(pattern)
+
+    def pop(self, text):
+        """
+        Remove the first pattern matching 'text', and return its value
+        """
+        groupname = self.first_match(text)
+        if groupname is None:
+            raise KeyError("No patterns matching '%s' in dict" % text)
+
+        return self.remove_group(groupname)[1]
+
+    def clear(self):
+        super(PatternDict, self).clear()
+        self.hits = {}
+        self.matches = 0
+        self.match_order = None
+        self.version += 1
+
+    def load_from_dict(self, data):
+        self.clear()
+        return super(PatternDict, self).load_from_dict(data)
+
+    def compile(self):
+        """
+        Compile all patterns, in the order they should be tried
+        """
+        groupnames = list(self.patterns.keys())
+        if self.match_order is not None:
+            groupnames = [groupnames[i] for i in self.match_order]
+
+        # Patterns matching normalized text and patterns matching the original
+        # text are never combined into the same regex
+        self.compiled = []
+        self.normalized = []
+        i = 0
+        while i < len(groupnames):
+            kind = is_normalized_pattern(self.patterns[groupnames[i]][0])
+            end = i + 1
+            while ((end < len(groupnames)) and ((end - i) < self.groups_per_regex) and
+                   (is_normalized_pattern(self.patterns[groupnames[end]][0]) == kind)):
+                end += 1
+
+            block = ['(?P<%s>^%s$)' % (g, self.patterns[g][0]) for g in groupnames[i:end]]
+            regexes = self._block_to_regexs(block)
+            self.compiled.extend(regexes)
+            self.normalized.extend([kind] * len(regexes))
+            i = end
+
+        self.group_ends = {}
+        for compiled in self.compiled:
+            self.group_ends.update(group_ends(compiled, self.patterns))
+
+    def _match(self, text):
+        # Returns (match, chunks tried, normalized), for the first compiled
+        # regex that matches
+        normalized = None
+        chunks = 0
+
+        for i in range(len(self.compiled)):
+            chunks += 1
+            if self.normalized[i]:
+                if normalized is None:
+                    normalized = normalized_text(text)
+
+                m = self.compiled[i].match(normalized)
+            else:
+                m = self.compiled[i].match(text)
+
+            if m and m.lastgroup:
+                return m, chunks, self.normalized[i]
+
+        return None, chunks, False
+
+    def _groups(self, m, text, normalized):
+        return match_groups(m, self.group_ends[m.lastgroup], text, normalized)
+
+    def _hit(self, groupname):
+        self.hits[groupname] = self.hits.get(groupname, 0) + 1
+        self.matches += 1
+        if self.matches >= const.PATTERN_REORDER_INTERVAL:
+            self.reorder()
+
+    def reorder(self):
+        """
+        Update the order patterns are tried in, based on the hit counts so far,
+        if that reduces the expected number of patterns tried for each match by
+        at least const.PATTERN_REORDER_MIN_GAIN. Hit counts are halved
+        afterwards, so that the order follows changes in traffic.
+
+        :return: True if the order was changed
+        """
+        groupnames = list(self.patterns.keys())
+        hits = [self.hits.get(g, 0) for g in groupnames]
+
+        # Keys are kept between updates, by pattern
+        keys = {}
+        for g in groupnames:
+            pattern = self.patterns[g][0]
+            if pattern in self.pattern_keys:
+                keys[pattern] = self.pattern_keys[pattern]
+            elif pattern not in keys:
+                keys[pattern] = order_keys(pattern)
+
+        self.pattern_keys = keys
+        self.hits = {groupnames[i]: hits[i] // 2 for i in range(len(hits)) if hits[i] > 1}
+        self.matches = 0
+
+        current = list(range(len(groupnames))) if self.match_order is None else self.match_order
+        new = match_order([keys[self.patterns[g][0]] for g in groupnames], hits)
+
+        if _cost(new, hits) >= (_cost(current, hits) * (1.0 - const.PATTERN_REORDER_MIN_GAIN)):
+            return False
+
+        self.match_order = new
+        self.compiled = None
+        return True
+
+    def match_summary(self):
+        """
+        Returns a chatbot_builder.prefilter.MatchSummary of the patterns in this
+        dict. Requirements are kept for each pattern, so only patterns added
+        since the last summary are described.
+        """
+        if (self.summary is None) or (self.summary[0] != self.version):
+            summary = MatchSummary()
+            requirements = {}
+
+            for pattern, _ in self.iteritems():
+                if pattern not in requirements:
+                    requirements[pattern] = self.requirements.get(pattern, None)
+                    if requirements[pattern] is None:
+                        requirements[pattern] = pattern_requirements(pattern)
+
+                summary.add(pattern, *requirements[pattern])
+
+            self.requirements = requirements
+            self.summary = (self.version, summary)
+
+        return self.summary[1]
+
+    def lookup(self, text):
+        """
+        Find the first pattern matching 'text'
+
+        :param str text: text to match
+        :return: tuple of the form (pattern, value, groups), or None if no \
+            pattern matches
+        """
+        if not self.compiled:
+            self.compile()
+
+        m, _, normalized = self._match(text)
+        if m is None:
+            return None
+
+        pattern, value = self.patterns[m.lastgroup]
+        if self.adaptive:
+            self._hit(m.lastgroup)
+
+        return pattern, value, self._groups(m, text, normalized)
+
+    def __getitem__(self, text):
+        ret = self.lookup(text)
+        if ret is None:
+            raise KeyError("No patterns matching '%s' in dict" % text)
+
+        self.subgroups = ret[2]
+        return ret[1]
+
+    def copy(self):
+        new = PatternDict()
+        for pattern, value in self.iteritems():
+            new[pattern] = value
+
+        return new
+
+    def frozen(self):
+        """
+        Returns a compiled copy of this dict, which must not be modified. The
+        same copy is returned until this dict changes. Since the copy is
+        already compiled and never changes, 'lookup' on the copy is safe to call
+        from many threads at once. The copy tries patterns in the same order as
+        this dict did when the copy was made.
+        """
+        if (self.frozen_copy is None) or (self.frozen_copy[0] != self.version):
+            new = self.copy()
+            new.adaptive = False
+            new.match_order = self.match_order
+            new.compile()
+            self.frozen_copy = (self.version, new)
+
+        return self.frozen_copy[1]
+
+    def add(self, pattern, value):
+        """
+        Add a pattern/value pair
+
+        :return: name of the group the pattern is stored under, or None if \
+            nothing was added
+        """
+        if not pattern:
+            return None
+
+        groupname = "g%d" % self.groupid
+        self.__setitem__(pattern, value)
+        return groupname
+
+    def remove(self, pattern):
+        """
+        Remove the first pair with the given pattern
+
+        :return: tuple of the form (groupname, value, index), which can be \
+            passed to 'restore' to put the pair back where it was
+        """
+        for groupname in self.patterns:
+            if self.patterns[groupname][0] == pattern:
+                _, value, index = self.remove_group(groupname)
+                return groupname, value, index
+
+        raise KeyError("No such pattern in ReDict: '%s'" % pattern)
+
+    def remove_group(self, groupname):
+        """
+        Remove the pair stored under the given group name
+
+        :return: tuple of the form (pattern, value, index), where 'index' can be \
+            passed to 'restore' to put the pair back where it was
+        """
+        index = list(self.patterns.keys()).index(groupname)
+        pattern, value = self.patterns.pop(groupname)
+        self._removed([groupname])
+        return pattern, value, index
+
+    def remove_groups(self, groupnames):
+        """
+        Remove the pairs stored under the given group names, all at once
+        """
+        for groupname in groupnames:
+            del self.patterns[groupname]
+
+        self._removed(groupnames)
+
+    def _removed(self, groupnames):
+        # Forget the order and hit counts of removed groups
+        for groupname in groupnames:
+            self.hits.pop(groupname, None)
+
+        self.compiled = None
+        self.match_order = None
+        self.version += 1
+
+    def restore(self, groupname, pattern, value, index):
+        """
+        Put a removed pattern/value pair back at its original position
+        """
+        items = list(self.patterns.items())
+        items.insert(index, (groupname, (pattern, value)))
+        self.patterns = dict(items)
+        self.compiled = None
+        self.match_order = None
+        self.version += 1
+
+    def first_match(self, text):
+        """
+        Returns the name of the group for the first pattern matching 'text', or
+        None if no pattern matches
+        """
+        if not self.compiled:
+            self.compile()
+
+        m, _, _ = self._match(text)
+        return None if m is None else m.lastgroup
+
+    def traced_lookup(self, text):
+        """
+        Same as 'lookup', but also returns the number of compiled chunks of
+        patterns that were tried
+
+        :return: tuple of the form (result, chunks), where 'result' is the \
+            return value of 'lookup'
+        """
+        if not self.compiled:
+            self.compile()
+
+        m, chunks, normalized = self._match(text)
+        if m is None:
+            return None, chunks
+
+        pattern, value = self.patterns[m.lastgroup]
+        if self.adaptive:
+            self._hit(m.lastgroup)
+
+        return (pattern, value, self._groups(m, text, normalized)), chunks
@@ -0,0 +1,170 @@
+import re
+
+from chatbot_builder.regex_lint import PatternInfo
+from chatbot_builder.normalize import is_normalized_pattern, normalized_text
+from chatbot_builder import constants as const
+
+def pattern_requirements(pattern, prefix_length=const.PREFILTER_PREFIX_LENGTH):
+    """
+    Describe what any text matching a pattern must look like
+
+    :param str pattern: pattern to describe
+    :param int prefix_length: maximum length of the returned prefixes
+    :return: tuple of the form (min length, prefixes), where 'prefixes' is a \
+        list of lowercase ASCII strings, one of which every match starts with \
+        (ignoring case), or None if a match could start with anything
+    """
+    # Not cached here, callers keep the result for each pattern they summarize
+    try:
+        info = PatternInfo(pattern)
+    except re.error:
+        return 0, None
+
+    if info.unanchored or info.scoped_flags:
+        return info.min_length, None
+
+    if info.prefix:
+        return info.min_length, [info.prefix[:prefix_length]]
+
+    if (info.literals is not None) and all([s and s.isascii() for s in info.literals]):
+        return info.min_length, list(set([s[:prefix_length].lower() for s in info.literals]))
+
+    return info.min_length, None
+
+class _Requirements(object):
+    # Requirements shared by a set of patterns, see 'pattern_requirements'
+    def __init__(self):
+        self.count = 0
+        self.min_length = float('inf')
+        self.prefixes = set()
+        self.lengths = set()
+
+    def add(self, min_length, prefixes):
+        self.count += 1
+        self.min_length = min(self.min_length, min_length)
+
+        if prefixes is None:
+            self.prefixes = None
+        elif self.prefixes is not None:
+            self.prefixes.update(prefixes)
+            self.lengths.update([len(p) for p in prefixes])
+
+    def merge(self, other):
+        self.count += other.count
+        self.min_length = min(self.min_length, other.min_length)
+
+        if other.prefixes is None:
+            self.prefixes = None
+        elif self.prefixes is not None:
+            self.prefixes.update(other.prefixes)
+            self.lengths.update(other.lengths)
+
+    def dump(self):
+        if not self.count:
+            return 0, 0, []
+
+        prefixes = None if self.prefixes is None else sorted(self.prefixes)
+        return self.count, self.min_length, prefixes
+
+    def load(self, data):
+        count, min_length, prefixes = data
+        if count:
+            self.count = 0
+            self.add(min_length, prefixes)
+            self.count = count
+
+        return self
+
+    def may_match(self, text):
+        if len(text) < self.min_length:
+            return False
+
+        if self.prefixes is None:
+            return True
+
+        if not self.lengths:
+            # None of the patterns can match anything
+            return False
+
+        head = text[:max(self.lengths)]
+        if not head.isascii():
+            # Some non-ASCII characters match ASCII characters when ignoring
+            # case, e.g. KELVIN SIGN matches 'k'
+            return True
+
+        head = head.lower()
+        for length in self.lengths:
+            if head[:length] in self.prefixes:
+                return True
+
+        return False
+
+class MatchSummary(object):
+    """
+    Summary of all the patterns in a bot, for rejecting messages that can't
+    match any of them without running any regular expressions. Patterns that
+    match normalized text (see chatbot_builder.normalize) are summarized
+    separately, and checked against the normalized text.
+
+    :param patterns: iterable of all patterns that a lookup could try
+    :param int prefix_length: maximum length of message prefixes to check
+    """
+    def __init__(self, patterns=(), prefix_length=const.PREFILTER_PREFIX_LENGTH):
+        self.plain = _Requirements()
+        self.normalized = _Requirements()
+
+        for pattern in patterns:
+            self.add(pattern, *pattern_requirements(pattern, prefix_length))
+
+    def add(self, pattern, min_length, prefixes):
+        """
+        Add a pattern to the summary, see 'pattern_requirements'
+
+        :param str pattern: pattern to add
+        :param int min_length: minimum length of a match
+        :param prefixes: prefixes one of which every match starts with, or None
+        """
+        requirements = self.normalized if is_normalized_pattern(pattern) else self.plain
+        requirements.add(min_length, prefixes)
+
+    def dump(self):
+        """
+        Returns the summary as a tuple of lists, strings and numbers, which can
+        be passed to 'load' to re-create it without describing each pattern again
+        """
+        return self.plain.dump(), self.normalized.dump()
+
+    @classmethod
+    def load(cls, data):
+        """
+        Re-create a summary from the output of 'dump'
+        """
+        ret = cls()
+        ret.plain.load(data[0])
+        ret.normalized.load(data[1])
+        return ret
+
+    def merge(self, other):
+        """
+        Add the patterns summarized by another MatchSummary to this one, without
+        describing each pattern again
+
+        :param MatchSummary other: summary to add
+        """
+        self.plain.merge(other.plain)
+        self.normalized.merge(other.normalized)
+
+    def may_match(self, text):
+        """
+        Returns False if 'text' can't match any of the summarized patterns
+
+        :param str text: message text, as passed to the lookup. To check \
+            normalized patterns, this must be prepared by the bot's normalizer.
+        """
+        if self.plain.count and self.plain.may_match(text):
+            return True
+
+        if self.normalized.count:
+            return self.normalized.may_match(normalized_text(text))
+
+        return False
@@ -0,0 +1,206 @@
+import os
+import re
+import time
+import pstats
+import cProfile
+import tracemalloc
+
+from chatbot_builder import constants as const
+from chatbot_builder.memory import format_size
+
+# Allocations made by the profiler itself are not interesting
+_ALLOCATION_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, __file__)
+]
+
+class Profiler(object):
+    """
+    Profiles CPU time (with cProfile) and memory allocations (with tracemalloc)
+    for the calls made through 'run', until 'messages' calls have been made or
+    'seconds' seconds have passed, whichever is first. Only calls made through
+    'run' are profiled, so other bots running in the same process are not
+    affected.
+
+    :param str name: name used for the profile dump files
+    :param int messages: maximum number of calls to profile
+    :param float seconds: maximum number of seconds to profile for
+    :param str directory: directory to write profile dumps to
+    :raises ValueError: if 'messages' or 'seconds' is not a positive number
+    """
+    def __init__(self, name, messages=None, seconds=None, directory=const.PROFILE_DIR):
+        if ((messages is not None) and not (messages > 0)) or \
+                ((seconds is not None) and not (0 < seconds < float('inf'))):
+            raise ValueError("Message count and duration must be positive")
+
+        if (messages is None) and (seconds is None):
+            messages = const.PROFILE_DEFAULT_MESSAGES
+
+        if messages is None:
+            messages = const.PROFILE_MAX_MESSAGES
+
+        if seconds is None:
+            seconds = const.PROFILE_MAX_SECS
+
+        self.name = re.sub(r'[^\w.-]', '_', name)
+        self.max_messages = min(messages, const.PROFILE_MAX_MESSAGES)
+        self.max_seconds = min(seconds, const.PROFILE_MAX_SECS)
+        self.directory = os.path.expanduser(directory)
+        self.profile = cProfile.Profile(time.process_time)
+        self.allocations = {}
+        self.peak = 0
+        self.messages = 0
+        self.start_time = time.time()
+        self.finished = False
+        self.summary = None
+        self.files = []
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def expired(self):
+        return (self.messages >= self.max_messages) or (self.elapsed() >= self.max_seconds)
+
+    def status(self):
+        return ("Profiling: %d of %d message(s), %.1f of %.1f second(s)"
+                % (self.messages, self.max_messages, self.elapsed(), self.max_seconds))
+
+    def run(self, func, *args):
+        """
+        Call 'func' with the given arguments, and profile it
+        """
+        started_tracemalloc = not tracemalloc.is_tracing()
+        before = None
+
+        if started_tracemalloc:
+            tracemalloc.start()
+        else:
+            before = tracemalloc.take_snapshot()
+
+        self.profile.enable()
+        try:
+            return func(*args)
+        finally:
+            self.profile.disable()
+
+            # 'func' may have finished the profile itself
+            if not self.finished:
+                self.messages += 1
+                self._record_allocations(before, started_tracemalloc)
+
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+    def _record_allocations(self, before, started_tracemalloc):
+        after = tracemalloc.take_snapshot().filter_traces(_ALLOCATION_FILTERS)
+
+        if before is None:
+            stats = after.statistics('lineno')
+        else:
+            before = before.filter_traces(_ALLOCATION_FILTERS)
+            stats = after.compare_to(before, 'lineno')
+
+        for stat in stats:
+            size = stat.size if before is None else stat.size_diff
+            count = stat.count if before is None else stat.count_diff
+            if size <= 0:
+                continue
+
+            site = str(stat.traceback[0])
+            if site not in self.allocations:
+                self.allocations[site] = [0, 0]
+
+            self.allocations[site][0] += size
+            self.allocations[site][1] += count
+
+        if started_tracemalloc:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+
+    def _top_functions(self, stats, count):
+        items = sorted(stats.stats.items(), key=lambda i: i[1][2], reverse=True)
+
+        ret = "%10s %10s %8s  %s\n" % ("own (ms)", "total (ms)", "calls", "function")
+        for (filename, line, funcname), (_, calls, tottime, cumtime, _) in items[:count]:
+            ret += ("%10.3f %10.3f %8d  %s:%d(%s)\n"
+                    % (tottime * 1000.0, cumtime * 1000.0, calls,
+                       os.path.basename(filename), line, funcname))
+
+        return ret
+
+    def _top_allocations(self, count=None):
+        items = sorted(self.allocations.items(), key=lambda i: i[1][0], reverse=True)
+        if count is not None:
+            items = items[:count]
+
+        ret = "%12s %8s  %s\n" % ("size", "blocks", "allocation site")
+        for site, (size, blocks) in items:
+            ret += "%12s %8d  %s\n" % (format_size(size), blocks, site)
+
+        return ret
+
+    def finish(self):
+        """
+        Stop profiling, write the full results to disk, and return a summary
+
+        :return: summary text
+        """
+        if self.finished:
+            return self.summary
+
+        self.profile.disable()
+        self.finished = True
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        basename = os.path.join(self.directory, "%s-%s" % (
+            self.name, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.start_time))))
+
+        summary = ("Profiled %d message(s) over %.1f second(s)\n\n"
+                   % (self.messages, self.elapsed()))
+
+        if self.messages > 0:
+            prof_filename = basename + ".prof"
+            self.profile.dump_stats(prof_filename)
+            self.files.append(prof_filename)
+
+            alloc_filename = basename + ".alloc.txt"
+            with open(alloc_filename, 'w') as fh:
+                fh.write(self._top_allocations())
+
+            self.files.append(alloc_filename)
+
+            stats = pstats.Stats(self.profile)
+            summary += "Top functions by CPU time:\n\n"
+            summary += self._top_functions(stats, const.PROFILE_SUMMARY_SIZE)
+            summary += "\nTop allocation sites (memory still in use after each message):\n\n"
+            summary += self._top_allocations(const.PROFILE_SUMMARY_SIZE)
+
+            if self.peak > 0:
+                summary += "\nPeak traced memory during a message: %s\n" % format_size(self.peak)
+
+            summary += "\nFull results written to:\n\n"
+            summary += "\n".join(["  %s" % f for f in self.files]) + "\n"
+
+            self._delete_old_dumps()
+
+        self.summary = summary
+        return summary
+
+    def _delete_old_dumps(self):
+        # Keep only the newest const.PROFILE_MAX_DUMPS dumps for this bot.
+        # Timestamps in the file names sort in the order they were written.
+        dump_regex = re.compile(r'^%s-\d{8}-\d{6}(\.prof|\.alloc\.txt)$' % re.escape(self.name))
+        dumps = {}
+        for filename in os.listdir(self.directory):
+            m = dump_regex.match(filename)
+            if m is not None:
+                basename = filename[:-len(m.group(1))]
+                dumps.setdefault(basename, []).append(filename)
+
+        old = sorted(dumps.keys())[:-const.PROFILE_MAX_DUMPS]
+        for basename in old:
+            for filename in dumps[basename]:
+                os.remove(os.path.join(self.directory, filename))
@@ -0,0 +1,141 @@
+import threading
+
+from chatbot_builder.bot_builder import BotBuilder, VariableScope, find_response
+from chatbot_builder.entry_index import EntryIndex
+
+class FrozenContext(object):
+    """
+    Read-only copy of a BotContext, belonging to one published BotVersion
+    """
+    __slots__ = ['name', 'entry', 'responses', 'contexts', 'variables', 'parent']
+
+    def __init__(self, context, parent):
+        self.name = context.name
+        self.entry = context.entry.frozen()
+        self.responses = context.responses.frozen()
+        self.variables = dict(context.variables)
+        self.parent = parent
+        self.contexts = {n: FrozenContext(context.contexts[n], self) for n in context.contexts}
+
+class BotVersion(object):
+    """
+    Read-only copy of a BotBuilder at the time it was published. Nothing in a
+    version is ever modified, so any number of threads can look up responses
+    in it at once without locking. Compiled patterns are shared with earlier
+    versions for any pattern dicts that have not changed.
+
+    :param BotBuilder builder: bot to copy
+    :param int number: version number
+    """
+    def __init__(self, builder, number):
+        self.number = number
+        self.responses = builder.responses.frozen()
+        self.variables = dict(builder.variables)
+        self.default_responses = tuple(builder.default_responses)
+        self.global_entry = builder.global_entry
+        self.normalizer = builder.normalizer
+        self.contexts = {n: FrozenContext(builder.contexts[n], None) for n in builder.contexts}
+
+        self.by_name = {}
+        stack = list(self.contexts.values())
+        while stack:
+            ctx = stack.pop()
+            self.by_name[ctx.name] = ctx
+            stack.extend(ctx.contexts.values())
+
+        self.entry_index = EntryIndex()
+        if self.global_entry:
+            index = self.entry_index.build(self)
+            index.adaptive = False
+            index.compile()
+
+    def context(self, name):
+        """
+        Returns the context with the given full name (e.g. "weather::rain"),
+        or None if there is no such context in this version
+        """
+        if name is None:
+            return None
+
+        return self.by_name.get(name, None)
+
+    def lookup(self, text, context=None):
+        """
+        Find the response for some text
+
+        :param str text: text to find a response for
+        :param FrozenContext context: responding context to start in, or None \
+            for the main context
+        :return: chatbot_builder.lookup_cache.LookupResult instance. The \
+            'context' attribute is the new responding context.
+        """
+        return find_response(self, context, text)
+
+    def variable_scope(self, context):
+        return VariableScope(self, context)
+
+class ConcurrentBot(object):
+    """
+    Lets many threads look up responses in a bot while it is being edited,
+    using read-copy-update. Readers always use the most recently published
+    BotVersion, and never take a lock. Edits are made to the BotBuilder by one
+    writer at a time, and a new version is published when each edit is done.
+    Publishing a version is a single attribute assignment, so readers see
+    either the old version or the new one, never a partial edit.
+
+    Conversation state is not kept here: each reader passes in the name of its
+    responding context, and gets the new one back in the lookup result.
+
+    :param BotBuilder builder: bot to serve. Once passed in, it should only be \
+        changed through 'edit', or followed by a call to 'publish'.
+    """
+    def __init__(self, builder=None):
+        self.builder = BotBuilder() if builder is None else builder
+        self.write_lock = threading.Lock()
+        self.version = BotVersion(self.builder, 1)
+
+    def current(self):
+        """
+        Returns the most recently published version
+        """
+        return self.version
+
+    def lookup(self, text, context_name=None):
+        """
+        Find the response for some text in the current version
+
+        :param str text: text to find a response for
+        :param str context_name: full name of the responding context to start \
+            in, or None for the main context
+        :return: tuple of the form (result, context_name), where 'result' is \
+            a LookupResult and 'context_name' is the name of the new \
+            responding context (None for the main context)
+        """
+        version = self.version
+        result = version.lookup(text, version.context(context_name))
+        return result, (None if result.context is None else result.context.name)
+
+    def edit(self, func, *args, **kwargs):
+        """
+        Call func(builder, *args, **kwargs) with the write lock held, then
+        publish a new version. For example:
+
+            bot.edit(BotBuilder.add_response, "hello", "hi there")
+
+        :return: return value of 'func'
+        """
+        with self.write_lock:
+            ret = func(self.builder, *args, **kwargs)
+            self._publish()
+
+        return ret
+
+    def publish(self):
+        """
+        Publish a new version, after the BotBuilder was changed directly
+        """
+        with self.write_lock:
+            self._publish()
+
+    def _publish(self):
+        self.version = BotVersion(self.builder, self.version.number + 1)
@@ -0,0 +1,266 @@
+from chatbot_builder.regex_lint import pattern_info
+from chatbot_builder.normalize import is_normalized_pattern
+
+class ShadowedPattern(object):
+    """
+    A pattern that can never match, because every message it matches is matched
+    by an earlier pattern ('shadowed_by') first
+    """
+    def __init__(self, context, is_entry, groupname, pattern, shadowed_by):
+        self.context = context
+        self.is_entry = is_entry
+        self.groupname = groupname
+        self.pattern = pattern
+        self.shadowed_by = shadowed_by
+
+class UnreachableContext(object):
+    """
+    A context that can never become the responding context
+    """
+    def __init__(self, context, reason):
+        self.context = context
+        self.reason = reason
+
+class Analysis(object):
+    """
+    Shadowed patterns and unreachable contexts found in a bot. Patterns inside
+    unreachable contexts are not listed separately.
+    """
+    def __init__(self, shadowed, unreachable):
+        self.shadowed = shadowed
+        self.unreachable = unreachable
+
+    def empty(self):
+        return (not self.shadowed) and (not self.unreachable)
+
+    def describe(self):
+        ret = ""
+        for s in self.shadowed:
+            ctxname = "main context" if s.context is None else "context '%s'" % s.context.name
+            kind = "entry pattern" if s.is_entry else "pattern"
+            ret += ('%s "%s" in %s is shadowed by "%s"\n'
+                    % (kind, s.pattern, ctxname, s.shadowed_by))
+
+        for u in self.unreachable:
+            ret += "context '%s' is unreachable: %s\n" % (u.context.name, u.reason)
+
+        return ret
+
+class _Earlier(object):
+    # The patterns that are tried before a particular pattern: some complete
+    # pattern dicts, plus the patterns before it in its own pattern dict
+    def __init__(self, stores, own):
+        self.stores = stores
+        self.own = own
+        self.positions = {g: i for i, g in enumerate(own.patterns)}
+        self.seen = {}
+        self.any_line = {}
+
+        for store in stores + [own]:
+            for groupname in store.patterns:
+                pattern = store.patterns[groupname][0]
+                self._add(store, groupname, pattern)
+
+    def _add(self, store, groupname, pattern):
+        self.seen.setdefault(pattern, (store, groupname))
+        if is_normalized_pattern(pattern):
+            return
+
+        try:
+            info = pattern_info(pattern)
+        except Exception:
+            return
+
+        if (info.any_line is not None) and (not info.scoped_flags):
+            if info.any_line not in self.any_line:
+                self.any_line[info.any_line] = (store, groupname, pattern)
+
+    def _before(self, store, groupname, own_groupname):
+        # True if the pattern stored under 'groupname' in 'store' is tried
+        # before the pattern stored under 'own_groupname' in the own store
+        if store is not self.own:
+            return True
+
+        return self.positions[groupname] < self.positions[own_groupname]
+
+    def _first_match(self, text, own_groupname):
+        for store in self.stores + [self.own]:
+            groupname = store.first_match(text)
+            if groupname is None:
+                continue
+
+            if self._before(store, groupname, own_groupname):
+                pattern = store.patterns[groupname][0]
+                if is_normalized_pattern(pattern):
+                    # Matches normalized text, so the match on 'text' says
+                    # nothing about which messages it matches
+                    return None
+
+                try:
+                    if pattern_info(pattern).scoped_flags:
+                        return None
+                except Exception:
+                    return None
+
+                return pattern
+
+            return None
+
+        return None
+
+    def shadowing(self, groupname, pattern):
+        """
+        Returns an earlier pattern that shadows the pattern stored under
+        'groupname' in the own store, or None if it can't be shown to be shadowed
+        """
+        if pattern in self.seen:
+            store, other = self.seen[pattern]
+            if self._before(store, other, groupname):
+                return pattern
+
+        # Patterns matching normalized text are not analysed, since the
+        # messages they match depend on the bot's normalization options
+        if is_normalized_pattern(pattern):
+            return None
+
+        try:
+            info = pattern_info(pattern)
+        except Exception:
+            return None
+
+        if info.scoped_flags or info.unanchored:
+            return None
+
+        # Everything that doesn't contain a newline is matched by '.*'
+        if '\n' not in info.chars:
+            for lo in [0, 1]:
+                if lo not in self.any_line:
+                    continue
+
+                store, other, anyline = self.any_line[lo]
+                if (lo == 1) and info.nullable:
+                    continue
+
+                if self._before(store, other, groupname):
+                    return anyline
+
+        # Patterns that match a finite set of strings are shadowed if all of the
+        # strings are matched by earlier patterns. '$' also matches before a
+        # trailing newline, so check that too.
+        if info.literals is None:
+            return None
+
+        ret = None
+        for literal in info.literals:
+            for text in [literal, literal + "\n"]:
+                ret = self._first_match(text, groupname)
+                if ret is None:
+                    return None
+
+        return ret
+
+def _find_shadowed(stores, own, context, is_entry):
+    earlier = _Earlier(stores, own)
+    ret = []
+
+    for groupname in own.patterns:
+        pattern = own.patterns[groupname][0]
+        by = earlier.shadowing(groupname, pattern)
+        if by is not None:
+            ret.append(ShadowedPattern(context, is_entry, groupname, pattern, by))
+
+    return ret
+
+def _global_shadowed(builder):
+    # Entry patterns that can never match through the global entry index. When
+    # the main context is responding, the index is tried right after the main
+    # context's responses.
+    index = builder.entry_index.build(builder)
+    ret = {}
+
+    for s in _find_shadowed([builder.responses], index, None, True):
+        ctx, groupname = builder.entry_index.sources[s.groupname]
+        if ctx not in ret:
+            ret[ctx] = {}
+
+        ret[ctx][groupname] = ShadowedPattern(ctx, True, groupname, s.pattern, s.shadowed_by)
+
+    return ret
+
+def _analyze_contexts(parent_responses, contexts, parent_reachable, global_shadowed,
+                      shadowed, unreachable):
+    # Returns True if any context in 'contexts', or underneath them, is reachable
+    any_reachable = False
+    entries = []
+
+    for name in contexts:
+        ctx = contexts[name]
+        stores = [parent_responses] + entries
+        entries.append(ctx.entry)
+
+        # Entry patterns that can't match when the parent context is responding
+        found = None
+        if parent_reachable:
+            found = _find_shadowed(stores, ctx.entry, ctx, True)
+
+        # In global entry mode, they may still match through the global index
+        if global_shadowed is not None:
+            by_index = global_shadowed.get(ctx, {})
+            if found is None:
+                found = list(by_index.values())
+            else:
+                found = [s for s in found if s.groupname in by_index]
+
+        reachable = (len(ctx.entry) > 0) and (len(found) < len(ctx.entry))
+        if reachable:
+            shadowed.extend(found)
+            shadowed.extend(_find_shadowed([], ctx.responses, ctx, False))
+
+        # Subcontexts of an unreachable context can still be entered directly
+        # in global entry mode
+        mark = len(unreachable)
+        children_reachable = False
+        if reachable or (global_shadowed is not None):
+            children_reachable = _analyze_contexts(ctx.responses, ctx.contexts, reachable,
+                                                   global_shadowed, shadowed, unreachable)
+
+        if reachable or children_reachable:
+            any_reachable = True
+            continue
+
+        # Subcontexts are removed along with their parent, so don't list them
+        del unreachable[mark:]
+        if len(ctx.entry) == 0:
+            reason = "it has no entry patterns"
+        else:
+            reason = "all of its entry patterns are shadowed by earlier patterns"
+
+        unreachable.append(UnreachableContext(ctx, reason))
+
+    return any_reachable
+
+def analyze(builder):
+    """
+    Find patterns that can never match because they are shadowed by earlier
+    patterns, and contexts that can never be entered. Shadowing is detected
+    exactly for patterns that match a small, finite set of strings, and for
+    patterns covered by an earlier catch-all pattern like '(.*)'. Other patterns
+    are assumed to be reachable.
+
+    :param BotBuilder builder: bot to analyse
+    :return: Analysis instance
+    """
+    shadowed = _find_shadowed([], builder.responses, None, False)
+    unreachable = []
+
+    global_shadowed = None
+    if builder.global_entry:
+        global_shadowed = _global_shadowed(builder)
+
+    # Entry patterns for top-level contexts are only tried after the responses
+    # in the main context, and entry patterns for subcontexts are only tried
+    # after the responses in the parent context (or through the global entry
+    # index, in global entry mode)
+    _analyze_contexts(builder.responses, builder.contexts, True, global_shadowed,
+                      shadowed, unreachable)
+    return Analysis(shadowed, unreachable)
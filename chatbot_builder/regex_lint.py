@@ -0,0 +1,809 @@
+import re
+import functools
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+from chatbot_builder.normalize import is_normalized_pattern
+from chatbot_builder import constants as const
+
+# Finding severities
+SEVERITY_EXPONENTIAL = "exponential"
+SEVERITY_POLYNOMIAL = "polynomial"
+
+# Policies for handling patterns with exponential findings
+POLICY_REJECT = "reject"
+POLICY_WARN = "warn"
+POLICY_REWRITE = "rewrite"
+
+_MAXREPEAT = sre_constants.MAXREPEAT
+_REPEATS = [sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT]
+_POSSESSIVE_REPEAT = getattr(sre_constants, "POSSESSIVE_REPEAT", None)
+_ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+# Characters used to approximate the set of characters each part of a pattern
+# can match, for detecting overlap between parts of a pattern
+_ALPHABET = [chr(i) for i in range(128)] + list(" éßλ 中")
+_ANY = frozenset([c for c in _ALPHABET if c != '\n'])
+_ALL = frozenset(_ALPHABET)
+
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: lambda c: c.isdigit(),
+    sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_constants.CATEGORY_SPACE: lambda c: c.isspace(),
+    sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == '_',
+    sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == '_'),
+}
+
+_CATEGORY_TEXT = {
+    sre_constants.CATEGORY_DIGIT: '\\d',
+    sre_constants.CATEGORY_NOT_DIGIT: '\\D',
+    sre_constants.CATEGORY_SPACE: '\\s',
+    sre_constants.CATEGORY_NOT_SPACE: '\\S',
+    sre_constants.CATEGORY_WORD: '\\w',
+    sre_constants.CATEGORY_NOT_WORD: '\\W',
+}
+
+_AT_TEXT = {
+    sre_constants.AT_BEGINNING: '^',
+    sre_constants.AT_BEGINNING_STRING: '\\A',
+    sre_constants.AT_END: '$',
+    sre_constants.AT_END_STRING: '\\Z',
+    sre_constants.AT_BOUNDARY: '\\b',
+    sre_constants.AT_NON_BOUNDARY: '\\B',
+}
+
+_FLAG_TEXT = [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.ASCII, 'a')]
+
+class Finding(object):
+    """
+    A construct in a pattern that may cause super-linear matching time
+    """
+    def __init__(self, severity, message):
+        self.severity = severity
+        self.message = message
+
+    def __str__(self):
+        return "%s: %s" % (self.severity, self.message)
+
+    def __repr__(self):
+        return self.__str__()
+
+class LintResult(object):
+    """
+    Result of linting a single pattern. 'pattern' is the pattern to use, which
+    is the rewritten pattern if the pattern was rewritten. 'rejected' is True if
+    the pattern should not be added.
+    """
+    def __init__(self, pattern, findings, rejected=False, rewritten=False):
+        self.pattern = pattern
+        self.findings = findings
+        self.rejected = rejected
+        self.rewritten = rewritten
+
+    def exponential(self):
+        return [f for f in self.findings if f.severity == SEVERITY_EXPONENTIAL]
+
+    def describe(self):
+        return "\n".join(["  %s" % f for f in self.findings])
+
+def _items(sub):
+    return sub.data if hasattr(sub, 'data') else sub
+
+def _is_repeat(op):
+    return (op in _REPEATS) or ((_POSSESSIVE_REPEAT is not None) and (op == _POSSESSIVE_REPEAT))
+
+def _is_atomic(op):
+    return ((_POSSESSIVE_REPEAT is not None) and (op == _POSSESSIVE_REPEAT) or
+            (_ATOMIC_GROUP is not None) and (op == _ATOMIC_GROUP))
+
+def _with_case(chars):
+    # Patterns are always matched with re.IGNORECASE
+    ret = set(chars)
+    for c in chars:
+        ret.add(c.lower())
+        ret.add(c.upper())
+
+    return frozenset([c for c in ret if c in _ALL])
+
+def _in_set(items):
+    negate = False
+    tests = []
+
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            tests.append(lambda c, v=av: ord(c) == v)
+        elif op == sre_constants.RANGE:
+            tests.append(lambda c, v=av: v[0] <= ord(c) <= v[1])
+        elif op == sre_constants.CATEGORY:
+            tests.append(_CATEGORIES.get(av, lambda c: True))
+        else:
+            tests.append(lambda c: True)
+
+    ret = [c for c in _ALPHABET if any([t(c) for t in tests])]
+    ret = _with_case(ret)
+    if negate:
+        ret = _ALL - ret
+
+    return ret
+
+def _chars(op, av):
+    # Set of characters matched by a single-character node, or None
+    if op == sre_constants.LITERAL:
+        return _with_case([chr(av)])
+    elif op == sre_constants.NOT_LITERAL:
+        return _ALL - _with_case([chr(av)])
+    elif op == sre_constants.ANY:
+        return _ANY
+    elif op == sre_constants.IN:
+        return _in_set(av)
+
+    return None
+
+def _body(op, av):
+    # Sub-sequences contained in a node
+    if _is_repeat(op):
+        return [av[2]]
+    elif op == sre_constants.SUBPATTERN:
+        return [av[-1]]
+    elif op == sre_constants.BRANCH:
+        return av[1]
+    elif (_ATOMIC_GROUP is not None) and (op == _ATOMIC_GROUP):
+        return [av]
+    elif op == sre_constants.GROUPREF_EXISTS:
+        return [b for b in av[1:] if b is not None]
+
+    return []
+
+def _all_chars(items):
+    # All characters that may be consumed anywhere in a sequence
+    ret = frozenset()
+    for op, av in _items(items):
+        chars = _chars(op, av)
+        if chars is not None:
+            ret |= chars
+        elif op == sre_constants.GROUPREF:
+            ret |= _ALL
+        elif op not in [sre_constants.ASSERT, sre_constants.ASSERT_NOT]:
+            for body in _body(op, av):
+                ret |= _all_chars(body)
+
+    return ret
+
+def _node_first(op, av, reverse=False):
+    # Returns (set of chars that can start (or end, if reverse) a match, nullable)
+    chars = _chars(op, av)
+    if chars is not None:
+        return chars, False
+
+    if _is_repeat(op):
+        first, nullable = _first(av[2], reverse)
+        return first, nullable or (av[0] == 0)
+    elif op == sre_constants.BRANCH:
+        ret = frozenset()
+        nullable = False
+        for alt in av[1]:
+            first, n = _first(alt, reverse)
+            ret |= first
+            nullable = nullable or n
+
+        return ret, nullable
+    elif op == sre_constants.GROUPREF_EXISTS:
+        ret, nullable = _first(av[1], reverse)
+        if av[2] is None:
+            return ret, True
+
+        first, n = _first(av[2], reverse)
+        return ret | first, nullable or n
+    elif op == sre_constants.GROUPREF:
+        return _ALL, True
+    elif op in [sre_constants.SUBPATTERN] or ((_ATOMIC_GROUP is not None) and (op == _ATOMIC_GROUP)):
+        return _first(_body(op, av)[0], reverse)
+
+    # Zero-width assertions
+    return frozenset(), True
+
+def _first(items, reverse=False):
+    items = _items(items)
+    if reverse:
+        items = list(reversed(items))
+
+    ret = frozenset()
+    for op, av in items:
+        first, nullable = _node_first(op, av, reverse)
+        ret |= first
+        if not nullable:
+            return ret, False
+
+    return ret, True
+
+def _ambiguous_repeat(items, follow):
+    # Look for a variable-length part of a sequence that can consume the same
+    # characters as whatever may follow it. 'follow' is the set of characters
+    # that may follow the sequence. Atomic groups and possessive repeats are
+    # never ambiguous.
+    for op, av in reversed(_items(items)):
+        if _is_atomic(op):
+            pass
+        elif _is_repeat(op):
+            lo, hi, body = av
+            if (lo != hi) and (_all_chars(body) & follow):
+                return True
+
+            if _ambiguous_repeat(body, follow | _first(body)[0]):
+                return True
+        elif op == sre_constants.BRANCH:
+            for alt in av[1]:
+                if _ambiguous_repeat(alt, follow):
+                    return True
+
+            if _node_first(op, av)[1] and (_all_chars([(op, av)]) & follow):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _ambiguous_repeat(av[-1], follow):
+                return True
+
+        first, nullable = _node_first(op, av)
+        follow = (first | follow) if nullable else first
+
+    return False
+
+def _has_repeat(items):
+    for op, av in _items(items):
+        if _is_atomic(op):
+            continue
+
+        if _is_repeat(op) and (av[1] > 1):
+            return True
+
+        if op not in [sre_constants.ASSERT, sre_constants.ASSERT_NOT]:
+            for body in _body(op, av):
+                if _has_repeat(body):
+                    return True
+
+    return False
+
+def _literal_text(items):
+    # Returns the text matched by a sequence of literals, or None
+    ret = ""
+    for op, av in _items(items):
+        if op != sre_constants.LITERAL:
+            return None
+
+        ret += chr(av)
+
+    return ret.lower()
+
+def _ambiguous_branch(alts):
+    firsts = [_first(alt) for alt in alts]
+    for i in range(len(alts)):
+        for j in range(i + 1, len(alts)):
+            if firsts[i][1] and firsts[j][1]:
+                # Both can match the empty string. The parser factors common
+                # prefixes out of alternatives, so e.g. (a|a) becomes a(|).
+                return True
+
+            if not (firsts[i][0] & firsts[j][0]):
+                continue
+
+            a = _literal_text(alts[i])
+            b = _literal_text(alts[j])
+            if (a is not None) and (b is not None):
+                # Literal alternatives only overlap if one is a prefix of the other
+                if not (a.startswith(b) or b.startswith(a)):
+                    continue
+
+            return True
+
+    return False
+
+def _branches(items):
+    # Find alternations in a sequence, looking through groups but not repeats
+    ret = []
+    for op, av in _items(items):
+        if op == sre_constants.BRANCH:
+            ret.append(av[1])
+            for alt in av[1]:
+                ret.extend(_branches(alt))
+        elif op == sre_constants.SUBPATTERN:
+            ret.extend(_branches(av[-1]))
+
+    return ret
+
+def _flatten(items):
+    # Expand groups inline, so that adjacent repeats inside groups can be compared
+    ret = []
+    for op, av in _items(items):
+        if op == sre_constants.SUBPATTERN:
+            ret.extend(_flatten(av[-1]))
+        else:
+            ret.append((op, av))
+
+    return ret
+
+def _check_adjacent(items, findings):
+    items = _flatten(items)
+
+    for i in range(len(items)):
+        op, av = items[i]
+        if not (_is_repeat(op) and (op != _POSSESSIVE_REPEAT) and (av[1] == _MAXREPEAT)):
+            continue
+
+        chars = _all_chars(av[2])
+        for j in range(i + 1, len(items)):
+            op2, av2 = items[j]
+            if _is_repeat(op2) and (av2[1] == _MAXREPEAT):
+                if chars & _all_chars(av2[2]):
+                    findings.append((None, Finding(SEVERITY_POLYNOMIAL,
+                        "adjacent repetitions can match the same characters")))
+                    return
+
+            if not _node_first(op2, av2)[1]:
+                break
+
+def _check(items, findings):
+    # Appends (node, Finding) tuples to 'findings'. 'node' is the repeat that
+    # should be made possessive to fix the finding, if any.
+    _check_adjacent(items, findings)
+
+    for op, av in _items(items):
+        if _is_atomic(op):
+            if _POSSESSIVE_REPEAT is not None and op == _POSSESSIVE_REPEAT:
+                _check(av[2], findings)
+            else:
+                _check(av, findings)
+            continue
+
+        if _is_repeat(op) and (av[1] > 1):
+            body = av[2]
+            first, nullable = _first(body)
+
+            if nullable and _has_repeat(body):
+                findings.append(((op, av), Finding(SEVERITY_EXPONENTIAL,
+                    "repeated group can match the empty string and contains a repetition")))
+            elif _ambiguous_repeat(body, first):
+                findings.append(((op, av), Finding(SEVERITY_EXPONENTIAL,
+                    "nested repetition can match the same text in many ways")))
+            else:
+                for alts in _branches(body):
+                    if _ambiguous_branch(alts):
+                        findings.append(((op, av), Finding(SEVERITY_EXPONENTIAL,
+                            "repeated alternation has overlapping alternatives")))
+                        break
+
+        if op not in [sre_constants.ASSERT, sre_constants.ASSERT_NOT]:
+            for body in _body(op, av):
+                _check(body, findings)
+        else:
+            _check(av[1], findings)
+
+def _escape(code):
+    return re.escape(chr(code))
+
+def _unparse_in(items):
+    ret = "["
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            ret += "^"
+        elif op == sre_constants.LITERAL:
+            ret += _escape(av)
+        elif op == sre_constants.RANGE:
+            ret += "%s-%s" % (_escape(av[0]), _escape(av[1]))
+        elif op == sre_constants.CATEGORY:
+            ret += _CATEGORY_TEXT[av]
+        else:
+            raise ValueError("Can't unparse %s in character set" % op)
+
+    return ret + "]"
+
+def _flags_text(flags):
+    return "".join([c for f, c in _FLAG_TEXT if flags & f])
+
+def _is_single(items):
+    # True if a sequence can be quantified without wrapping it in a group
+    items = _items(items)
+    if len(items) != 1:
+        return False
+
+    op, av = items[0]
+    return ((_chars(op, av) is not None) or
+            ((op == sre_constants.SUBPATTERN) and (av[0] is not None)))
+
+def _unparse(items, names, possessive):
+    ret = ""
+    for op, av in _items(items):
+        if op == sre_constants.LITERAL:
+            ret += _escape(av)
+        elif op == sre_constants.NOT_LITERAL:
+            ret += "[^%s]" % _escape(av)
+        elif op == sre_constants.ANY:
+            ret += "."
+        elif op == sre_constants.IN:
+            if (len(av) == 1) and (av[0][0] == sre_constants.CATEGORY):
+                ret += _CATEGORY_TEXT[av[0][1]]
+            else:
+                ret += _unparse_in(av)
+        elif op == sre_constants.AT:
+            ret += _AT_TEXT[av]
+        elif op == sre_constants.BRANCH:
+            ret += "(?:%s)" % "|".join([_unparse(alt, names, possessive) for alt in av[1]])
+        elif op == sre_constants.SUBPATTERN:
+            group, add_flags, del_flags, body = av
+            body = _unparse(body, names, possessive)
+            if group is None:
+                flags = _flags_text(add_flags)
+                if del_flags:
+                    flags += "-" + _flags_text(del_flags)
+                ret += "(?%s:%s)" % (flags, body)
+            elif group in names:
+                ret += "(?P<%s>%s)" % (names[group], body)
+            else:
+                ret += "(%s)" % body
+        elif _is_repeat(op):
+            lo, hi, body = av
+            if _is_single(body):
+                ret += _unparse(body, names, possessive)
+            else:
+                ret += "(?:%s)" % _unparse(body, names, possessive)
+
+            if (lo, hi) == (0, _MAXREPEAT):
+                ret += "*"
+            elif (lo, hi) == (1, _MAXREPEAT):
+                ret += "+"
+            elif (lo, hi) == (0, 1):
+                ret += "?"
+            elif lo == hi:
+                ret += "{%d}" % lo
+            elif hi == _MAXREPEAT:
+                ret += "{%d,}" % lo
+            else:
+                ret += "{%d,%d}" % (lo, hi)
+
+            if (op == _POSSESSIVE_REPEAT) or (id(av) in possessive):
+                ret += "+"
+            elif op == sre_constants.MIN_REPEAT:
+                ret += "?"
+        elif op == sre_constants.GROUPREF:
+            ret += "(?:\\%d)" % av
+        elif op in [sre_constants.ASSERT, sre_constants.ASSERT_NOT]:
+            direction, body = av
+            ret += "(?%s%s%s)" % ("<" if direction < 0 else "",
+                                  "=" if op == sre_constants.ASSERT else "!",
+                                  _unparse(body, names, possessive))
+        elif op == sre_constants.GROUPREF_EXISTS:
+            group, yes, no = av
+            ret += "(?(%d)%s" % (group, _unparse(yes, names, possessive))
+            if no is not None:
+                ret += "|%s" % _unparse(no, names, possessive)
+            ret += ")"
+        elif (_ATOMIC_GROUP is not None) and (op == _ATOMIC_GROUP):
+            ret += "(?>%s)" % _unparse(av, names, possessive)
+        else:
+            raise ValueError("Can't unparse %s" % op)
+
+    return ret
+
+def _rewrite(parsed, nodes):
+    # Make the given repeat nodes possessive, so they never backtrack
+    names = {gid: name for name, gid in parsed.state.groupdict.items()}
+    possessive = set([id(av) for _, av in nodes])
+    ret = _unparse(parsed, names, possessive)
+
+    flags = _flags_text(parsed.state.flags & ~re.UNICODE)
+    if flags:
+        ret = "(?%s:%s)" % (flags, ret)
+
+    return ret
+
+@functools.lru_cache(maxsize=4096)
+def _lint(pattern):
+    parsed = sre_parse.parse(pattern)
+    found = []
+    _check(parsed, found)
+
+    findings = []
+    nodes = []
+    for node, finding in found:
+        if str(finding) not in [str(f) for f in findings]:
+            findings.append(finding)
+
+        if node is not None:
+            nodes.append(node)
+
+    rewritten = None
+    if nodes and (_POSSESSIVE_REPEAT is not None):
+        try:
+            rewritten = _rewrite(parsed, nodes)
+            if is_normalized_pattern(pattern):
+                # Comments are lost when unparsing
+                rewritten = const.NORMALIZED_PATTERN_PREFIX + rewritten
+
+            re.compile(rewritten)
+        except (ValueError, re.error):
+            rewritten = None
+
+    return tuple(findings), rewritten
+
+def find_risky_constructs(pattern):
+    """
+    Find constructs in a regular expression that may cause super-linear
+    matching time.
+
+    :param str pattern: regular expression to check
+    :return: list of Finding instances
+    :raises re.error: if the pattern is invalid
+    """
+    return list(_lint(pattern)[0])
+
+def lint_pattern(pattern, policy=const.REGEX_LINT_POLICY):
+    """
+    Check a pattern, and apply a policy to patterns with exponential findings.
+    With POLICY_REWRITE, risky repetitions are made possessive (which requires
+    python 3.11 or later, and otherwise falls back to POLICY_REJECT). This may
+    change what some ambiguous patterns match.
+
+    :param str pattern: regular expression to check
+    :param str policy: one of POLICY_REJECT, POLICY_WARN or POLICY_REWRITE
+    :return: LintResult instance
+    :raises re.error: if the pattern is invalid
+    """
+    findings, rewritten = _lint(pattern)
+    findings = list(findings)
+    exponential = [f for f in findings if f.severity == SEVERITY_EXPONENTIAL]
+
+    if (not exponential) or (policy == POLICY_WARN):
+        return LintResult(pattern, findings)
+
+    if (policy == POLICY_REWRITE) and (rewritten is not None):
+        remaining = list(_lint(rewritten)[0])
+        if not [f for f in remaining if f.severity == SEVERITY_EXPONENTIAL]:
+            return LintResult(rewritten, findings, rewritten=True)
+
+    return LintResult(pattern, findings, rejected=True)
+
+def check_pattern(pattern, policy=const.REGEX_LINT_POLICY):
+    """
+    Check a pattern before it is added to a bot, and apply a lint policy
+
+    :param str pattern: regular expression to check
+    :param str policy: one of POLICY_REJECT, POLICY_WARN or POLICY_REWRITE
+    :return: tuple of the form (pattern, error, warning), where 'pattern' may \
+        have been rewritten according to the policy, and 'error' and 'warning' \
+        are messages for the user, or None
+    """
+    # The regex engine raises OverflowError and RecursionError, as well as
+    # re.error, for some patterns it can't compile
+    try:
+        _ = re.compile(pattern)
+    except (re.error, OverflowError, RecursionError):
+        return None, "Invalid regular expression", None
+
+    try:
+        result = lint_pattern(pattern, policy)
+    except re.error:
+        return None, "Invalid regular expression", None
+
+    if result.rejected:
+        return None, ("Pattern rejected, it may take a very long time to match some "
+                      "messages:\n\n%s" % result.describe()), None
+
+    warning = None
+    if result.rewritten:
+        warning = ("Pattern was rewritten to '%s' to avoid taking a very long time "
+                   "to match some messages:\n\n%s" % (result.pattern, result.describe()))
+    elif result.findings:
+        warning = ("Warning, pattern may be slow to match some messages:\n\n%s"
+                   % result.describe())
+
+    return result.pattern, None, warning
+
+def lint_bot(builder):
+    """
+    Find risky patterns in all contexts of a BotBuilder instance
+
+    :param BotBuilder builder: bot to check
+    :return: list of tuples of the form (context, is_entry, pattern, findings). \
+        'context' is None for the main context.
+    """
+    ret = []
+    for context, is_entry, patterns in builder.pattern_dicts():
+        for pattern in patterns.keys():
+            try:
+                findings = find_risky_constructs(pattern)
+            except (re.error, RecursionError, ValueError):
+                continue
+
+            if findings:
+                ret.append((context, is_entry, pattern, findings))
+
+    return ret
+
+def _has_scoped_flags(items):
+    for op, av in _items(items):
+        if (op == sre_constants.SUBPATTERN) and (av[1] or av[2]):
+            return True
+
+        if op in [sre_constants.ASSERT, sre_constants.ASSERT_NOT]:
+            bodies = [av[1]]
+        else:
+            bodies = _body(op, av)
+
+        for body in bodies:
+            if _has_scoped_flags(body):
+                return True
+
+    return False
+
+def _expand(items, limit):
+    # Returns the list of strings matched by a sequence, if it only matches a
+    # small, finite set of strings. Otherwise returns None.
+    ret = [""]
+    for op, av in _items(items):
+        if op == sre_constants.LITERAL:
+            options = [chr(av)]
+        elif (op == sre_constants.IN) and all([o == sre_constants.LITERAL for o, _ in av]):
+            options = [chr(v) for _, v in av]
+        elif op == sre_constants.SUBPATTERN:
+            options = _expand(av[-1], limit)
+        elif op == sre_constants.BRANCH:
+            options = []
+            for alt in av[1]:
+                strings = _expand(alt, limit)
+                if strings is None:
+                    return None
+
+                options.extend(strings)
+        elif (op in _REPEATS) and (av[1] <= limit):
+            body = _expand(av[2], limit)
+            if body is None:
+                return None
+
+            options = []
+            for count in range(av[0], av[1] + 1):
+                strings = [""]
+                for _ in range(count):
+                    strings = [a + b for a in strings for b in body]
+                    if len(strings) > limit:
+                        return None
+
+                options.extend(strings)
+        elif (op == sre_constants.AT) and (av in [sre_constants.AT_BEGINNING,
+                                                  sre_constants.AT_BEGINNING_STRING,
+                                                  sre_constants.AT_END,
+                                                  sre_constants.AT_END_STRING]):
+            # Patterns are always anchored at the start and end
+            options = [""]
+        else:
+            return None
+
+        if options is None:
+            return None
+
+        ret = [a + b for a in ret for b in options]
+        if len(ret) > limit:
+            return None
+
+    return ret
+
+def _prefix(items):
+    # Returns (text, complete), where 'text' is the lowercase ASCII text that
+    # every match of a sequence starts with, and 'complete' is True if the
+    # whole sequence is just that text
+    ret = ""
+    for op, av in _items(items):
+        if op == sre_constants.SUBPATTERN:
+            text, complete = _prefix(av[-1])
+            ret += text
+            if not complete:
+                return ret, False
+
+            continue
+
+        if (op == sre_constants.AT) and (av in [sre_constants.AT_BEGINNING,
+                                                sre_constants.AT_BEGINNING_STRING]):
+            continue
+
+        if op == sre_constants.LITERAL:
+            chars = set([chr(av).lower()])
+        elif (op == sre_constants.IN) and all([o == sre_constants.LITERAL for o, _ in av]):
+            # e.g. '[Hh]'
+            chars = set([chr(v).lower() for _, v in av])
+        else:
+            return ret, False
+
+        c = chars.pop()
+        if chars or (not c.isascii()):
+            return ret, False
+
+        ret += c
+
+    return ret, True
+
+def _top_level_alternation(pattern):
+    # ReDict wraps each pattern as '^pattern$' without a group, so a pattern
+    # like 'a|b' matches anything starting with 'a'
+    depth = 0
+    in_class = False
+    escape = False
+
+    for i, c in enumerate(pattern):
+        if escape:
+            escape = False
+        elif c == '\\':
+            escape = True
+        elif in_class:
+            if (c == ']') and (pattern[i - 1] != '['):
+                in_class = False
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif (c == '|') and (depth == 0):
+            return True
+
+    return False
+
+class PatternInfo(object):
+    """
+    Facts about the set of strings a pattern can match, for analysing patterns
+
+    :ivar literals: list of all strings the pattern matches (ignoring case), if \
+        it only matches a small, finite set of strings, otherwise None
+    :ivar chars: approximate set of characters the pattern can consume
+    :ivar nullable: False if the pattern definitely can't match an empty string
+    :ivar scoped_flags: True if the pattern changes any regex flags
+    :ivar any_line: if the pattern is equivalent to '.*' or '.+' (possibly in \
+        a group), the minimum number of characters it matches, otherwise None
+    :ivar unanchored: True if the pattern has a top-level alternation, which \
+        means it also matches any text that starts with one of the alternatives
+    :ivar prefix: lowercase ASCII text that every match starts with (ignoring \
+        case), possibly empty
+    :ivar int min_length: minimum number of characters in a match
+    """
+    def __init__(self, pattern, literal_limit=64):
+        parsed = sre_parse.parse(pattern)
+        self.pattern = pattern
+        self.unanchored = _top_level_alternation(pattern)
+        self.chars = _ALL if self.unanchored else _all_chars(parsed)
+        self.nullable = _first(parsed)[1]
+        self.scoped_flags = (_has_scoped_flags(parsed) or
+                             bool(parsed.state.flags & ~(re.UNICODE | re.IGNORECASE)))
+        self.literals = None
+        self.any_line = None
+        self.prefix = ""
+        self.min_length = parsed.getwidth()[0]
+
+        if self.unanchored:
+            return
+
+        self.prefix = _prefix(parsed)[0]
+
+        self.literals = _expand(parsed, literal_limit)
+        if self.literals is not None:
+            self.literals = list(dict.fromkeys(self.literals))
+
+        items = _flatten(parsed)
+        if (len(items) == 1) and (items[0][0] in _REPEATS):
+            lo, hi, body = items[0][1]
+            body = _flatten(body)
+            if ((len(body) == 1) and (body[0][0] == sre_constants.ANY) and
+                    (lo <= 1) and (hi == _MAXREPEAT)):
+                self.any_line = lo
+
+@functools.lru_cache(maxsize=4096)
+def pattern_info(pattern):
+    """
+    Returns a PatternInfo instance for a pattern
+
+    :raises re.error: if the pattern is invalid
+    """
+    return PatternInfo(pattern)
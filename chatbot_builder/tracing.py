@@ -0,0 +1,217 @@
+import os
+import time
+import json
+import random
+import logging
+import logging.handlers
+import argparse
+
+from chatbot_builder import constants as const
+
+# Keys used in trace records. Records are written one per line as JSON, with
+# short keys and times in microseconds to keep trace files small.
+KEY_TIME = "t"
+KEY_BOT = "b"
+KEY_TEXT = "m"
+KEY_START_CONTEXT = "c0"
+KEY_END_CONTEXT = "c1"
+KEY_CACHED = "h"
+KEY_STEPS = "s"
+KEY_PATTERN = "p"
+KEY_LOOKUP_US = "l"
+KEY_FORMAT_US = "f"
+
+def _usecs(seconds):
+    return int(round(seconds * 1000000))
+
+def _context_name(context):
+    return None if context is None else context.name
+
+class Trace(object):
+    """
+    Record of a single response lookup. Each pattern dict that was tried is
+    recorded as a step of the form [store, microseconds, chunks tried, matched
+    pattern], where 'store' is "responses" for the main context,
+    "responses:<name>" for a context, "entry:<name>" for a context's entry
+    patterns, "entry:*" for the global entry index, or "compiled" for a bot
+    loaded from its compiled module
+    """
+    def __init__(self, bot, text, start_context):
+        self.bot = bot
+        self.text = text[:const.TRACE_MAX_TEXT]
+        self.start_context = _context_name(start_context)
+        self.end_context = None
+        self.cached = False
+        self.steps = []
+        self.pattern = None
+        self.lookup_seconds = 0.0
+        self.format_seconds = 0.0
+        self.timestamp = time.time()
+
+    def step(self, store, seconds, chunks, pattern):
+        self.steps.append([store, _usecs(seconds), chunks, pattern])
+
+    def finish(self, result, lookup_seconds, format_seconds=0.0):
+        """
+        Record the result of the lookup
+
+        :param chatbot_builder.lookup_cache.LookupResult result: lookup result
+        :param float lookup_seconds: total time spent finding a response
+        :param float format_seconds: time spent formatting the response
+        """
+        self.end_context = _context_name(result.context)
+        self.pattern = result.pattern
+        self.lookup_seconds = lookup_seconds
+        self.format_seconds = format_seconds
+
+    def to_record(self):
+        return {
+            KEY_TIME: round(self.timestamp, 3),
+            KEY_BOT: self.bot,
+            KEY_TEXT: self.text,
+            KEY_START_CONTEXT: self.start_context,
+            KEY_END_CONTEXT: self.end_context,
+            KEY_CACHED: int(self.cached),
+            KEY_STEPS: self.steps,
+            KEY_PATTERN: self.pattern,
+            KEY_LOOKUP_US: _usecs(self.lookup_seconds),
+            KEY_FORMAT_US: _usecs(self.format_seconds)
+        }
+
+class Tracer(object):
+    """
+    Decides which lookups to trace, and writes finished traces to a rotating
+    file. One tracer can be shared by many bots.
+
+    :param str filename: file to write traces to
+    :param float sample_rate: fraction of lookups to trace, between 0.0 and 1.0
+    :param int max_bytes: rotate the file when it reaches this size
+    :param int backup_count: number of rotated files to keep
+    """
+    def __init__(self, filename, sample_rate=1.0, max_bytes=const.TRACE_FILE_MAX_BYTES,
+                 backup_count=const.TRACE_FILE_BACKUPS, seed=None):
+        self.filename = os.path.expanduser(filename)
+        self.sample_rate = sample_rate
+        self.random = random.Random(seed)
+        self.handler = logging.handlers.RotatingFileHandler(
+            self.filename, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def sample(self):
+        """
+        Returns True if the next lookup should be traced
+        """
+        if self.sample_rate >= 1.0:
+            return True
+
+        return self.random.random() < self.sample_rate
+
+    def begin(self, bot, text, start_context):
+        return Trace(bot, text, start_context)
+
+    def write(self, trace):
+        msg = json.dumps(trace.to_record(), separators=(',', ':'))
+        record = logging.LogRecord("chatbot_builder.tracing", logging.INFO,
+                                   __file__, 0, msg, None, None)
+        self.handler.handle(record)
+
+    def close(self):
+        self.handler.close()
+
+def read_traces(filename):
+    """
+    Read all trace records from a trace file and its rotated backups, oldest
+    first. Lines that can't be parsed (e.g. partially written) are skipped.
+
+    :param str filename: trace file name
+    :return: list of trace records
+    """
+    filename = os.path.expanduser(filename)
+    filenames = [filename]
+
+    i = 1
+    while os.path.isfile("%s.%d" % (filename, i)):
+        filenames.insert(0, "%s.%d" % (filename, i))
+        i += 1
+
+    ret = []
+    for name in filenames:
+        if not os.path.isfile(name):
+            continue
+
+        with open(name, 'r') as fh:
+            for line in fh:
+                try:
+                    ret.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    return ret
+
+def summarize(records, num_slowest=10):
+    """
+    Summarize trace records: time spent in each store across all traces, and
+    the slowest individual traces
+
+    :param list records: trace records, as returned by 'read_traces'
+    :param int num_slowest: number of slowest traces to show
+    :return: summary text
+    """
+    if not records:
+        return "No traces found\n"
+
+    cached = 0
+    stores = {}
+    for rec in records:
+        cached += rec[KEY_CACHED]
+        for store, usecs, chunks, pattern in rec[KEY_STEPS]:
+            if store not in stores:
+                stores[store] = [0, 0, 0]
+
+            stores[store][0] += 1
+            stores[store][1] += usecs
+            stores[store][2] += int(pattern is not None)
+
+    ret = "%d traces, %d served from cache\n\n" % (len(records), cached)
+    ret += "%-40s %8s %12s %10s %8s\n" % ("store", "tries", "total (us)", "mean (us)", "matches")
+
+    for store in sorted(stores, key=lambda s: stores[s][1], reverse=True):
+        tries, usecs, matches = stores[store]
+        ret += ("%-40s %8d %12d %10.1f %8d\n"
+                % (store, tries, usecs, float(usecs) / tries, matches))
+
+    slowest = sorted(records, key=lambda r: r[KEY_LOOKUP_US] + r[KEY_FORMAT_US],
+                     reverse=True)[:num_slowest]
+
+    ret += "\nSlowest %d traces:\n" % len(slowest)
+    for rec in slowest:
+        ret += ('\n%s  bot=%s  lookup=%dus  format=%dus%s\n  "%s"\n  context: %s -> %s\n'
+                % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rec[KEY_TIME])),
+                   rec[KEY_BOT], rec[KEY_LOOKUP_US], rec[KEY_FORMAT_US],
+                   "  (cached)" if rec[KEY_CACHED] else "", rec[KEY_TEXT],
+                   rec[KEY_START_CONTEXT], rec[KEY_END_CONTEXT]))
+
+        for store, usecs, chunks, pattern in rec[KEY_STEPS]:
+            matched = "" if pattern is None else '  matched "%s"' % pattern
+            ret += ("    %-36s %8dus  %d chunk(s)%s\n" % (store, usecs, chunks, matched))
+
+    return ret
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize response lookup traces")
+    parser.add_argument('filename', help="Trace file to read (rotated backups of "
+                        "this file are also read)")
+    parser.add_argument('-n', '--num', type=int, default=10,
+                        help="Number of slowest traces to show")
+    parser.add_argument('-b', '--bot', default=None,
+                        help="Only show traces for the bot with this name")
+    args = parser.parse_args()
+
+    records = read_traces(args.filename)
+    if args.bot is not None:
+        records = [r for r in records if r[KEY_BOT] == args.bot]
+
+    print(summarize(records, args.num))
+
+if __name__ == "__main__":
+    main()
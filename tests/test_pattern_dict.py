@@ -0,0 +1,60 @@
+import unittest
+
+from chatbot_builder.pattern_dict import PatternDict
+from chatbot_builder import constants as const
+
+class TestPatternDict(unittest.TestCase):
+    def setUp(self):
+        self.d = PatternDict()
+        self.d.adaptive = True
+        for i in range(10):
+            self.d["w%d" % i] = "v%d" % i
+
+        # Matching only the last pattern moves it to the front
+        for _ in range(const.PATTERN_REORDER_INTERVAL):
+            self.d.lookup("w9")
+
+        self.assertIsNotNone(self.d.match_order)
+        self.frozen = self.d.frozen()
+
+    def assertRemoved(self, pattern, remaining):
+        self.assertIsNone(self.d.match_order)
+        self.assertIsNone(self.d.lookup(pattern))
+        self.assertEqual(len(self.d.patterns), remaining)
+
+        for p, v in self.d.iteritems():
+            self.assertEqual(self.d.lookup(p)[1], v)
+
+        frozen = self.d.frozen()
+        self.assertIsNot(frozen, self.frozen)
+        self.assertIsNone(frozen.lookup(pattern))
+
+    def test_delitem(self):
+        del self.d["w0"]
+        self.assertRemoved("w0", 9)
+        self.assertEqual(self.d.lookup("w4")[1], "v4")
+
+    def test_delitem_missing(self):
+        with self.assertRaises(KeyError):
+            del self.d["nothing"]
+
+    def test_pop(self):
+        self.assertEqual(self.d.pop("w9"), "v9")
+        self.assertRemoved("w9", 9)
+        self.assertNotIn("g10", self.d.hits)
+
+    def test_pop_missing(self):
+        self.assertRaises(KeyError, self.d.pop, "nothing")
+
+    def test_clear(self):
+        self.d.clear()
+        self.assertRemoved("w9", 0)
+        self.assertEqual(self.d.hits, {})
+
+    def test_load_from_dict(self):
+        self.d.load_from_dict({"x": "1", "y": "2"})
+        self.assertRemoved("w9", 2)
+        self.assertEqual(self.d.lookup("y")[1], "2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+from unittest import mock
+
+from chatbot_builder import regex_lint
+
+class TestRegexLint(unittest.TestCase):
+    def assertExponential(self, pattern):
+        findings = regex_lint.find_risky_constructs(pattern)
+        self.assertIn(regex_lint.SEVERITY_EXPONENTIAL, [f.severity for f in findings],
+                      pattern)
+
+    def assertNotExponential(self, pattern):
+        findings = regex_lint.find_risky_constructs(pattern)
+        self.assertNotIn(regex_lint.SEVERITY_EXPONENTIAL, [f.severity for f in findings],
+                         pattern)
+
+    def test_nested_repeats(self):
+        for pattern in ["(a+)+$", "(a*)*", "(\\w+\\s?)+$", "(a|aa)+$"]:
+            self.assertExponential(pattern)
+
+    def test_identical_alternatives(self):
+        # The parser factors these into a common prefix followed by a branch
+        # with empty alternatives, e.g. (a|a) becomes a(|)
+        for pattern in ["(a|a)*b", "(foo|foo)+x", "((a|a)b)*c", "(a(|))*b"]:
+            self.assertExponential(pattern)
+
+    def test_common_prefix_alternatives(self):
+        for pattern in ["(ab|a)*c", "(a|ab)*c", "(x|y)*z", "(hello|hi) there", "(a|a)b"]:
+            self.assertNotExponential(pattern)
+
+    def test_check_pattern_rejects(self):
+        pattern, error, _ = regex_lint.check_pattern("(a|a)*b", regex_lint.POLICY_REJECT)
+        self.assertIsNone(pattern)
+        self.assertTrue(error.startswith("Pattern rejected"))
+
+    def test_check_pattern_invalid(self):
+        for pattern in ["(a", "(?<=a*)b", "a{99999999999}"]:
+            self.assertEqual(regex_lint.check_pattern(pattern),
+                             (None, "Invalid regular expression", None))
+
+    def test_check_pattern_analyzer_error(self):
+        # Errors in the checker itself are not reported as invalid patterns
+        with mock.patch.object(regex_lint, "lint_pattern", side_effect=ValueError("bug")):
+            self.assertRaises(ValueError, regex_lint.check_pattern, "hello")
+
+if __name__ == "__main__":
+    unittest.main()
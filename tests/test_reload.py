@@ -0,0 +1,75 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from chatbot_builder.bot_builder_cli import BotBuilderCLI
+
+class TestReload(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "bot.json")
+        self.cli = BotBuilderCLI(self.filename, load_compiled=False)
+
+        self.cmd('%new a')
+        self.cmd('%entry "go a" "in a"')
+        self.cmd('%set x ax')
+        self.cmd('%new b')
+        self.cmd('%entry "go b" "in b"')
+        self.cmd('%on "show" "x={x}"')
+        self.cmd('%on "s.*" "shadowing"')
+        self.cmd('%on "shadowed" "never"')
+        self.cmd('%new unreachable')
+        self.cmd('%save')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def cmd(self, text):
+        # Commands that access the disk are rate limited
+        self.cli.last_file_access_time = 0
+        return self.cli.process_message(text)
+
+    def reload(self):
+        # Change only the main context, so every context is kept
+        with open(self.filename, 'r') as fh:
+            attrs = json.load(fh)
+
+        attrs["responses"]["hello"] = "hi"
+        with open(self.filename, 'w') as fh:
+            json.dump(attrs, fh)
+
+        self.cli.file_signature = None
+        self.assertTrue(self.cli.prepare_reload())
+        self.assertTrue(self.cli.apply_pending_reload())
+
+    def test_reload_keeps_parent_links(self):
+        a = self.cli.builder.find_context("a")
+        b = self.cli.builder.find_context("a::b")
+
+        self.reload()
+
+        self.assertIs(self.cli.builder.find_context("a"), a)
+        self.assertIs(self.cli.builder.find_context("a::b"), b)
+        self.assertIs(b.parent, a)
+        self.assertIsNone(a.parent)
+
+        self.assertEqual(self.cli.process_message("hello"), "hi")
+        self.assertEqual(self.cli.process_message("go a"), "in a")
+        self.assertEqual(self.cli.process_message("go b"), "in b")
+        self.assertEqual(self.cli.process_message("show"), "x=ax")
+
+    def test_prune_after_reload(self):
+        self.reload()
+
+        self.assertTrue(self.cmd('%prune').startswith("Deleted 1 pattern(s) and 1 context(s)"))
+        self.assertIsNone(self.cli.builder.find_context("a::b::unreachable"))
+
+        self.cmd('%undo')
+        b = self.cli.builder.find_context("a::b")
+        self.assertIn("shadowed", [p for p, _ in b.responses.iteritems()])
+        self.assertIs(self.cli.builder.find_context("a::b::unreachable").parent, b)
+
+if __name__ == "__main__":
+    unittest.main()
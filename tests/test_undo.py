@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from chatbot_builder.bot_builder_cli import BotBuilderCLI
+
+class TestUndo(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cli = BotBuilderCLI(os.path.join(self.tempdir, "bot.json"), load_compiled=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def cmd(self, text):
+        # Commands that access the disk are rate limited
+        self.cli.last_file_access_time = 0
+        return self.cli.process_message(text)
+
+    def test_drop_after_undo_past_save(self):
+        self.cmd('%on "one" "1"')
+        self.cmd('%on "two" "2"')
+        self.cmd('%save')
+        self.cmd('%undo 2')
+        self.cmd('%on "three" "3"')
+        self.cmd('%on "four" "4"')
+
+        self.assertTrue(self.cli.builder.has_unsaved_changes())
+
+        self.cmd('%drop')
+        self.assertEqual(self.cli.process_message("one"), "1")
+        self.assertEqual(self.cli.process_message("two"), "2")
+        self.assertIsNone(self.cli.process_message("three"))
+        self.assertIsNone(self.cli.process_message("four"))
+        self.assertFalse(self.cli.builder.has_unsaved_changes())
+
+    def test_undo_context_keeps_editing_context(self):
+        self.cmd('%new a')
+        self.cmd('%unload')
+        self.cmd('%new b')
+        self.cmd('%load a')
+        self.cmd('%undo')
+
+        self.assertIs(self.cli.builder.editing_context, self.cli.builder.contexts["a"])
+
+    def test_drop_resets_assigned_variables(self):
+        self.cmd('%on "remember (.*)" "ok;;thing={p0}"')
+        self.cmd('%on "recall" "{thing}"')
+        self.cmd('%set thing nothing')
+        self.cmd('%save')
+        self.cmd('remember cats')
+        self.assertEqual(self.cli.process_message("recall"), "cats")
+
+        self.cmd('%drop')
+        self.assertEqual(self.cli.process_message("recall"), "nothing")
+
+        # Undo of the %set before the save still applies to the same variables
+        self.cmd('%undo')
+        self.assertNotIn("thing", self.cli.builder.variables)
+
+if __name__ == "__main__":
+    unittest.main()